@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+'''Benchmarks for euclid.
+
+Run the suite, printing operations per second and allocations per
+operation, and optionally save the results as a JSON baseline::
+
+    python bench_euclid.py run [--filter TEXT] [--min-time S] [--output FILE]
+
+Compare a baseline with a saved run, or with a fresh run of the same
+benchmarks.  The exit status is 1 if any benchmark is slower than the
+baseline by more than the threshold (a fraction), or allocates more::
+
+    python bench_euclid.py compare BASELINE [CURRENT] [--threshold 0.1]
+
+Thread scaling of the batch kernels::
+
+    python bench_euclid.py threads [--points N] [--workers 1,2,4,8]
+
+Run it under both a standard and a free-threaded (3.13t or later) build of
+CPython to compare; the header line reports whether the GIL is enabled and
+whether NumPy was found.
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+
+import euclid as eu
+
+SHAPES_2D = ('Point2', 'Line2', 'Ray2', 'LineSegment2', 'Circle', 'Polygon2',
+             'AABB2')
+SHAPES_3D = ('Point3', 'Line3', 'Ray3', 'LineSegment3', 'Sphere', 'Plane',
+             'TriangleMesh3', 'AABB3', 'OBB3')
+
+def gil_enabled():
+    '''True if the interpreter runs with a GIL.'''
+    is_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_enabled() if is_enabled is not None else True
+
+def sample_shapes(offset=0.):
+    '''One instance of each shape type, by class name.
+
+    The shapes overlap each other.  Shapes with different offsets are
+    apart, and in that case the 2D lines are all parallel, as lines
+    crossing each other cannot be connected.
+    '''
+    def P2(x, y):
+        return eu.Point2(x, y + offset)
+    def P3(x, y, z):
+        return eu.Point3(x, y, z + offset)
+    if offset:
+        rays = (P2(-1., 0.), P2(2., 2.))
+        segment = (P2(-0.5, -1.), P2(2.5, 1.))
+    else:
+        rays = (P2(-1., 0.), P2(2., 1.))
+        segment = (P2(-0.5, 1.5), P2(1.5, -0.5))
+    return {
+        'Point2': P2(0.5, 0.25),
+        'Line2': eu.Line2(P2(-1., -0.5), P2(2., 1.5)),
+        'Ray2': eu.Ray2(*rays),
+        'LineSegment2': eu.LineSegment2(*segment),
+        'Circle': eu.Circle(P2(0.5, 0.5), 0.75),
+        'Polygon2': eu.Polygon2([P2(0., 0.), P2(1., 0.), P2(1.2, 0.8),
+                                 P2(0.4, 1.1)]),
+        'AABB2': eu.AABB2(P2(0.25, 0.), P2(1., 0.75)),
+        'Point3': P3(0.5, 0.25, 0.5),
+        'Line3': eu.Line3(P3(-1., -0.5, 0.), P3(2., 1.5, 1.)),
+        'Ray3': eu.Ray3(P3(-1., 0., 0.5), P3(2., 1., 0.5)),
+        'LineSegment3': eu.LineSegment3(P3(-0.5, 1.5, 0.), P3(1.5, -0.5, 1.)),
+        'Sphere': eu.Sphere(P3(0.5, 0.5, 0.5), 0.75),
+        'Plane': eu.Plane(P3(0., 0., 0.4), eu.Vector3(0.1, 0.2, 1.)),
+        'TriangleMesh3': eu.TriangleMesh3(
+            [P3(0., 0., 0.), P3(1., 0., 0.), P3(0., 1., 0.), P3(0., 0., 1.)],
+            [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]),
+        'AABB3': eu.AABB3(P3(0.25, 0., 0.), P3(1., 0.75, 1.)),
+        'OBB3': eu.OBB3(P3(0.5, 0.5, 0.5),
+                        [eu.Vector3(1., 1., 0.).normalized(),
+                         eu.Vector3(-1., 1., 0.).normalized(),
+                         eu.Vector3(0., 0., 1.)], (0.5, 0.3, 0.4)),
+    }
+
+def _arithmetic():
+    v2 = eu.Vector2(1., 2.)
+    w2 = eu.Vector2(3., -1.)
+    v3 = eu.Vector3(1., 2., 3.)
+    w3 = eu.Vector3(3., -1., 0.5)
+    p2 = eu.Point2(1., 2.)
+    p3 = eu.Point3(1., 2., 3.)
+    m3 = eu.Matrix3.new_rotate(0.3)
+    m3.translate(1., 2.)
+    n3 = eu.Matrix3.new_scale(2., 3.)
+    m4 = eu.Matrix4.new_rotate_axis(0.3, eu.Vector3(1., 2., 3.))
+    m4.translate(1., 2., 3.)
+    n4 = eu.Matrix4.new_perspective(1., 1.5, 0.1, 100.)
+    q = eu.Quaternion.new_rotate_axis(0.3, eu.Vector3(1., 2., 3.))
+    r = eu.Quaternion.new_rotate_axis(1.2, eu.Vector3(-1., 0., 1.))
+    return [
+        ('Vector2 + Vector2', lambda: v2 + w2),
+        ('Vector2 - Vector2', lambda: v2 - w2),
+        ('Vector2 * float', lambda: v2 * 2.5),
+        ('Vector2.dot', lambda: v2.dot(w2)),
+        ('Vector2.normalized', lambda: v2.normalized()),
+        ('Vector3 + Vector3', lambda: v3 + w3),
+        ('Vector3 - Vector3', lambda: v3 - w3),
+        ('Vector3 * float', lambda: v3 * 2.5),
+        ('Vector3.dot', lambda: v3.dot(w3)),
+        ('Vector3.cross', lambda: v3.cross(w3)),
+        ('Vector3.normalized', lambda: v3.normalized()),
+        ('Matrix3 * Matrix3', lambda: m3 * n3),
+        ('Matrix3 * Point2', lambda: m3 * p2),
+        ('Matrix3.inverse', lambda: m3.inverse()),
+        ('Matrix4 * Matrix4', lambda: m4 * n4),
+        ('Matrix4 * Point3', lambda: m4 * p3),
+        ('Matrix4 * Vector3', lambda: m4 * v3),
+        ('Matrix4.transform', lambda: m4.transform(p3)),
+        ('Matrix4.inverse', lambda: m4.inverse()),
+        ('Quaternion * Quaternion', lambda: q * r),
+        ('Quaternion * Vector3', lambda: q * v3),
+        ('Quaternion.new_interpolate',
+         lambda: eu.Quaternion.new_interpolate(q, r, 0.3)),
+    ]
+
+def _pairs(operation, functions, offset):
+    shapes_a = sample_shapes()
+    shapes_b = sample_shapes(offset)
+    out = []
+    for names in (SHAPES_2D, SHAPES_3D):
+        for name_a in names:
+            for name_b in names:
+                a = shapes_a[name_a]
+                b = shapes_b[name_b]
+                if eu._registered(functions, a, b) is None:
+                    continue
+                method = getattr(a, operation)
+                out.append(('%s %s %s' % (operation, name_a, name_b),
+                            lambda method=method, b=b: method(b)))
+    return out
+
+def benchmarks():
+    '''All benchmarks, as a list of (name, function of no arguments).
+
+    Every pair of shape types supported by intersect and connect is
+    included, called through the shapes' methods: intersect on overlapping
+    shapes and connect on shapes set apart.
+    '''
+    return _arithmetic() + \
+        _pairs('intersect', eu._intersect_functions, 0.) + \
+        _pairs('connect', eu._connect_functions, 3.)
+
+def measure(function, min_time=0.1, repeat=3):
+    '''Best rate of calls to function, in operations per second.'''
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 0.01:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / repeat / elapsed))
+    return number / min(timer.repeat(repeat, number))
+
+def allocations(function, number=100):
+    '''Memory blocks and bytes allocated by euclid per call to function,
+    and still held by the result.'''
+    import tracemalloc
+    results = [None] * number
+    function()
+    only_euclid = [tracemalloc.Filter(True, eu.__file__)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(only_euclid)
+        for i in range(number):
+            results[i] = function()
+        after = tracemalloc.take_snapshot().filter_traces(only_euclid)
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum([s.count_diff for s in stats])
+    size = sum([s.size_diff for s in stats])
+    return blocks / float(number), size / float(number)
+
+def run(pattern=None, min_time=0.1, names=None, report=None):
+    '''Run the benchmarks whose names contain pattern (and are in names,
+    if given).  Returns the results in the form saved as a baseline.'''
+    results = {}
+    for name, function in benchmarks():
+        if pattern and pattern not in name:
+            continue
+        if names is not None and name not in names:
+            continue
+        blocks, size = allocations(function)
+        results[name] = {
+            'ops_per_sec': measure(function, min_time),
+            'blocks_per_op': blocks,
+            'bytes_per_op': size,
+        }
+        if report:
+            report(name, results[name])
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def compare(baseline, current, threshold=0.1):
+    '''Compare two runs benchmark by benchmark.
+
+    Returns a list of (name, speed ratio, change in blocks per op,
+    status), where the ratio is current over baseline operations per
+    second, and status is 'slower', 'allocates' (more), 'faster' or 'ok'.
+    '''
+    rows = []
+    base = baseline['results']
+    new = current['results']
+    for name in sorted(set(base) & set(new)):
+        ratio = new[name]['ops_per_sec'] / base[name]['ops_per_sec']
+        blocks = new[name]['blocks_per_op'] - base[name]['blocks_per_op']
+        if ratio < 1 - threshold:
+            status = 'slower'
+        elif blocks > 0.5:
+            status = 'allocates'
+        elif ratio > 1 + threshold:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, ratio, blocks, status))
+    return rows
+
+def _best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def _scene(points, seed=0):
+    rnd = random.Random(seed)
+    def point():
+        return eu.Point3(*[rnd.uniform(-10, 10) for i in range(3)])
+    return {
+        'points': eu.pack_points3([point() for i in range(points)]),
+        'lines': eu.pack_lines3([eu.Ray3(point(), point())
+                                 for i in range(points // 10)]),
+        'spheres': eu.pack_spheres([eu.Sphere(point(), rnd.uniform(0.5, 2))
+                                    for i in range(16)]),
+        'matrix': eu.Matrix4.new_rotate_axis(0.5, eu.Vector3(1, 1, 0)),
+    }
+
+def bench_threads(points=200000, workers=(1, 2, 4, 8), repeat=3,
+                  use_numpy=None):
+    '''Time each batch kernel on a ThreadedExecutor for each number of
+    workers.  Returns a list of (kernel, workers, seconds, speedup).'''
+    scene = _scene(points)
+    cases = [
+        ('transform_points', (scene['points'], scene['matrix'])),
+        ('distance_points_spheres', (scene['points'], scene['spheres'])),
+        ('intersect_lines_spheres', (scene['lines'], scene['spheres'])),
+    ]
+    results = []
+    for name, args in cases:
+        base = None
+        for n in workers:
+            with eu.ThreadedExecutor(n, use_numpy=use_numpy) as executor:
+                method = getattr(executor, name)
+                method(*args)
+                seconds = _best(lambda: method(*args), repeat)
+            if base is None:
+                base = seconds
+            results.append((name, n, seconds, base / seconds))
+    return results
+
+def _print_result(name, result):
+    print('%-36s %12.0f ops/s %6.1f blocks %8.1f bytes' % (
+        name, result['ops_per_sec'], result['blocks_per_op'],
+        result['bytes_per_op']))
+
+def _load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--filter', default=None)
+    run_parser.add_argument('--min-time', type=float, default=0.1)
+    run_parser.add_argument('--output', default=None)
+    compare_parser = commands.add_parser(
+        'compare', help='compare with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current', nargs='?', default=None)
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    compare_parser.add_argument('--min-time', type=float, default=0.1)
+    threads = commands.add_parser('threads',
+                                  help='thread scaling of batch kernels')
+    threads.add_argument('--points', type=int, default=200000)
+    threads.add_argument('--workers', default='1,2,4,8')
+    threads.add_argument('--repeat', type=int, default=3)
+    threads.add_argument('--no-numpy', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.filter, args.min_time, report=_print_result)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+    elif args.command == 'compare':
+        baseline = _load(args.baseline)
+        if args.current:
+            current = _load(args.current)
+        else:
+            current = run(min_time=args.min_time,
+                          names=set(baseline['results']))
+        rows = compare(baseline, current, args.threshold)
+        for name, ratio, blocks, status in rows:
+            print('%-36s %6.2fx %+6.1f blocks  %s' % (
+                name, ratio, blocks, status))
+        regressions = [row for row in rows
+                       if row[3] in ('slower', 'allocates')]
+        print('%d benchmarks, %d regressions' % (len(rows), len(regressions)))
+        return regressions and 1 or 0
+    elif args.command == 'threads':
+        use_numpy = False if args.no_numpy else None
+        print('Python %s, GIL %s, NumPy %s' % (
+            sys.version.split()[0],
+            gil_enabled() and 'enabled' or 'disabled',
+            eu._numpy() is not None and use_numpy is None and 'used' or
+            'not used'))
+        workers = [int(n) for n in args.workers.split(',')]
+        for name, n, seconds, speedup in bench_threads(
+                args.points, workers, args.repeat, use_numpy):
+            print('%-26s %3d threads %10.4f s %6.2fx' % (
+                name, n, seconds, speedup))
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
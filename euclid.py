@@ -38,8 +38,12 @@ else:
 __docformat__ = 'restructuredtext'
 version = '0.2.0'
 
+import array
+import bisect
+import itertools
 import math
 import operator
+import random
 import types
 
 
@@ -1572,34 +1576,380 @@ class Quaternion(Slotted):
         return Q
     new_interpolate = classmethod(new_interpolate)
 
+# Robust predicates
+# Adaptive precision floating point after Jonathan Shewchuk, "Adaptive
+# Precision Floating-Point Arithmetic and Fast Robust Geometric Predicates".
+# Each predicate is first evaluated with ordinary floats; only when the
+# result is smaller than its forward error bound is it recomputed exactly
+# with floating point expansions.
+# ---------------------------------------------------------------------------
+
+_epsilon = 2.0 ** -53
+_splitter = 2.0 ** 27 + 1.0
+_ccwerrboundA = (3.0 + 16.0 * _epsilon) * _epsilon
+_iccerrboundA = (10.0 + 96.0 * _epsilon) * _epsilon
+
+def _two_sum(a, b):
+    x = a + b
+    bv = x - a
+    av = x - bv
+    return x, (a - av) + (b - bv)
+
+def _split(a):
+    c = _splitter * a
+    hi = c - (c - a)
+    return hi, a - hi
+
+def _two_product(a, b):
+    x = a * b
+    ahi, alo = _split(a)
+    bhi, blo = _split(b)
+    err = x - ahi * bhi - alo * bhi - ahi * blo
+    return x, alo * blo - err
+
+def _grow_expansion(e, b):
+    # e is a nonoverlapping expansion, least significant component first
+    h = []
+    q = b
+    for component in e:
+        q, hh = _two_sum(q, component)
+        if hh:
+            h.append(hh)
+    if q or not h:
+        h.append(q)
+    return h
+
+def _expansion_sum(e, f):
+    for component in f:
+        e = _grow_expansion(e, component)
+    return e
+
+def _scale_expansion(e, b):
+    h = []
+    bhi, blo = _split(b)
+    q = 0.0
+    for component in e:
+        x = component * b
+        chi, clo = _split(component)
+        y = clo * blo - (x - chi * bhi - clo * bhi - chi * blo)
+        q, hh = _two_sum(q, y)
+        if hh:
+            h.append(hh)
+        q, hh = _two_sum(q, x)
+        if hh:
+            h.append(hh)
+    if q or not h:
+        h.append(q)
+    return h
+
+def _expansion_product(e, f):
+    result = [0.0]
+    for component in f:
+        result = _expansion_sum(result, _scale_expansion(e, component))
+    return result
+
+def _expansion_diff(a, b):
+    # exact a - b as a two component expansion
+    x, y = _two_sum(a, -b)
+    return [y, x]
+
+def _expansion_negate(e):
+    return [-component for component in e]
+
+def _expansion_sign(e):
+    for component in reversed(e):
+        if component > 0:
+            return 1
+        elif component < 0:
+            return -1
+    return 0
+
+def _expansion_estimate(e):
+    return sum(e)
+
+def _orient2d_exact(ax, ay, bx, by, cx, cy):
+    acx = _expansion_diff(ax, cx)
+    acy = _expansion_diff(ay, cy)
+    bcx = _expansion_diff(bx, cx)
+    bcy = _expansion_diff(by, cy)
+    return _expansion_sum(_expansion_product(acx, bcy),
+                          _expansion_negate(_expansion_product(acy, bcx)))
+
+def _orient2d(ax, ay, bx, by, cx, cy):
+    detleft = (ax - cx) * (by - cy)
+    detright = (ay - cy) * (bx - cx)
+    det = detleft - detright
+    if detleft > 0:
+        if detright <= 0:
+            return det
+        detsum = detleft + detright
+    elif detleft < 0:
+        if detright >= 0:
+            return det
+        detsum = -detleft - detright
+    else:
+        return det
+    if abs(det) >= _ccwerrboundA * detsum:
+        return det
+    return _expansion_estimate(_orient2d_exact(ax, ay, bx, by, cx, cy))
+
+def _incircle_exact(ax, ay, bx, by, cx, cy, dx, dy):
+    adx = _expansion_diff(ax, dx)
+    ady = _expansion_diff(ay, dy)
+    bdx = _expansion_diff(bx, dx)
+    bdy = _expansion_diff(by, dy)
+    cdx = _expansion_diff(cx, dx)
+    cdy = _expansion_diff(cy, dy)
+
+    def lift(x, y):
+        return _expansion_sum(_expansion_product(x, x),
+                              _expansion_product(y, y))
+
+    def cross(x1, y1, x2, y2):
+        return _expansion_sum(_expansion_product(x1, y2),
+                              _expansion_negate(_expansion_product(y1, x2)))
+
+    det = _expansion_product(lift(adx, ady), cross(bdx, bdy, cdx, cdy))
+    det = _expansion_sum(det, _expansion_product(lift(bdx, bdy),
+                                                 cross(cdx, cdy, adx, ady)))
+    det = _expansion_sum(det, _expansion_product(lift(cdx, cdy),
+                                                 cross(adx, ady, bdx, bdy)))
+    return det
+
+def _incircle(ax, ay, bx, by, cx, cy, dx, dy):
+    adx = ax - dx
+    bdx = bx - dx
+    cdx = cx - dx
+    ady = ay - dy
+    bdy = by - dy
+    cdy = cy - dy
+
+    bdxcdy = bdx * cdy
+    cdxbdy = cdx * bdy
+    alift = adx * adx + ady * ady
+
+    cdxady = cdx * ady
+    adxcdy = adx * cdy
+    blift = bdx * bdx + bdy * bdy
+
+    adxbdy = adx * bdy
+    bdxady = bdx * ady
+    clift = cdx * cdx + cdy * cdy
+
+    det = alift * (bdxcdy - cdxbdy) + \
+          blift * (cdxady - adxcdy) + \
+          clift * (adxbdy - bdxady)
+    permanent = (abs(bdxcdy) + abs(cdxbdy)) * alift + \
+                (abs(cdxady) + abs(adxcdy)) * blift + \
+                (abs(adxbdy) + abs(bdxady)) * clift
+    if abs(det) > _iccerrboundA * permanent:
+        return det
+    return _expansion_estimate(
+        _incircle_exact(ax, ay, bx, by, cx, cy, dx, dy))
+
+def orient2d(a, b, c):
+    '''Return a positive value if the points a, b and c occur in
+    counterclockwise order, a negative value if they occur in clockwise
+    order and zero if they are collinear.
+
+    The sign of the result is always correct; the magnitude approximates
+    twice the signed area of the triangle abc.
+    '''
+    return _orient2d(a.x, a.y, b.x, b.y, c.x, c.y)
+
+def incircle(a, b, c, d):
+    '''Return a positive value if d lies inside the circle passing through
+    a, b and c, a negative value if it lies outside and zero if the four
+    points are cocircular.  The points a, b and c must occur in
+    counterclockwise order, or the sign of the result is reversed.
+    '''
+    return _incircle(a.x, a.y, b.x, b.y, c.x, c.y, d.x, d.y)
+
+# Point collections
+# Functions working on many points accept either a sequence of points
+# (or 2- and 3-tuples) or a flat buffer of coordinates such as
+# array.array('d', [x0, y0, x1, y1, ...]).
+# ---------------------------------------------------------------------------
+
+def _coords2(points):
+    if not hasattr(points, '__len__'):
+        points = list(points)
+    if len(points) and isinstance(points[0], numbers.Real):
+        return list(points[0::2]), list(points[1::2])
+    try:
+        return [p.x for p in points], [p.y for p in points]
+    except AttributeError:
+        return [p[0] for p in points], [p[1] for p in points]
+
+def _records(buffer, size):
+    # Tuples of size values from a flat buffer holding whole records
+    if not hasattr(buffer, '__len__'):
+        buffer = list(buffer)
+    if len(buffer) % size:
+        raise AttributeError('Buffer of %d values does not hold records of '
+                             '%d values' % (len(buffer), size))
+    it = iter(buffer)
+    return zip(*[it] * size)
+
+def _coords3(points):
+    if not hasattr(points, '__len__'):
+        points = list(points)
+    if len(points) and isinstance(points[0], numbers.Real):
+        return list(points[0::3]), list(points[1::3]), list(points[2::3])
+    try:
+        return [p.x for p in points], [p.y for p in points], \
+               [p.z for p in points]
+    except AttributeError:
+        return [p[0] for p in points], [p[1] for p in points], \
+               [p[2] for p in points]
+
+def _dist2(a, b):
+    return sum([(x - y) ** 2 for x, y in zip(a, b)])
+
+def _ritter_ball(pts):
+    # Ritter's approximate bounding ball: start from a roughly diametral
+    # pair, then grow the ball just enough to cover each outlying point.
+    p = pts[0]
+    q = max(pts, key=lambda s: _dist2(s, p))
+    p = max(pts, key=lambda s: _dist2(s, q))
+    c = tuple([(x + y) / 2 for x, y in zip(p, q)])
+    r = math.sqrt(_dist2(p, q)) / 2
+    r2 = r * r
+    for s in pts:
+        d2 = _dist2(s, c)
+        if d2 > r2:
+            d = math.sqrt(d2)
+            f = (d - r) / (2 * d)
+            r = (r + d) / 2
+            r2 = r * r
+            c = tuple([x + (y - x) * f for x, y in zip(c, s)])
+    return c, r2
+
+def _ball_through2(pts):
+    # Smallest circle with 1 to 3 points on its boundary, as (center, r**2),
+    # or None if three points are collinear.
+    ax, ay = pts[0]
+    if len(pts) == 1:
+        return (ax, ay), 0.
+    if len(pts) == 2:
+        c = ((ax + pts[1][0]) / 2, (ay + pts[1][1]) / 2)
+        return c, _dist2(c, pts[0])
+    bx, by = pts[1][0] - ax, pts[1][1] - ay
+    cx, cy = pts[2][0] - ax, pts[2][1] - ay
+    d = 2 * (bx * cy - by * cx)
+    if d == 0:
+        return None
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (cy * b2 - by * c2) / d
+    uy = (bx * c2 - cx * b2) / d
+    return (ax + ux, ay + uy), ux * ux + uy * uy
+
+def _ball_through3(pts):
+    # Smallest sphere with 1 to 4 points on its boundary, as (center, r**2),
+    # or None if the points are collinear (three) or coplanar (four).
+    ax, ay, az = pts[0]
+    if len(pts) == 1:
+        return (ax, ay, az), 0.
+    if len(pts) == 2:
+        c = tuple([(x + y) / 2 for x, y in zip(pts[0], pts[1])])
+        return c, _dist2(c, pts[0])
+    b = Vector3(pts[1][0] - ax, pts[1][1] - ay, pts[1][2] - az)
+    c = Vector3(pts[2][0] - ax, pts[2][1] - ay, pts[2][2] - az)
+    if len(pts) == 3:
+        n = b.cross(c)
+        d = 2 * n.magnitude_squared()
+        if d == 0:
+            return None
+        u = (c * b.magnitude_squared() - b * c.magnitude_squared()).cross(n)
+    else:
+        e = Vector3(pts[3][0] - ax, pts[3][1] - ay, pts[3][2] - az)
+        d = 2 * b.dot(c.cross(e))
+        if d == 0:
+            return None
+        u = c.cross(e) * b.magnitude_squared() + \
+            e.cross(b) * c.magnitude_squared() + \
+            b.cross(c) * e.magnitude_squared()
+    u /= d
+    return (ax + u.x, ay + u.y, az + u.z), u.magnitude_squared()
+
+def _ball_outside(p, ball):
+    return ball is None or _dist2(p, ball[0]) > ball[1] * (1 + 1e-12)
+
+def _ball_on(fixed, through):
+    ball = through(fixed)
+    if ball is None:
+        # Degenerate support set; the smallest ball through a subset that
+        # still covers the rest is the answer.
+        for n in range(2, len(fixed)):
+            for sub in itertools.combinations(fixed, n):
+                b = through(list(sub))
+                if b is not None and not [p for p in fixed
+                                          if _ball_outside(p, b)]:
+                    if ball is None or b[1] < ball[1]:
+                        ball = b
+    return ball
+
+def _welzl_ball(pts, n, fixed, through, limit):
+    # Smallest ball containing pts[:n] with the points of fixed on its
+    # boundary.  Recursion only goes as deep as the number of support points.
+    ball = fixed and _ball_on(fixed, through) or None
+    if len(fixed) == limit:
+        return ball
+    for i in range(n):
+        if _ball_outside(pts[i], ball):
+            ball = _welzl_ball(pts, i, fixed + [pts[i]], through, limit)
+    return ball
+
+def _bounding_ball(pts, exact, through, limit):
+    assert pts, 'No points given'
+    if not exact:
+        return _ritter_ball(pts)
+    # Welzl's algorithm runs in expected linear time on shuffled input.
+    pts = list(pts)
+    random.Random(len(pts)).shuffle(pts)
+    return _welzl_ball(pts, len(pts), [], through, limit)
+
 # Geometry
 # Much maths thanks to Paul Bourke, http://astronomy.swin.edu.au/~pbourke
 # ---------------------------------------------------------------------------
 
 class Geometry(object):
     def _connect_unimplemented(self, other):
+        function = _registered(_connect_functions, other, self)
+        if function:
+            return function(other, self)
         raise AttributeError('Cannot connect %s to %s' % \
             (self.__class__, other.__class__))
 
     def _intersect_unimplemented(self, other):
+        function = _registered(_intersect_functions, other, self)
+        if function:
+            return function(other, self)
         raise AttributeError('Cannot intersect %s and %s' % \
             (self.__class__, other.__class__))
 
     _intersect_point2 = _intersect_unimplemented
     _intersect_line2 = _intersect_unimplemented
     _intersect_circle = _intersect_unimplemented
+    _intersect_polygon2 = _intersect_unimplemented
+    _intersect_aabb2 = _intersect_unimplemented
     _connect_point2 = _connect_unimplemented
     _connect_line2 = _connect_unimplemented
     _connect_circle = _connect_unimplemented
+    _connect_polygon2 = _connect_unimplemented
+    _connect_aabb2 = _connect_unimplemented
 
     _intersect_point3 = _intersect_unimplemented
     _intersect_line3 = _intersect_unimplemented
     _intersect_sphere = _intersect_unimplemented
     _intersect_plane = _intersect_unimplemented
+    _intersect_aabb3 = _intersect_unimplemented
     _connect_point3 = _connect_unimplemented
     _connect_line3 = _connect_unimplemented
     _connect_sphere = _connect_unimplemented
     _connect_plane = _connect_unimplemented
+    _connect_aabb3 = _connect_unimplemented
 
     def intersect(self, other):
         raise NotImplementedError
@@ -1614,7 +1964,7 @@ class Geometry(object):
         return 0.0
 
 def _intersect_point2_circle(P, C):
-    return abs(P - C.c) <= C.r
+    return (P.x - C.c.x) ** 2 + (P.y - C.c.y) ** 2 <= C.r ** 2
     
 def _intersect_line2_line2(A, B):
     d = B.v.y * A.v.x - B.v.x * A.v.y
@@ -1633,20 +1983,98 @@ def _intersect_line2_line2(A, B):
     return Point2(A.p.x + ua * A.v.x,
                   A.p.y + ua * A.v.y)
 
-def _intersect_line2_circle(L, C):
-    a = L.v.magnitude_squared()
-    b = 2 * (L.v.x * (L.p.x - C.c.x) + \
-             L.v.y * (L.p.y - C.c.y))
-    c = C.c.magnitude_squared() + \
-        L.p.magnitude_squared() - \
-        2 * C.c.dot(L.p) - \
-        C.r ** 2
+def _robust_u_in(L, num_sign, over_sign):
+    # num_sign is the exact sign of u, over_sign the exact sign of u - 1;
+    # pass _u_in a representative value on the same side of 0 and 1.
+    if num_sign < 0:
+        u = -1.0
+    elif num_sign == 0:
+        u = 0.0
+    elif over_sign < 0:
+        u = 0.5
+    elif over_sign == 0:
+        u = 1.0
+    else:
+        u = 2.0
+    return L._u_in(u)
+
+def _intersect_line2_line2_robust(A, B):
+    # Same as _intersect_line2_line2, but the parallel test and the
+    # parameter range tests are exact.
+    t1 = B.v.y * A.v.x
+    t2 = B.v.x * A.v.y
+    d = t1 - t2
+    d_err = _ccwerrboundA * (abs(t1) + abs(t2))
+
+    dy = A.p.y - B.p.y
+    dx = A.p.x - B.p.x
+    t1 = B.v.x * dy
+    t2 = B.v.y * dx
+    na = t1 - t2
+    na_err = _ccwerrboundA * (abs(t1) + abs(t2))
+    t1 = A.v.x * dy
+    t2 = A.v.y * dx
+    nb = t1 - t2
+    nb_err = _ccwerrboundA * (abs(t1) + abs(t2))
+
+    if abs(d) > d_err and abs(na) > na_err and abs(nb) > nb_err and \
+       abs(d - na) > 2 * (d_err + na_err) and \
+       abs(d - nb) > 2 * (d_err + nb_err):
+        # Fast path: every sign is certain
+        ua = na / d
+        if not A._u_in(ua):
+            return None
+        if not B._u_in(nb / d):
+            return None
+        return Point2(A.p.x + ua * A.v.x,
+                      A.p.y + ua * A.v.y)
+
+    d_e = _expansion_sum(_two_product(A.v.x, B.v.y)[::-1],
+                         _expansion_negate(
+                             _two_product(A.v.y, B.v.x)[::-1]))
+    d_sign = _expansion_sign(d_e)
+    if d_sign == 0:
+        return None
+
+    dy_e = _expansion_diff(A.p.y, B.p.y)
+    dx_e = _expansion_diff(A.p.x, B.p.x)
+    na_e = _expansion_sum(_scale_expansion(dy_e, B.v.x),
+                          _expansion_negate(_scale_expansion(dx_e, B.v.y)))
+    nb_e = _expansion_sum(_scale_expansion(dy_e, A.v.x),
+                          _expansion_negate(_scale_expansion(dx_e, A.v.y)))
+    neg_d_e = _expansion_negate(d_e)
+    if not _robust_u_in(A, _expansion_sign(na_e) * d_sign,
+                        _expansion_sign(_expansion_sum(na_e, neg_d_e)) *
+                        d_sign):
+        return None
+    if not _robust_u_in(B, _expansion_sign(nb_e) * d_sign,
+                        _expansion_sign(_expansion_sum(nb_e, neg_d_e)) *
+                        d_sign):
+        return None
+
+    ua = _expansion_estimate(na_e) / _expansion_estimate(d_e)
+    return Point2(A.p.x + ua * A.v.x,
+                  A.p.y + ua * A.v.y)
+
+def _line2_circle_roots(px, py, vx, vy, cx, cy, r):
+    # Parameters u1 >= u2 at which p + u * v meets the circle, or None.
+    dx = px - cx
+    dy = py - cy
+    a = vx * vx + vy * vy
+    b = 2 * (vx * dx + vy * dy)
+    c = dx * dx + dy * dy - r * r
     det = b ** 2 - 4 * a * c
     if det < 0:
         return None
     sq = math.sqrt(det)
-    u1 = (-b + sq) / (2 * a)
-    u2 = (-b - sq) / (2 * a)
+    return (-b + sq) / (2 * a), (-b - sq) / (2 * a)
+
+def _intersect_line2_circle(L, C):
+    roots = _line2_circle_roots(L.p.x, L.p.y, L.v.x, L.v.y,
+                                C.c.x, C.c.y, C.r)
+    if roots is None:
+        return None
+    u1, u2 = roots
 
     if u1 * u2 > 0 and not L._u_in(u1) and not L._u_in(u2):
         return None
@@ -1666,6 +2094,70 @@ def _intersect_line2_circle(L, C):
                         Point2(L.p.x + u2 * L.v.x,
                                L.p.y + u2 * L.v.y))
 
+def _toi_disc(px, py, vx, vy, r):
+    # Earliest u in [0, 1] at which p + u * v comes within r of the origin.
+    if px * px + py * py <= r * r:
+        return 0.
+    if not (vx or vy):
+        return None
+    roots = _line2_circle_roots(px, py, vx, vy, 0., 0., r)
+    if roots is None or not 0 <= roots[1] <= 1:
+        return None
+    return roots[1]
+
+def _toi_circle_circle(ax, ay, ar, avx, avy, bx, by, br, bvx, bvy):
+    u = _toi_disc(ax - bx, ay - by, avx - bvx, avy - bvy, ar + br)
+    if u is None:
+        return None
+    ax += avx * u
+    ay += avy * u
+    f = ar and ar / (ar + br)
+    return (u, ax + (bx + bvx * u - ax) * f, ay + (by + bvy * u - ay) * f)
+
+def _toi_circle_segment(cx, cy, r, vx, vy, ax, ay, bx, by, svx, svy):
+    # Solved in the frame of the segment, then moved back.
+    vx -= svx
+    vy -= svy
+    ex = bx - ax
+    ey = by - ay
+    e2 = ex * ex + ey * ey
+    w = e2 and max(min(((cx - ax) * ex + (cy - ay) * ey) / e2, 1.), 0.)
+    qx = ax + w * ex
+    qy = ay + w * ey
+    if (cx - qx) ** 2 + (cy - qy) ** 2 <= r * r:
+        return (0., qx, qy)
+    hit = None
+    if e2:
+        # Side of the segment, sweeping the center against the offset line
+        el = math.sqrt(e2)
+        s0 = (ex * (cy - ay) - ey * (cx - ax)) / el
+        ds = (ex * vy - ey * vx) / el
+        if ds:
+            u = ((s0 > 0 and r or -r) - s0) / ds
+            if 0 <= u <= 1:
+                w = ((cx + u * vx - ax) * ex + (cy + u * vy - ay) * ey) / e2
+                if 0 <= w <= 1:
+                    hit = (u, ax + w * ex, ay + w * ey)
+    for qx, qy in ((ax, ay), (bx, by)):
+        # End caps
+        u = _toi_disc(cx - qx, cy - qy, vx, vy, r)
+        if u is not None and (hit is None or u < hit[0]):
+            hit = (u, qx, qy)
+    if hit is not None:
+        u, x, y = hit
+        return (u, x + svx * u, y + svy * u)
+
+def _toi_circle(C, vx, vy, other, ovx, ovy):
+    if isinstance(other, Circle):
+        return _toi_circle_circle(C.c.x, C.c.y, C.r, vx, vy,
+                                  other.c.x, other.c.y, other.r, ovx, ovy)
+    elif isinstance(other, LineSegment2):
+        return _toi_circle_segment(C.c.x, C.c.y, C.r, vx, vy,
+                                   other.p1.x, other.p1.y,
+                                   other.p2.x, other.p2.y, ovx, ovy)
+    raise AttributeError('Cannot compute time of impact of %s and %s' % \
+        (C.__class__, other.__class__))
+
 def _connect_point2_line2(P, L):
     d = L.v.magnitude_squared()
     assert d != 0
@@ -1688,8 +2180,7 @@ def _connect_line2_line2(A, B):
     if d == 0:
         # Parallel, connect an endpoint with a line
         if isinstance(B, Ray2) or isinstance(B, LineSegment2):
-            p1, p2 = _connect_point2_line2(B.p, A)
-            return p2, p1
+            return _connect_point2_line2(B.p, A)._swap()
         # No endpoint (or endpoint is on A), possibly choose arbitrary point
         # on line.
         return _connect_point2_line2(A.p, B)
@@ -1760,6 +2251,25 @@ class Point2(Vector2, Geometry):
         if c:
             return c._swap()
 
+    def _intersect_polygon2(self, other):
+        return other.contains(self)
+
+    def _intersect_aabb2(self, other):
+        return other.contains(self)
+
+    def _connect_polygon2(self, other):
+        c = _connect_point2_polygon2(self, other)
+        if c:
+            return c._swap()
+
+    def _connect_aabb2(self, other):
+        c = _connect_point2_aabb2(self, other)
+        if c:
+            return c._swap()
+
+    bounds = property(lambda self: AABB2(self, self),
+        doc='AABB2 containing the point')
+
 class Line2(Geometry, Slotted):
     __slots__ = ['p', 'v']
 
@@ -1796,6 +2306,28 @@ class Line2(Geometry, Slotted):
 
     copy = __copy__
 
+    def new_borrowed(cls, p, v):
+        '''Create a line from p and v without copying or checking them;
+        the line keeps and changes the objects given.'''
+        self = object.__new__(cls)
+        self.p = p
+        self.v = v
+        return self
+    new_borrowed = classmethod(new_borrowed)
+
+    def new_many(cls, buffer):
+        '''Create a list of lines from a flat buffer of four values each,
+        the coordinates of p then v.'''
+        new = object.__new__
+        lines = []
+        for px, py, vx, vy in _records(buffer, 4):
+            L = new(cls)
+            L.p = Point2(px, py)
+            L.v = Vector2(vx, vy)
+            lines.append(L)
+        return lines
+    new_many = classmethod(new_many)
+
     def __repr__(self):
         return 'Line2(<%.2f, %.2f> + u<%.2f, %.2f>)' % \
             (self.p.x, self.p.y, self.v.x, self.v.y)
@@ -1808,10 +2340,16 @@ class Line2(Geometry, Slotted):
         self.p = t * self.p
         self.v = t * self.v
 
+    def _get_bounds(self):
+        return _line2_bounds(self)
+    bounds = property(_get_bounds, doc='AABB2 containing the line')
+
     def _u_in(self, u):
         return True
 
-    def intersect(self, other):
+    def intersect(self, other, robust=False):
+        if robust and isinstance(other, Line2):
+            return _intersect_line2_line2_robust(other, self)
         return other._intersect_line2(self)
 
     def _intersect_line2(self, other):
@@ -1820,6 +2358,9 @@ class Line2(Geometry, Slotted):
     def _intersect_circle(self, other):
         return _intersect_line2_circle(self, other)
 
+    def _intersect_aabb2(self, other):
+        return _intersect_line2_aabb2(self, other)
+
     def connect(self, other):
         return other._connect_line2(self)
 
@@ -1832,6 +2373,11 @@ class Line2(Geometry, Slotted):
     def _connect_circle(self, other):
         return _connect_circle_line2(other, self)
 
+    def _connect_aabb2(self, other):
+        c = _connect_line2_aabb2(self, other)
+        if c:
+            return c._swap()
+
 class Ray2(Line2):
     def __repr__(self):
         return 'Ray2(<%.2f, %.2f> + u<%.2f, %.2f>)' % \
@@ -1875,13 +2421,54 @@ class Circle(Geometry, Slotted):
 
     copy = __copy__
 
+    def new_borrowed(cls, center, radius):
+        '''Create a circle from center and radius without copying or checking
+        them; the circle keeps and changes the center given.'''
+        self = object.__new__(cls)
+        self.c = center
+        self.r = radius
+        return self
+    new_borrowed = classmethod(new_borrowed)
+
+    def new_many(cls, buffer):
+        '''Create a list of circles from a flat buffer of three values each,
+        the center then the radius.'''
+        new = object.__new__
+        circles = []
+        for x, y, r in _records(buffer, 3):
+            B = new(cls)
+            B.c = Point2(x, y)
+            B.r = r
+            circles.append(B)
+        return circles
+    new_many = classmethod(new_many)
+
     def __repr__(self):
         return 'Circle(<%.2f, %.2f>, radius=%.2f)' % \
             (self.c.x, self.c.y, self.r)
 
+    def new_bounding(cls, points, exact=False):
+        pts = list(zip(*_coords2(points)))
+        c, r2 = _bounding_ball(pts, exact, _ball_through2, 3)
+        return cls(Point2(*c), math.sqrt(r2))
+    new_bounding = classmethod(new_bounding)
+
     def _apply_transform(self, t):
         self.c = t * self.c
 
+    def _get_bounds(self):
+        c = self.c
+        r = self.r
+        return AABB2(Point2(c.x - r, c.y - r), Point2(c.x + r, c.y + r))
+    bounds = property(_get_bounds, doc='AABB2 containing the circle')
+
+    def time_of_impact(self, velocity, other, other_velocity=None):
+        assert isinstance(velocity, Vector2)
+        ov = other_velocity or Vector2()
+        hit = _toi_circle(self, velocity.x, velocity.y, other, ov.x, ov.y)
+        if hit is not None:
+            return hit[0], Point2(hit[1], hit[2])
+
     def intersect(self, other):
         return other._intersect_circle(self)
 
@@ -1891,6 +2478,9 @@ class Circle(Geometry, Slotted):
     def _intersect_line2(self, other):
         return _intersect_line2_circle(other, self)
 
+    def _intersect_aabb2(self, other):
+        return _intersect_circle_aabb2(self, other)
+
     def connect(self, other):
         return other._connect_circle(self)
 
@@ -1905,6 +2495,591 @@ class Circle(Geometry, Slotted):
     def _connect_circle(self, other):
         return _connect_circle_circle(other, self)
 
+    def _connect_aabb2(self, other):
+        c = _connect_circle_aabb2(self, other)
+        if c:
+            return c._swap()
+
+def _hull2(xs, ys, order):
+    # Andrew's monotone chain over the point indices in order; returns
+    # the hull indices in counterclockwise order.
+    order = sorted(order, key=lambda i: (xs[i], ys[i]))
+    if len(order) < 2:
+        return order
+
+    def chain(order):
+        hull = []
+        for i in order:
+            x = xs[i]
+            y = ys[i]
+            while len(hull) >= 2 and \
+                  _orient2d(xs[hull[-2]], ys[hull[-2]],
+                            xs[hull[-1]], ys[hull[-1]], x, y) <= 0:
+                hull.pop()
+            hull.append(i)
+        return hull
+
+    lower = chain(order)
+    upper = chain(reversed(order))
+    hull = lower[:-1] + upper[:-1]
+    if len(hull) == 2 and \
+       xs[hull[0]] == xs[hull[1]] and ys[hull[0]] == ys[hull[1]]:
+        # all points coincide
+        return hull[:1]
+    return hull
+
+def _hull2_edges(hull):
+    if len(hull) < 2:
+        return []
+    if len(hull) == 2:
+        return [(hull[0], hull[1])]
+    return list(zip(hull, hull[1:] + hull[:1]))
+
+def convex_hull2(points):
+    '''Return the convex hull of a collection of 2D points as a tuple
+    (indices, edges).
+
+    indices lists the hull vertices in counterclockwise order, as indices
+    into points; edges lists the hull edges as pairs of indices.  points
+    may be a sequence of points or a flat coordinate buffer.
+    '''
+    xs, ys = _coords2(points)
+    hull = _hull2(xs, ys, range(len(xs)))
+    return hull, _hull2_edges(hull)
+
+class ConvexHull2(Slotted):
+    '''Incrementally maintained convex hull of a stream of 2D points.
+
+    Points are numbered in the order they are added.  New points are
+    buffered and merged with the current hull vertices only, so the
+    points already known to be interior are never revisited.
+    '''
+    __slots__ = ['count', '_xs', '_ys', '_indices', '_pending']
+
+    def __init__(self, points=None):
+        self.count = 0
+        self._xs = []
+        self._ys = []
+        self._indices = []
+        self._pending = []
+        if points is not None:
+            self.extend(points)
+
+    def __copy__(self):
+        H = self.__class__()
+        self._merge()
+        H.count = self.count
+        H._xs = self._xs[:]
+        H._ys = self._ys[:]
+        H._indices = self._indices[:]
+        return H
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'ConvexHull2(%d points, %d on hull)' % \
+            (self.count, len(self.indices))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, point):
+        self._pending.append((point[0], point[1], self.count))
+        self.count += 1
+        if len(self._pending) > 64 + 4 * len(self._indices):
+            self._merge()
+
+    def extend(self, points):
+        xs, ys = _coords2(points)
+        count = self.count
+        self._pending.extend(zip(xs, ys, range(count, count + len(xs))))
+        self.count += len(xs)
+        self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        xs = self._xs + [p[0] for p in self._pending]
+        ys = self._ys + [p[1] for p in self._pending]
+        ids = self._indices + [p[2] for p in self._pending]
+        hull = _hull2(xs, ys, range(len(xs)))
+        self._xs = [xs[i] for i in hull]
+        self._ys = [ys[i] for i in hull]
+        self._indices = [ids[i] for i in hull]
+        self._pending = []
+
+    def _get_indices(self):
+        self._merge()
+        return self._indices[:]
+    indices = property(_get_indices,
+        doc='Indices of the hull vertices in counterclockwise order')
+
+    def _get_edges(self):
+        return _hull2_edges(self.indices)
+    edges = property(_get_edges, doc='Hull edges as pairs of indices')
+
+    def _get_points(self):
+        self._merge()
+        return [Point2(x, y) for x, y in zip(self._xs, self._ys)]
+    points = property(_get_points,
+        doc='Hull vertices as Point2 in counterclockwise order')
+
+def _connect_point2_polygon2(P, polygon):
+    px = P.x
+    py = P.y
+    xs = polygon._xs
+    ys = polygon._ys
+    best = None
+    x0 = xs[-1]
+    y0 = ys[-1]
+    for x1, y1 in zip(xs, ys):
+        vx = x1 - x0
+        vy = y1 - y0
+        d = vx * vx + vy * vy
+        u = ((px - x0) * vx + (py - y0) * vy) / d if d else 0.0
+        u = max(min(u, 1.0), 0.0)
+        qx = x0 + u * vx
+        qy = y0 + u * vy
+        dist = (qx - px) ** 2 + (qy - py) ** 2
+        if best is None or dist < best:
+            best = dist
+            bx = qx
+            by = qy
+        x0 = x1
+        y0 = y1
+    return LineSegment2(P, Point2(bx, by))
+
+class Polygon2(Geometry, Slotted):
+    '''A simple polygon given by its vertices in order.
+
+    Edge data is built on the first containment query, which then scans
+    every edge.  With index=True, or after build_index(), the edges are
+    also held in a segment tree over their heights and each query takes
+    O(log^2 n) time.
+    '''
+    __slots__ = ['_xs', '_ys', '_edges', '_indexed', '_index', '_bounds']
+
+    def __init__(self, points, index=False):
+        xs, ys = _coords2(points)
+        if len(xs) < 3:
+            raise AttributeError('Polygon has fewer than three vertices')
+        self._xs = xs
+        self._ys = ys
+        self._edges = None
+        self._indexed = index
+        self._index = None
+        self._bounds = None
+
+    def __copy__(self):
+        return self.__class__(self.vertices, self._indexed)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'Polygon2(%d vertices)' % len(self._xs)
+
+    def __len__(self):
+        return len(self._xs)
+
+    def __getitem__(self, key):
+        return Point2(self._xs[key], self._ys[key])
+
+    def _get_vertices(self):
+        return [Point2(x, y) for x, y in zip(self._xs, self._ys)]
+    vertices = property(_get_vertices, doc='List of Point2 vertices')
+
+    def _get_edges(self):
+        v = self.vertices
+        return [LineSegment2(a, b) for a, b in zip(v, v[1:] + v[:1])]
+    edges = property(_get_edges, doc='List of LineSegment2 edges')
+
+    def _get_signed_area(self):
+        xs = self._xs
+        ys = self._ys
+        s = 0.0
+        x0 = xs[-1]
+        y0 = ys[-1]
+        for x1, y1 in zip(xs, ys):
+            s += x0 * y1 - x1 * y0
+            x0 = x1
+            y0 = y1
+        return s / 2
+    signed_area = property(_get_signed_area,
+        doc='Area, positive if the vertices are counterclockwise')
+
+    area = property(lambda self: abs(self._get_signed_area()))
+
+    def _get_centroid(self):
+        xs = self._xs
+        ys = self._ys
+        a = cx = cy = 0.0
+        x0 = xs[-1]
+        y0 = ys[-1]
+        for x1, y1 in zip(xs, ys):
+            d = x0 * y1 - x1 * y0
+            a += d
+            cx += (x0 + x1) * d
+            cy += (y0 + y1) * d
+            x0 = x1
+            y0 = y1
+        if not a:
+            raise AttributeError('Polygon has zero area')
+        return Point2(cx / (3 * a), cy / (3 * a))
+    centroid = property(_get_centroid)
+
+    def _build_edges(self):
+        # (ylo, yhi, x at ylo, dx/dy) of each edge that is not horizontal;
+        # horizontal edges never cross the half-open scanline test.
+        xs = self._xs
+        ys = self._ys
+        edges = []
+        x0 = xs[-1]
+        y0 = ys[-1]
+        for x1, y1 in zip(xs, ys):
+            if y0 < y1:
+                edges.append((y0, y1, x0, (x1 - x0) / (y1 - y0)))
+            elif y0 > y1:
+                edges.append((y1, y0, x1, (x0 - x1) / (y0 - y1)))
+            x0 = x1
+            y0 = y1
+        self._edges = edges
+
+    def build_index(self):
+        '''Index the edges so that each later containment query takes
+        O(log^2 n) time.  The index holds O(n log n) edge entries, and is
+        rebuilt after the polygon is transformed.'''
+        if self._edges is None:
+            self._build_edges()
+        # A segment tree over the slabs between consecutive distinct vertex
+        # heights: each edge is stored in the O(log n) nodes whose slabs
+        # together make up its height.  The edges of a node span all its
+        # slabs without crossing each other, so they keep one order by x
+        # and can be binary searched.
+        levels = sorted(set(self._ys))
+        size = 1
+        while size < len(levels) - 1:
+            size *= 2
+        nodes = [None] * (2 * size)
+        for edge in self._edges:
+            lo = bisect.bisect_left(levels, edge[0]) + size
+            hi = bisect.bisect_left(levels, edge[1]) + size
+            while lo < hi:
+                if lo & 1:
+                    nodes[lo] = nodes[lo] or []
+                    nodes[lo].append(edge)
+                    lo += 1
+                if hi & 1:
+                    hi -= 1
+                    nodes[hi] = nodes[hi] or []
+                    nodes[hi].append(edge)
+                lo //= 2
+                hi //= 2
+        for node, node_edges in enumerate(nodes):
+            if node_edges:
+                depth = node.bit_length() - 1
+                width = size >> depth
+                first = (node - (1 << depth)) * width
+                mid = (levels[first] + levels[first + width]) / 2
+                node_edges.sort(key=lambda e: e[2] + (mid - e[0]) * e[3])
+        self._indexed = True
+        self._index = (levels, size, nodes)
+
+    def _contains_scan(self, px, py):
+        inside = False
+        for ylo, yhi, x, slope in self._edges:
+            if ylo <= py < yhi and px < x + (py - ylo) * slope:
+                inside = not inside
+        return inside
+
+    def _contains_index(self, px, py):
+        levels, size, nodes = self._index
+        i = bisect.bisect_right(levels, py) - 1
+        if i < 0 or i >= len(levels) - 1:
+            return False
+        # Count the edges right of the point in the nodes over its slab:
+        # those from the first with px < x at py
+        count = 0
+        node = i + size
+        while node:
+            node_edges = nodes[node]
+            if node_edges:
+                lo = 0
+                hi = len(node_edges)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    ylo, yhi, x, slope = node_edges[mid]
+                    if px < x + (py - ylo) * slope:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                count += len(node_edges) - lo
+            node //= 2
+        return count % 2 == 1
+
+    def _contains_function(self):
+        if self._edges is None:
+            self._build_edges()
+        if self._indexed:
+            if self._index is None:
+                self.build_index()
+            return self._contains_index
+        return self._contains_scan
+
+    def contains(self, point):
+        '''Return True if point lies inside the polygon.'''
+        return self._contains_function()(point.x, point.y)
+
+    def contains_many(self, points):
+        '''Return a list of booleans, one for each of points, which may
+        be a sequence of points or a flat coordinate buffer.'''
+        contains = self._contains_function()
+        xs, ys = _coords2(points)
+        return [contains(x, y) for x, y in zip(xs, ys)]
+
+    def _apply_transform(self, t):
+        vertices = [t * p for p in self.vertices]
+        self._xs = [p.x for p in vertices]
+        self._ys = [p.y for p in vertices]
+        self._edges = None
+        self._index = None
+        self._bounds = None
+
+    def _get_bounds(self):
+        bounds = self._bounds
+        if bounds is None:
+            bounds = self._bounds = AABB2(
+                Point2(min(self._xs), min(self._ys)),
+                Point2(max(self._xs), max(self._ys)))
+        return bounds
+    bounds = property(_get_bounds, doc='Cached AABB2 containing the polygon')
+
+    def intersect(self, other):
+        return other._intersect_polygon2(self)
+
+    def _intersect_point2(self, other):
+        return self.contains(other)
+
+    def connect(self, other):
+        return other._connect_polygon2(self)
+
+    def _connect_point2(self, other):
+        return _connect_point2_polygon2(other, self)
+
+def _line2_range(L):
+    # parameter range of a line, ray or line segment
+    if isinstance(L, LineSegment2):
+        return 0.0, 1.0
+    elif isinstance(L, Ray2):
+        return 0.0, float('inf')
+    return float('-inf'), float('inf')
+
+def _line_extent(p, v, u0, u1):
+    if not v:
+        return p, p
+    a = p + u0 * v
+    b = p + u1 * v
+    if a > b:
+        return b, a
+    return a, b
+
+def _line2_bounds(L):
+    u0, u1 = _line2_range(L)
+    x0, x1 = _line_extent(L.p.x, L.v.x, u0, u1)
+    y0, y1 = _line_extent(L.p.y, L.v.y, u0, u1)
+    return AABB2(Point2(x0, y0), Point2(x1, y1))
+
+def _clamp(x, lo, hi):
+    if x < lo:
+        return lo
+    elif x > hi:
+        return hi
+    return x
+
+def _intersect_line2_aabb2(L, B):
+    u0, u1 = _line2_range(L)
+    for p, v, lo, hi in ((L.p.x, L.v.x, B.minx, B.maxx),
+                         (L.p.y, L.v.y, B.miny, B.maxy)):
+        if v:
+            ua = (lo - p) / v
+            ub = (hi - p) / v
+            if ua > ub:
+                ua, ub = ub, ua
+            if ua > u0:
+                u0 = ua
+            if ub < u1:
+                u1 = ub
+        elif p < lo or p > hi:
+            return None
+    if u0 > u1:
+        return None
+    if u0 == u1:
+        return Point2(L.p.x + u0 * L.v.x,
+                      L.p.y + u0 * L.v.y)
+    return LineSegment2(Point2(L.p.x + u0 * L.v.x,
+                               L.p.y + u0 * L.v.y),
+                        Point2(L.p.x + u1 * L.v.x,
+                               L.p.y + u1 * L.v.y))
+
+def _intersect_circle_aabb2(C, B):
+    dx = C.c.x - _clamp(C.c.x, B.minx, B.maxx)
+    dy = C.c.y - _clamp(C.c.y, B.miny, B.maxy)
+    return dx ** 2 + dy ** 2 <= C.r ** 2
+
+def _intersect_aabb2_aabb2(A, B):
+    minx = max(A.minx, B.minx)
+    miny = max(A.miny, B.miny)
+    maxx = min(A.maxx, B.maxx)
+    maxy = min(A.maxy, B.maxy)
+    if minx > maxx or miny > maxy:
+        return None
+    return AABB2(Point2(minx, miny), Point2(maxx, maxy))
+
+def _connect_point2_aabb2(P, B):
+    x = _clamp(P.x, B.minx, B.maxx)
+    y = _clamp(P.y, B.miny, B.maxy)
+    if x == P.x and y == P.y:
+        # Inside
+        return None
+    return LineSegment2(P, Point2(x, y))
+
+def _connect_line2_aabb2(L, B):
+    if _intersect_line2_aabb2(L, B) is not None:
+        return None
+    # The line misses the box, so the closest points are a corner and the
+    # line, or an end-point of the line and the box.
+    best = None
+    for x, y in ((B.minx, B.miny), (B.maxx, B.miny),
+                 (B.maxx, B.maxy), (B.minx, B.maxy)):
+        c = _connect_point2_line2(Point2(x, y), L)._swap()
+        if best is None or c.magnitude_squared() < best.magnitude_squared():
+            best = c
+    ends = []
+    if isinstance(L, (Ray2, LineSegment2)):
+        ends.append(L.p1)
+    if isinstance(L, LineSegment2):
+        ends.append(L.p2)
+    for p in ends:
+        c = _connect_point2_aabb2(p, B)
+        if c.magnitude_squared() < best.magnitude_squared():
+            best = c
+    return best
+
+def _connect_circle_aabb2(C, B):
+    x = _clamp(C.c.x, B.minx, B.maxx)
+    y = _clamp(C.c.y, B.miny, B.maxy)
+    d = math.sqrt((x - C.c.x) ** 2 + (y - C.c.y) ** 2)
+    if d <= C.r:
+        return None
+    s = C.r / d
+    return LineSegment2(Point2(C.c.x + (x - C.c.x) * s,
+                               C.c.y + (y - C.c.y) * s),
+                        Point2(x, y))
+
+def _closest_interval(alo, ahi, blo, bhi):
+    # closest coordinates of two intervals along one axis
+    if ahi < blo:
+        return ahi, blo
+    elif bhi < alo:
+        return alo, bhi
+    x = (max(alo, blo) + min(ahi, bhi)) / 2
+    return x, x
+
+def _connect_aabb2_aabb2(A, B):
+    if _intersect_aabb2_aabb2(A, B) is not None:
+        return None
+    ax, bx = _closest_interval(A.minx, A.maxx, B.minx, B.maxx)
+    ay, by = _closest_interval(A.miny, A.maxy, B.miny, B.maxy)
+    return LineSegment2(Point2(ax, ay), Point2(bx, by))
+
+class AABB2(Geometry, Slotted):
+    '''Axis-aligned bounding box in 2D, given by two opposite corners.'''
+    __slots__ = ['minx', 'miny', 'maxx', 'maxy']
+    __hash__ = None
+
+    def __init__(self, p1, p2):
+        assert isinstance(p1, Vector2) and isinstance(p2, Vector2)
+        self.minx = min(p1.x, p2.x)
+        self.miny = min(p1.y, p2.y)
+        self.maxx = max(p1.x, p2.x)
+        self.maxy = max(p1.y, p2.y)
+
+    def __copy__(self):
+        return self.__class__(self.p1, self.p2)
+
+    copy = __copy__
+
+    def __eq__(self, other):
+        return isinstance(other, AABB2) and \
+            self.minx == other.minx and self.miny == other.miny and \
+            self.maxx == other.maxx and self.maxy == other.maxy
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'AABB2(<%.2f, %.2f> to <%.2f, %.2f>)' % \
+            (self.minx, self.miny, self.maxx, self.maxy)
+
+    p1 = property(lambda self: Point2(self.minx, self.miny),
+                  doc='Minimum corner')
+    p2 = property(lambda self: Point2(self.maxx, self.maxy),
+                  doc='Maximum corner')
+    center = property(lambda self: Point2((self.minx + self.maxx) / 2,
+                                          (self.miny + self.maxy) / 2))
+    bounds = property(lambda self: self)
+
+    def new_bounding(cls, points):
+        xs, ys = _coords2(points)
+        return cls(Point2(min(xs), min(ys)), Point2(max(xs), max(ys)))
+    new_bounding = classmethod(new_bounding)
+
+    def _apply_transform(self, t):
+        corners = [t * Point2(x, y) for x in (self.minx, self.maxx)
+                                    for y in (self.miny, self.maxy)]
+        self.minx = min(p.x for p in corners)
+        self.miny = min(p.y for p in corners)
+        self.maxx = max(p.x for p in corners)
+        self.maxy = max(p.y for p in corners)
+
+    def contains(self, point):
+        return self.minx <= point.x <= self.maxx and \
+               self.miny <= point.y <= self.maxy
+
+    def overlaps(self, other):
+        '''Return True if the box overlaps the AABB2 other.'''
+        return self.minx <= other.maxx and other.minx <= self.maxx and \
+               self.miny <= other.maxy and other.miny <= self.maxy
+
+    def intersect(self, other):
+        return other._intersect_aabb2(self)
+
+    def _intersect_point2(self, other):
+        return self.contains(other)
+
+    def _intersect_line2(self, other):
+        return _intersect_line2_aabb2(other, self)
+
+    def _intersect_circle(self, other):
+        return _intersect_circle_aabb2(other, self)
+
+    def _intersect_aabb2(self, other):
+        return _intersect_aabb2_aabb2(other, self)
+
+    def connect(self, other):
+        return other._connect_aabb2(self)
+
+    def _connect_point2(self, other):
+        return _connect_point2_aabb2(other, self)
+
+    def _connect_line2(self, other):
+        return _connect_line2_aabb2(other, self)
+
+    def _connect_circle(self, other):
+        return _connect_circle_aabb2(other, self)
+
+    def _connect_aabb2(self, other):
+        return _connect_aabb2_aabb2(other, self)
+
 # 3D Geometry
 # -------------------------------------------------------------------------
 
@@ -2030,23 +3205,29 @@ def _connect_plane_plane(A, B):
         return _connect_point3_plane(A._get_point(), B)
 
 def _intersect_point3_sphere(P, S):
-    return abs(P - S.c) <= S.r
+    return (P.x - S.c.x) ** 2 + (P.y - S.c.y) ** 2 + \
+           (P.z - S.c.z) ** 2 <= S.r ** 2
     
-def _intersect_line3_sphere(L, S):
-    a = L.v.magnitude_squared()
-    b = 2 * (L.v.x * (L.p.x - S.c.x) + \
-             L.v.y * (L.p.y - S.c.y) + \
-             L.v.z * (L.p.z - S.c.z))
-    c = S.c.magnitude_squared() + \
-        L.p.magnitude_squared() - \
-        2 * S.c.dot(L.p) - \
-        S.r ** 2
+def _line3_sphere_roots(px, py, pz, vx, vy, vz, cx, cy, cz, r):
+    # Parameters u1 >= u2 at which p + u * v meets the sphere, or None.
+    dx = px - cx
+    dy = py - cy
+    dz = pz - cz
+    a = vx * vx + vy * vy + vz * vz
+    b = 2 * (vx * dx + vy * dy + vz * dz)
+    c = dx * dx + dy * dy + dz * dz - r * r
     det = b ** 2 - 4 * a * c
     if det < 0:
         return None
     sq = math.sqrt(det)
-    u1 = (-b + sq) / (2 * a)
-    u2 = (-b - sq) / (2 * a)
+    return (-b + sq) / (2 * a), (-b - sq) / (2 * a)
+
+def _intersect_line3_sphere(L, S):
+    roots = _line3_sphere_roots(L.p.x, L.p.y, L.p.z, L.v.x, L.v.y, L.v.z,
+                                S.c.x, S.c.y, S.c.z, S.r)
+    if roots is None:
+        return None
+    u1, u2 = roots
     if not L._u_in(u1):
         u1 = max(min(u1, 1.0), 0.0)
     if not L._u_in(u2):
@@ -2058,6 +3239,63 @@ def _intersect_line3_sphere(L, S):
                                L.p.y + u2 * L.v.y,
                                L.p.z + u2 * L.v.z))
 
+def _toi_ball(px, py, pz, vx, vy, vz, r):
+    # Earliest u in [0, 1] at which p + u * v comes within r of the origin.
+    if px * px + py * py + pz * pz <= r * r:
+        return 0.
+    if not (vx or vy or vz):
+        return None
+    roots = _line3_sphere_roots(px, py, pz, vx, vy, vz, 0., 0., 0., r)
+    if roots is None or not 0 <= roots[1] <= 1:
+        return None
+    return roots[1]
+
+def _toi_sphere_sphere(ax, ay, az, ar, avx, avy, avz,
+                       bx, by, bz, br, bvx, bvy, bvz):
+    u = _toi_ball(ax - bx, ay - by, az - bz,
+                  avx - bvx, avy - bvy, avz - bvz, ar + br)
+    if u is None:
+        return None
+    ax += avx * u
+    ay += avy * u
+    az += avz * u
+    f = ar and ar / (ar + br)
+    return (u, ax + (bx + bvx * u - ax) * f,
+               ay + (by + bvy * u - ay) * f,
+               az + (bz + bvz * u - az) * f)
+
+def _toi_sphere_plane(cx, cy, cz, r, vx, vy, vz, nx, ny, nz, k, pvx, pvy, pvz):
+    # Signed distance to the plane is d0 + u * dv in the plane's frame.
+    nl = math.sqrt(nx * nx + ny * ny + nz * nz)
+    nx /= nl
+    ny /= nl
+    nz /= nl
+    d0 = nx * cx + ny * cy + nz * cz - k / nl
+    if abs(d0) <= r:
+        return (0., cx - nx * d0, cy - ny * d0, cz - nz * d0)
+    dv = nx * (vx - pvx) + ny * (vy - pvy) + nz * (vz - pvz)
+    if not dv:
+        return None
+    side = d0 > 0 and r or -r
+    u = (side - d0) / dv
+    if not 0 <= u <= 1:
+        return None
+    return (u, cx + vx * u - nx * side,
+               cy + vy * u - ny * side,
+               cz + vz * u - nz * side)
+
+def _toi_sphere(S, vx, vy, vz, other, ovx, ovy, ovz):
+    if isinstance(other, Sphere):
+        return _toi_sphere_sphere(S.c.x, S.c.y, S.c.z, S.r, vx, vy, vz,
+                                  other.c.x, other.c.y, other.c.z, other.r,
+                                  ovx, ovy, ovz)
+    elif isinstance(other, Plane):
+        return _toi_sphere_plane(S.c.x, S.c.y, S.c.z, S.r, vx, vy, vz,
+                                 other.n.x, other.n.y, other.n.z, other.k,
+                                 ovx, ovy, ovz)
+    raise AttributeError('Cannot compute time of impact of %s and %s' % \
+        (S.__class__, other.__class__))
+
 def _intersect_line3_plane(L, P):
     d = P.n.dot(L.v)
     if not d:
@@ -2118,6 +3356,23 @@ class Point3(Vector3, Geometry):
         if c:
             return c._swap()
 
+    def _intersect_aabb3(self, other):
+        return other.contains(self)
+
+    def _intersect_obb3(self, other):
+        return other.contains(self)
+
+    def _connect_aabb3(self, other):
+        c = _connect_point3_aabb3(self, other)
+        if c:
+            return c._swap()
+
+    bounds = property(lambda self: AABB3(self, self),
+        doc='AABB3 containing the point')
+
+    def support(self, direction):
+        return self.copy()
+
 class Line3(Slotted):
     __slots__ = ['p', 'v']
 
@@ -2155,6 +3410,31 @@ class Line3(Slotted):
 
     copy = __copy__
 
+    def new_borrowed(cls, p, v):
+        '''Create a line from p and v without copying or checking them;
+        the line keeps and changes the objects given.'''
+        self = object.__new__(cls)
+        self.p = p
+        self.v = v
+        return self
+    new_borrowed = classmethod(new_borrowed)
+
+    def new_many(cls, buffer, size=6):
+        '''Create a list of lines from a flat buffer of size values each,
+        the coordinates of p then v.  With size 8 the layout is that of
+        pack_lines3, and the parameter range ending each line is ignored:
+        the class decides it.'''
+        assert size in (6, 8), 'size must be 6 or 8'
+        new = object.__new__
+        lines = []
+        for r in _records(buffer, size):
+            L = new(cls)
+            L.p = Point3(r[0], r[1], r[2])
+            L.v = Vector3(r[3], r[4], r[5])
+            lines.append(L)
+        return lines
+    new_many = classmethod(new_many)
+
     def __repr__(self):
         return 'Line3(<%.2f, %.2f, %.2f> + u<%.2f, %.2f, %.2f>)' % \
             (self.p.x, self.p.y, self.p.z, self.v.x, self.v.y, self.v.z)
@@ -2168,6 +3448,10 @@ class Line3(Slotted):
         self.p = t * self.p
         self.v = t * self.v
 
+    def _get_bounds(self):
+        return _line3_bounds(self)
+    bounds = property(_get_bounds, doc='AABB3 containing the line')
+
     def _u_in(self, u):
         return True
 
@@ -2180,6 +3464,15 @@ class Line3(Slotted):
     def _intersect_plane(self, other):
         return _intersect_line3_plane(self, other)
 
+    def _intersect_triangle_mesh3(self, other):
+        return other._intersect_line3(self)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_line3_aabb3(self, other)
+
+    def _intersect_obb3(self, other):
+        return _intersect_line3_obb3(self, other)
+
     def connect(self, other):
         return other._connect_line3(self)
 
@@ -2195,7 +3488,12 @@ class Line3(Slotted):
     def _connect_plane(self, other):
         c = _connect_line3_plane(self, other)
         if c:
-            return c
+            return c._swap()
+
+    def _connect_aabb3(self, other):
+        c = _connect_line3_aabb3(self, other)
+        if c:
+            return c._swap()
 
 class Ray3(Line3):
     def __repr__(self):
@@ -2228,6 +3526,11 @@ class LineSegment3(Line3):
 
     length = property(lambda self: abs(self.v))
 
+    def support(self, direction):
+        if self.v.dot(direction) > 0:
+            return self.p2
+        return self.p.copy()
+
 class Sphere(Slotted):
     __slots__ = ['c', 'r']
 
@@ -2241,13 +3544,59 @@ class Sphere(Slotted):
 
     copy = __copy__
 
+    def new_borrowed(cls, center, radius):
+        '''Create a sphere from center and radius without copying or checking
+        them; the sphere keeps and changes the center given.'''
+        self = object.__new__(cls)
+        self.c = center
+        self.r = radius
+        return self
+    new_borrowed = classmethod(new_borrowed)
+
+    def new_many(cls, buffer):
+        '''Create a list of spheres from a flat buffer of four values each,
+        the center then the radius, as from pack_spheres.'''
+        new = object.__new__
+        spheres = []
+        for x, y, z, r in _records(buffer, 4):
+            B = new(cls)
+            B.c = Point3(x, y, z)
+            B.r = r
+            spheres.append(B)
+        return spheres
+    new_many = classmethod(new_many)
+
     def __repr__(self):
         return 'Sphere(<%.2f, %.2f, %.2f>, radius=%.2f)' % \
             (self.c.x, self.c.y, self.c.z, self.r)
 
+    def new_bounding(cls, points, exact=False):
+        pts = list(zip(*_coords3(points)))
+        c, r2 = _bounding_ball(pts, exact, _ball_through3, 4)
+        return cls(Point3(*c), math.sqrt(r2))
+    new_bounding = classmethod(new_bounding)
+
     def _apply_transform(self, t):
         self.c = t * self.c
 
+    def _get_bounds(self):
+        c = self.c
+        r = self.r
+        return AABB3(Point3(c.x - r, c.y - r, c.z - r),
+                     Point3(c.x + r, c.y + r, c.z + r))
+    bounds = property(_get_bounds, doc='AABB3 containing the sphere')
+
+    def support(self, direction):
+        return self.c + direction.normalized() * self.r
+
+    def time_of_impact(self, velocity, other, other_velocity=None):
+        assert isinstance(velocity, Vector3)
+        ov = other_velocity or Vector3()
+        hit = _toi_sphere(self, velocity.x, velocity.y, velocity.z,
+                          other, ov.x, ov.y, ov.z)
+        if hit is not None:
+            return hit[0], Point3(hit[1], hit[2], hit[3])
+
     def intersect(self, other):
         return other._intersect_sphere(self)
 
@@ -2257,6 +3606,12 @@ class Sphere(Slotted):
     def _intersect_line3(self, other):
         return _intersect_line3_sphere(other, self)
 
+    def _intersect_aabb3(self, other):
+        return _intersect_sphere_aabb3(self, other)
+
+    def _intersect_obb3(self, other):
+        return _intersect_sphere_obb3(self, other)
+
     def connect(self, other):
         return other._connect_sphere(self)
 
@@ -2274,7 +3629,12 @@ class Sphere(Slotted):
     def _connect_plane(self, other):
         c = _connect_sphere_plane(self, other)
         if c:
-            return c
+            return c._swap()
+
+    def _connect_aabb3(self, other):
+        c = _connect_sphere_aabb3(self, other)
+        if c:
+            return c._swap()
 
 class Plane(Slotted):
     # n.p = k, where n is normal, p is point on plane, k is constant scalar
@@ -2309,10 +3669,36 @@ class Plane(Slotted):
 
     copy = __copy__
 
+    def new_many(cls, buffer):
+        '''Create a list of planes from a flat buffer of four values each,
+        the normal then k, as from pack_planes.  The normals are kept as
+        given, without normalizing or checking them.'''
+        new = object.__new__
+        planes = []
+        for x, y, z, k in _records(buffer, 4):
+            P = new(cls)
+            P.n = Vector3(x, y, z)
+            P.k = k
+            planes.append(P)
+        return planes
+    new_many = classmethod(new_many)
+
     def __repr__(self):
         return 'Plane(<%.2f, %.2f, %.2f>.p = %.2f)' % \
             (self.n.x, self.n.y, self.n.z, self.k)
 
+    def signed_distance_many(self, points):
+        '''The signed distances n.p - k of points, Point3 objects or a
+        flat buffer of coordinates, as an array('d').  They are positive in
+        front of the plane, and in units of the length of the normal.'''
+        P = _bulk(points, pack_points3)
+        nx = self.n.x
+        ny = self.n.y
+        nz = self.n.z
+        k = self.k
+        return array.array('d', [x * nx + y * ny + z * nz - k for x, y, z in
+                                 zip(P[0::3], P[1::3], P[2::3])])
+
     def _get_point(self):
         # Return an arbitrary point on the plane
         if self.n.z:
@@ -2327,6 +3713,18 @@ class Plane(Slotted):
         self.n = t * self.n
         self.k = self.n.dot(p)
 
+    def _get_bounds(self):
+        # Unbounded, except along the normal of an axis-aligned plane
+        inf = float('inf')
+        lo = [-inf, -inf, -inf]
+        hi = [inf, inf, inf]
+        n = (self.n.x, self.n.y, self.n.z)
+        if sum(1 for c in n if c) == 1:
+            axis = [c != 0 for c in n].index(True)
+            lo[axis] = hi[axis] = self.k / n[axis]
+        return AABB3(Point3(*lo), Point3(*hi))
+    bounds = property(_get_bounds, doc='AABB3 containing the plane')
+
     def intersect(self, other):
         return other._intersect_plane(self)
 
@@ -2336,6 +3734,12 @@ class Plane(Slotted):
     def _intersect_plane(self, other):
         return _intersect_plane_plane(self, other)
 
+    def _intersect_aabb3(self, other):
+        return _intersect_plane_aabb3(self, other)
+
+    def _intersect_obb3(self, other):
+        return _intersect_plane_obb3(self, other)
+
     def connect(self, other):
         return other._connect_plane(self)
 
@@ -2351,3 +3755,3349 @@ class Plane(Slotted):
     def _connect_plane(self, other):
         return _connect_plane_plane(other, self)
 
+    def _connect_aabb3(self, other):
+        c = _connect_plane_aabb3(self, other)
+        if c:
+            return c._swap()
+
+def transform_planes(planes, matrix):
+    '''Planes transformed by the affine part of a Matrix4.
+
+    planes are Plane objects or a flat buffer as from pack_planes; returns
+    an array('d') in the same layout, with unit normals.  The normals are
+    multiplied by the inverse transpose of the matrix, computed once, so
+    the planes stay perpendicular to them under scaling and shearing as
+    well as rotation and translation.
+    '''
+    P = pack_planes(planes)
+    M = matrix
+    a, b, c, tx = M.a, M.b, M.c, M.d
+    e, f, g, ty = M.e, M.f, M.g, M.h
+    i, j, k, tz = M.i, M.j, M.k, M.l
+    # Cofactors of the linear part; their matrix over det is the inverse
+    # transpose.
+    c00 = f * k - g * j
+    c01 = g * i - e * k
+    c02 = e * j - f * i
+    c10 = c * j - b * k
+    c11 = a * k - c * i
+    c12 = b * i - a * j
+    c20 = b * g - c * f
+    c21 = c * e - a * g
+    c22 = a * f - b * e
+    det = a * c00 + b * c01 + c * c02
+    if not det:
+        raise AttributeError('Matrix is not invertible')
+    sign = 1. if det > 0 else -1.
+    out = array.array('d', [0.0]) * len(P)
+    for s in range(0, len(P), 4):
+        x = P[s]
+        y = P[s + 1]
+        z = P[s + 2]
+        ux = c00 * x + c01 * y + c02 * z
+        uy = c10 * x + c11 * y + c12 * z
+        uz = c20 * x + c21 * y + c22 * z
+        q = sign / math.sqrt(ux * ux + uy * uy + uz * uz)
+        out[s] = ux * q
+        out[s + 1] = uy * q
+        out[s + 2] = uz * q
+        out[s + 3] = (P[s + 3] * det + ux * tx + uy * ty + uz * tz) * q
+    return out
+
+def time_of_impact_many(shapes, velocities, other, other_velocity=None):
+    '''Sweep each of a sequence of circles or spheres against other.
+
+    velocities is a sequence of vectors, or a flat coordinate buffer, with
+    one velocity per shape.  Returns a list holding the result of
+    time_of_impact for each shape.
+    '''
+    shapes = list(shapes)
+    if shapes and isinstance(shapes[0], Sphere):
+        ov = other_velocity or Vector3()
+        result = []
+        for S, vx, vy, vz in zip(shapes, *_coords3(velocities)):
+            hit = _toi_sphere(S, vx, vy, vz, other, ov.x, ov.y, ov.z)
+            result.append(hit and (hit[0], Point3(hit[1], hit[2], hit[3])))
+    else:
+        ov = other_velocity or Vector2()
+        result = []
+        for C, vx, vy in zip(shapes, *_coords2(velocities)):
+            hit = _toi_circle(C, vx, vy, other, ov.x, ov.y)
+            result.append(hit and (hit[0], Point2(hit[1], hit[2])))
+    return result
+
+def _hull3_face(xs, ys, zs, a, b, c):
+    ux = xs[b] - xs[a]
+    uy = ys[b] - ys[a]
+    uz = zs[b] - zs[a]
+    vx = xs[c] - xs[a]
+    vy = ys[c] - ys[a]
+    vz = zs[c] - zs[a]
+    nx = uy * vz - uz * vy
+    ny = uz * vx - ux * vz
+    nz = ux * vy - uy * vx
+    d = math.sqrt(nx * nx + ny * ny + nz * nz)
+    if d:
+        nx /= d
+        ny /= d
+        nz /= d
+    return [nx, ny, nz, nx * xs[a] + ny * ys[a] + nz * zs[a]]
+
+def convex_hull3(points):
+    '''Return the convex hull of a collection of 3D points as a tuple
+    (indices, faces), computed with the quickhull algorithm.
+
+    indices lists the hull vertices as indices into points; faces lists
+    the triangular hull faces as triples of indices, counterclockwise when
+    seen from outside the hull.  points may be a sequence of points or a
+    flat coordinate buffer.
+    '''
+    xs, ys, zs = _coords3(points)
+    n = len(xs)
+    if n < 4:
+        raise AttributeError('At least four points are required')
+    eps = 3 * 2.2204460492503131e-16 * \
+          (max(map(abs, xs)) + max(map(abs, ys)) + max(map(abs, zs)))
+
+    def dist(face, i):
+        return face[0] * xs[i] + face[1] * ys[i] + face[2] * zs[i] - face[3]
+
+    # Initial tetrahedron from the extreme points
+    extremes = []
+    for coords in (xs, ys, zs):
+        extremes.append(min(range(n), key=coords.__getitem__))
+        extremes.append(max(range(n), key=coords.__getitem__))
+    best = -1.0
+    for i in extremes:
+        for j in extremes:
+            d = (xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2 + \
+                (zs[i] - zs[j]) ** 2
+            if d > best:
+                best = d
+                i0, i1 = i, j
+    if best <= eps * eps:
+        raise AttributeError('Points are coincident')
+
+    dx = xs[i1] - xs[i0]
+    dy = ys[i1] - ys[i0]
+    dz = zs[i1] - zs[i0]
+    best = -1.0
+    for i in range(n):
+        px = xs[i] - xs[i0]
+        py = ys[i] - ys[i0]
+        pz = zs[i] - zs[i0]
+        d = (py * dz - pz * dy) ** 2 + (pz * dx - px * dz) ** 2 + \
+            (px * dy - py * dx) ** 2
+        if d > best:
+            best = d
+            i2 = i
+    if math.sqrt(best / (dx * dx + dy * dy + dz * dz)) <= eps:
+        raise AttributeError('Points are colinear')
+
+    base = _hull3_face(xs, ys, zs, i0, i1, i2)
+    i3 = max(range(n), key=lambda i: abs(dist(base, i)))
+    if abs(dist(base, i3)) <= eps:
+        raise AttributeError('Points are coplanar')
+    if dist(base, i3) > 0:
+        i1, i2 = i2, i1
+
+    faces = []          # [a, b, c, plane, outside points] or None if deleted
+    edges = {}          # directed edge -> face number
+
+    def add_face(a, b, c):
+        f = len(faces)
+        faces.append([a, b, c, _hull3_face(xs, ys, zs, a, b, c), []])
+        edges[a, b] = f
+        edges[b, c] = f
+        edges[c, a] = f
+        return f
+
+    new = [add_face(i0, i1, i2), add_face(i0, i3, i1),
+           add_face(i1, i3, i2), add_face(i2, i3, i0)]
+    candidates = [i for i in range(n) if i not in (i0, i1, i2, i3)]
+    pending = []
+
+    while True:
+        for i in candidates:
+            for f in new:
+                if dist(faces[f][3], i) > eps:
+                    faces[f][4].append(i)
+                    break
+        pending.extend(f for f in new if faces[f][4])
+        while pending and faces[pending[-1]] is None:
+            pending.pop()
+        if not pending:
+            break
+
+        # Farthest outside point of the face, and the faces it can see
+        start = pending.pop()
+        plane = faces[start][3]
+        p = max(faces[start][4], key=lambda i: dist(plane, i))
+        visible = set([start])
+        stack = [start]
+        horizon = []
+        while stack:
+            f = stack.pop()
+            a, b, c = faces[f][:3]
+            for edge in ((a, b), (b, c), (c, a)):
+                g = edges[edge[1], edge[0]]
+                if g in visible:
+                    continue
+                if dist(faces[g][3], p) > eps:
+                    visible.add(g)
+                    stack.append(g)
+                else:
+                    horizon.append(edge)
+
+        candidates = []
+        for f in visible:
+            a, b, c, plane, outside = faces[f]
+            candidates.extend(outside)
+            for edge in ((a, b), (b, c), (c, a)):
+                if edges.get(edge) == f:
+                    del edges[edge]
+            faces[f] = None
+        candidates = [i for i in candidates if i != p]
+        new = [add_face(a, b, p) for a, b in horizon]
+
+    faces = [tuple(face[:3]) for face in faces if face is not None]
+    indices = sorted(set(i for face in faces for i in face))
+    return indices, faces
+
+def _line3_range(L):
+    # parameter range of a line, ray or line segment
+    if isinstance(L, LineSegment3):
+        return 0.0, 1.0
+    elif isinstance(L, Ray3):
+        return 0.0, float('inf')
+    return float('-inf'), float('inf')
+
+class TriangleMesh3(Slotted):
+    '''An indexed triangle mesh.
+
+    Vertices are held in a flat array of coordinates and triangles in a
+    flat array of vertex indices.  A bounding volume hierarchy over the
+    triangles is built on the first intersection query.
+    '''
+    __slots__ = ['vertices', 'triangles', '_tris', '_bvh', '_bounds']
+
+    def __init__(self, vertices, triangles):
+        xs, ys, zs = _coords3(vertices)
+        coords = array.array('d', [0.0]) * (3 * len(xs))
+        coords[0::3] = array.array('d', xs)
+        coords[1::3] = array.array('d', ys)
+        coords[2::3] = array.array('d', zs)
+        self.vertices = coords
+        if not hasattr(triangles, '__len__'):
+            triangles = list(triangles)
+        if len(triangles) and not isinstance(triangles[0], numbers.Integral):
+            triangles = [i for triangle in triangles for i in triangle]
+        self.triangles = array.array('l', triangles)
+        if len(self.triangles) % 3:
+            raise AttributeError('Triangle indices are not a multiple of 3')
+        self._tris = None
+        self._bvh = None
+        self._bounds = None
+
+    def __copy__(self):
+        return self.__class__(self.vertices, self.triangles)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'TriangleMesh3(%d vertices, %d triangles)' % \
+            (len(self.vertices) // 3, len(self.triangles) // 3)
+
+    def __len__(self):
+        return len(self.triangles) // 3
+
+    def _apply_transform(self, t):
+        v = self.vertices
+        for i in range(0, len(v), 3):
+            p = t * Point3(v[i], v[i + 1], v[i + 2])
+            v[i] = p.x
+            v[i + 1] = p.y
+            v[i + 2] = p.z
+        self._tris = None
+        self._bvh = None
+        self._bounds = None
+
+    def _get_bounds(self):
+        bounds = self._bounds
+        if bounds is None:
+            bounds = self._bounds = AABB3.new_bounding(self.vertices)
+        return bounds
+    bounds = property(_get_bounds, doc='Cached AABB3 containing the mesh')
+
+    def support(self, direction):
+        # Vertex of the mesh's convex hull furthest along direction
+        x, y, z = direction
+        vs = self.vertices
+        i = max(range(0, len(vs), 3),
+                key=lambda i: vs[i] * x + vs[i + 1] * y + vs[i + 2] * z)
+        return Point3(vs[i], vs[i + 1], vs[i + 2])
+
+    def _build(self):
+        # Per triangle: vertex 0 and the two edges from it.
+        v = self.vertices
+        tri = self.triangles
+        tris = []
+        centroids = []
+        boxes = []
+        for n in range(0, len(tri), 3):
+            a = 3 * tri[n]
+            b = 3 * tri[n + 1]
+            c = 3 * tri[n + 2]
+            ax, ay, az = v[a], v[a + 1], v[a + 2]
+            bx, by, bz = v[b], v[b + 1], v[b + 2]
+            cx, cy, cz = v[c], v[c + 1], v[c + 2]
+            tris.append((ax, ay, az, bx - ax, by - ay, bz - az,
+                         cx - ax, cy - ay, cz - az))
+            centroids.append(((ax + bx + cx) / 3,
+                              (ay + by + cy) / 3,
+                              (az + bz + cz) / 3))
+            boxes.append((min(ax, bx, cx), min(ay, by, cy), min(az, bz, cz),
+                          max(ax, bx, cx), max(ay, by, cy), max(az, bz, cz)))
+        self._tris = tris
+
+        # Nodes are [minx, miny, minz, maxx, maxy, maxz, left, right,
+        # triangles]; leaves have a list of triangles and no children.
+        nodes = []
+
+        def build(order):
+            box = boxes[order[0]]
+            lo = list(box[:3])
+            hi = list(box[3:])
+            for i in order:
+                box = boxes[i]
+                for axis in range(3):
+                    if box[axis] < lo[axis]:
+                        lo[axis] = box[axis]
+                    if box[axis + 3] > hi[axis]:
+                        hi[axis] = box[axis + 3]
+            node = lo + hi + [None, None, None]
+            nodes.append(node)
+            if len(order) <= 4:
+                node[8] = order
+                return len(nodes) - 1
+            cmin = [min(centroids[i][axis] for i in order)
+                    for axis in range(3)]
+            cmax = [max(centroids[i][axis] for i in order)
+                    for axis in range(3)]
+            axis = max(range(3), key=lambda axis: cmax[axis] - cmin[axis])
+            order = sorted(order, key=lambda i: centroids[i][axis])
+            mid = len(order) // 2
+            index = len(nodes) - 1
+            node[6] = build(order[:mid])
+            node[7] = build(order[mid:])
+            return index
+
+        if tris:
+            build(list(range(len(tris))))
+        self._bvh = nodes
+
+    def _intersect(self, px, py, pz, vx, vy, vz, tmin, tmax):
+        if self._bvh is None:
+            self._build()
+        nodes = self._bvh
+        if not nodes:
+            return None
+        tris = self._tris
+        inf = float('inf')
+        ix = 1.0 / vx if vx else inf
+        iy = 1.0 / vy if vy else inf
+        iz = 1.0 / vz if vz else inf
+        best = None
+        stack = [0]
+        while stack:
+            node = nodes[stack.pop()]
+
+            # slab test against the node bounds
+            t0 = tmin
+            t1 = tmax
+            for p, inv, lo, hi in ((px, ix, node[0], node[3]),
+                                   (py, iy, node[1], node[4]),
+                                   (pz, iz, node[2], node[5])):
+                if inv == inf:
+                    if p < lo or p > hi:
+                        t0 = inf
+                        break
+                    continue
+                ta = (lo - p) * inv
+                tb = (hi - p) * inv
+                if ta > tb:
+                    ta, tb = tb, ta
+                if ta > t0:
+                    t0 = ta
+                if tb < t1:
+                    t1 = tb
+                if t0 > t1:
+                    break
+            if t0 > t1:
+                continue
+
+            if node[8] is None:
+                stack.append(node[6])
+                stack.append(node[7])
+                continue
+
+            # Moller-Trumbore against each triangle in the leaf
+            for n in node[8]:
+                ax, ay, az, e1x, e1y, e1z, e2x, e2y, e2z = tris[n]
+                qx = vy * e2z - vz * e2y
+                qy = vz * e2x - vx * e2z
+                qz = vx * e2y - vy * e2x
+                det = e1x * qx + e1y * qy + e1z * qz
+                if not det:
+                    continue
+                inv = 1.0 / det
+                sx = px - ax
+                sy = py - ay
+                sz = pz - az
+                u = (sx * qx + sy * qy + sz * qz) * inv
+                if u < 0.0 or u > 1.0:
+                    continue
+                rx = sy * e1z - sz * e1y
+                ry = sz * e1x - sx * e1z
+                rz = sx * e1y - sy * e1x
+                w = (vx * rx + vy * ry + vz * rz) * inv
+                if w < 0.0 or u + w > 1.0:
+                    continue
+                t = (e2x * rx + e2y * ry + e2z * rz) * inv
+                if tmin <= t <= tmax:
+                    tmax = t
+                    best = (t, n, u, w)
+        return best
+
+    def intersect(self, other):
+        '''First hit of a line, ray or line segment on the mesh, as a
+        tuple (t, index, u, v), or None.  t is the line parameter of the
+        hit, which is its distance from other.p in units of abs(other.v).
+        '''
+        return other._intersect_triangle_mesh3(self)
+
+    def _intersect_line3(self, other):
+        tmin, tmax = _line3_range(other)
+        return self._intersect(other.p.x, other.p.y, other.p.z,
+                               other.v.x, other.v.y, other.v.z, tmin, tmax)
+
+    def intersect_many(self, lines):
+        '''Intersect each of a sequence of lines, rays or line segments
+        with the mesh, returning a list of results as for intersect().
+        lines may also be a flat buffer in the layout of pack_lines3.'''
+        if self._bvh is None:
+            self._build()
+        intersect = self._intersect
+        return [intersect(px, py, pz, vx, vy, vz, tmin, tmax)
+                for px, py, pz, vx, vy, vz, tmin, tmax
+                in _records(_bulk(lines, pack_lines3), 8)]
+
+def _line3_bounds(L):
+    u0, u1 = _line3_range(L)
+    x0, x1 = _line_extent(L.p.x, L.v.x, u0, u1)
+    y0, y1 = _line_extent(L.p.y, L.v.y, u0, u1)
+    z0, z1 = _line_extent(L.p.z, L.v.z, u0, u1)
+    return AABB3(Point3(x0, y0, z0), Point3(x1, y1, z1))
+
+def _intersect_line3_aabb3(L, B):
+    u0, u1 = _line3_range(L)
+    for p, v, lo, hi in ((L.p.x, L.v.x, B.minx, B.maxx),
+                         (L.p.y, L.v.y, B.miny, B.maxy),
+                         (L.p.z, L.v.z, B.minz, B.maxz)):
+        if v:
+            ua = (lo - p) / v
+            ub = (hi - p) / v
+            if ua > ub:
+                ua, ub = ub, ua
+            if ua > u0:
+                u0 = ua
+            if ub < u1:
+                u1 = ub
+        elif p < lo or p > hi:
+            return None
+    if u0 > u1:
+        return None
+    return LineSegment3(Point3(L.p.x + u0 * L.v.x,
+                               L.p.y + u0 * L.v.y,
+                               L.p.z + u0 * L.v.z),
+                        Point3(L.p.x + u1 * L.v.x,
+                               L.p.y + u1 * L.v.y,
+                               L.p.z + u1 * L.v.z))
+
+def _intersect_sphere_aabb3(S, B):
+    dx = S.c.x - _clamp(S.c.x, B.minx, B.maxx)
+    dy = S.c.y - _clamp(S.c.y, B.miny, B.maxy)
+    dz = S.c.z - _clamp(S.c.z, B.minz, B.maxz)
+    return dx ** 2 + dy ** 2 + dz ** 2 <= S.r ** 2
+
+def _plane_aabb3_range(P, B):
+    # Range of n.p over the box.  Axes the normal ignores are skipped, so
+    # that infinite extents along them (as in the bounds of planes and
+    # lines) do not give inf * 0.
+    lo = hi = 0.
+    for c, a, b in ((P.n.x, B.minx, B.maxx), (P.n.y, B.miny, B.maxy),
+                    (P.n.z, B.minz, B.maxz)):
+        if c:
+            a *= c
+            b *= c
+            if a > b:
+                a, b = b, a
+            lo += a
+            hi += b
+    return lo, hi
+
+def _intersect_plane_aabb3(P, B):
+    lo, hi = _plane_aabb3_range(P, B)
+    return lo <= P.k <= hi
+
+def _intersect_aabb3_aabb3(A, B):
+    minx = max(A.minx, B.minx)
+    miny = max(A.miny, B.miny)
+    minz = max(A.minz, B.minz)
+    maxx = min(A.maxx, B.maxx)
+    maxy = min(A.maxy, B.maxy)
+    maxz = min(A.maxz, B.maxz)
+    if minx > maxx or miny > maxy or minz > maxz:
+        return None
+    return AABB3(Point3(minx, miny, minz), Point3(maxx, maxy, maxz))
+
+def _connect_point3_aabb3(P, B):
+    x = _clamp(P.x, B.minx, B.maxx)
+    y = _clamp(P.y, B.miny, B.maxy)
+    z = _clamp(P.z, B.minz, B.maxz)
+    if x == P.x and y == P.y and z == P.z:
+        # Inside
+        return None
+    return LineSegment3(P, Point3(x, y, z))
+
+def _connect_line3_aabb3(L, B):
+    if _intersect_line3_aabb3(L, B) is not None:
+        return None
+    # The line misses the box, so the closest points are on a box edge and
+    # the line, or an end-point of the line and the box.
+    best = None
+    corners = B._corners()
+    for i, j in ((0, 1), (2, 3), (4, 5), (6, 7), (0, 2), (1, 3),
+                 (4, 6), (5, 7), (0, 4), (1, 5), (2, 6), (3, 7)):
+        if corners[i] == corners[j]:
+            # flat box
+            continue
+        c = _connect_line3_line3(L, LineSegment3(corners[i], corners[j]))
+        if best is None or c.magnitude_squared() < best.magnitude_squared():
+            best = c
+    ends = []
+    if isinstance(L, (Ray3, LineSegment3)):
+        ends.append(L.p1)
+    if isinstance(L, LineSegment3):
+        ends.append(L.p2)
+    for p in ends:
+        c = _connect_point3_aabb3(p, B)
+        if c.magnitude_squared() < best.magnitude_squared():
+            best = c
+    return best
+
+def _connect_sphere_aabb3(S, B):
+    x = _clamp(S.c.x, B.minx, B.maxx)
+    y = _clamp(S.c.y, B.miny, B.maxy)
+    z = _clamp(S.c.z, B.minz, B.maxz)
+    d = math.sqrt((x - S.c.x) ** 2 + (y - S.c.y) ** 2 + (z - S.c.z) ** 2)
+    if d <= S.r:
+        return None
+    s = S.r / d
+    return LineSegment3(Point3(S.c.x + (x - S.c.x) * s,
+                               S.c.y + (y - S.c.y) * s,
+                               S.c.z + (z - S.c.z) * s),
+                        Point3(x, y, z))
+
+def _connect_plane_aabb3(P, B):
+    lo, hi = _plane_aabb3_range(P, B)
+    if lo <= P.k <= hi:
+        return None
+    # The point of the box furthest along the normal, or against it,
+    # whichever side the plane is on; any point along axes the normal
+    # ignores, which may be unbounded.
+    front = P.k > hi
+    coords = []
+    for c, a, b in ((P.n.x, B.minx, B.maxx), (P.n.y, B.miny, B.maxy),
+                    (P.n.z, B.minz, B.maxz)):
+        if not c:
+            coords.append(_clamp(0., a, b))
+        else:
+            coords.append(b if (c > 0) == front else a)
+    return _connect_point3_plane(Point3(*coords), P)._swap()
+
+def _connect_aabb3_aabb3(A, B):
+    if _intersect_aabb3_aabb3(A, B) is not None:
+        return None
+    ax, bx = _closest_interval(A.minx, A.maxx, B.minx, B.maxx)
+    ay, by = _closest_interval(A.miny, A.maxy, B.miny, B.maxy)
+    az, bz = _closest_interval(A.minz, A.maxz, B.minz, B.maxz)
+    return LineSegment3(Point3(ax, ay, az), Point3(bx, by, bz))
+
+class AABB3(Slotted):
+    '''Axis-aligned bounding box in 3D, given by two opposite corners.'''
+    __slots__ = ['minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz']
+    __hash__ = None
+
+    def __init__(self, p1, p2):
+        assert isinstance(p1, Vector3) and isinstance(p2, Vector3)
+        self.minx = min(p1.x, p2.x)
+        self.miny = min(p1.y, p2.y)
+        self.minz = min(p1.z, p2.z)
+        self.maxx = max(p1.x, p2.x)
+        self.maxy = max(p1.y, p2.y)
+        self.maxz = max(p1.z, p2.z)
+
+    def __copy__(self):
+        return self.__class__(self.p1, self.p2)
+
+    copy = __copy__
+
+    def __eq__(self, other):
+        return isinstance(other, AABB3) and \
+            self.minx == other.minx and self.miny == other.miny and \
+            self.minz == other.minz and self.maxx == other.maxx and \
+            self.maxy == other.maxy and self.maxz == other.maxz
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'AABB3(<%.2f, %.2f, %.2f> to <%.2f, %.2f, %.2f>)' % \
+            (self.minx, self.miny, self.minz, self.maxx, self.maxy, self.maxz)
+
+    p1 = property(lambda self: Point3(self.minx, self.miny, self.minz),
+                  doc='Minimum corner')
+    p2 = property(lambda self: Point3(self.maxx, self.maxy, self.maxz),
+                  doc='Maximum corner')
+    center = property(lambda self: Point3((self.minx + self.maxx) / 2,
+                                          (self.miny + self.maxy) / 2,
+                                          (self.minz + self.maxz) / 2))
+    bounds = property(lambda self: self)
+
+    def new_bounding(cls, points):
+        xs, ys, zs = _coords3(points)
+        return cls(Point3(min(xs), min(ys), min(zs)),
+                   Point3(max(xs), max(ys), max(zs)))
+    new_bounding = classmethod(new_bounding)
+
+    def _corners(self):
+        return [Point3(x, y, z) for x in (self.minx, self.maxx)
+                                for y in (self.miny, self.maxy)
+                                for z in (self.minz, self.maxz)]
+
+    def _apply_transform(self, t):
+        corners = [t * p for p in self._corners()]
+        self.minx = min(p.x for p in corners)
+        self.miny = min(p.y for p in corners)
+        self.minz = min(p.z for p in corners)
+        self.maxx = max(p.x for p in corners)
+        self.maxy = max(p.y for p in corners)
+        self.maxz = max(p.z for p in corners)
+
+    def contains(self, point):
+        return self.minx <= point.x <= self.maxx and \
+               self.miny <= point.y <= self.maxy and \
+               self.minz <= point.z <= self.maxz
+
+    def support(self, direction):
+        return Point3(direction.x > 0 and self.maxx or self.minx,
+                      direction.y > 0 and self.maxy or self.miny,
+                      direction.z > 0 and self.maxz or self.minz)
+
+    def overlaps(self, other):
+        '''Return True if the box overlaps the AABB3 other.'''
+        return self.minx <= other.maxx and other.minx <= self.maxx and \
+               self.miny <= other.maxy and other.miny <= self.maxy and \
+               self.minz <= other.maxz and other.minz <= self.maxz
+
+    def intersect(self, other):
+        return other._intersect_aabb3(self)
+
+    def _intersect_point3(self, other):
+        return self.contains(other)
+
+    def _intersect_line3(self, other):
+        return _intersect_line3_aabb3(other, self)
+
+    def _intersect_sphere(self, other):
+        return _intersect_sphere_aabb3(other, self)
+
+    def _intersect_plane(self, other):
+        return _intersect_plane_aabb3(other, self)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_aabb3_aabb3(other, self)
+
+    def _intersect_obb3(self, other):
+        return _intersect_aabb3_obb3(self, other)
+
+    def connect(self, other):
+        return other._connect_aabb3(self)
+
+    def _connect_point3(self, other):
+        return _connect_point3_aabb3(other, self)
+
+    def _connect_line3(self, other):
+        return _connect_line3_aabb3(other, self)
+
+    def _connect_sphere(self, other):
+        return _connect_sphere_aabb3(other, self)
+
+    def _connect_plane(self, other):
+        return _connect_plane_aabb3(other, self)
+
+    def _connect_aabb3(self, other):
+        return _connect_aabb3_aabb3(other, self)
+
+# GJK and EPA
+# ---------------------------------------------------------------------------
+# Work on any convex shape with a support(direction) method returning the
+# point of the shape furthest along direction.
+
+_GJK_EPS = 1e-10
+_GJK_MAX_ITERATIONS = 64
+_EPA_EPS = 1e-8
+_EPA_MAX_ITERATIONS = 128
+
+class GJKCache(Slotted):
+    '''Simplex kept between calls on the same pair of shapes.
+
+    Passing the same cache to each frame's query starts the search from the
+    previous frame's simplex, which usually converges in one or two steps
+    when the shapes have moved only a little.
+    '''
+    __slots__ = ['directions', 'iterations']
+
+    def __init__(self):
+        self.directions = []
+        self.iterations = 0
+
+    def __repr__(self):
+        return 'GJKCache(%d directions)' % len(self.directions)
+
+def _gjk_support(a, b, d):
+    # Vertex of the Minkowski difference a - b, with its two parts and the
+    # search direction that found it.
+    sa = a.support(d)
+    sb = b.support(-d)
+    return (Vector3(sa.x - sb.x, sa.y - sb.y, sa.z - sb.z), sa, sb, d)
+
+def _gjk_barycentric(ws):
+    # Barycentric coordinates of the point nearest the origin on the affine
+    # hull of ws, or None if the points are affinely dependent.
+    if len(ws) == 1:
+        return [1.]
+    y = ws[0]
+    es = [w - y for w in ws[1:]]
+    n = len(es)
+    m = [[ei.dot(ej) for ej in es] + [-ei.dot(y)] for ei in es]
+    scale = max([m[i][i] for i in range(n)])
+    for i in range(n):
+        p = max(range(i, n), key=lambda r: abs(m[r][i]))
+        if abs(m[p][i]) <= 1e-12 * scale:
+            return None
+        m[i], m[p] = m[p], m[i]
+        for r in range(i + 1, n):
+            f = m[r][i] / m[i][i]
+            for c in range(i, n + 1):
+                m[r][c] -= f * m[i][c]
+    mu = [0.] * n
+    for i in range(n - 1, -1, -1):
+        mu[i] = (m[i][n] - sum([m[i][c] * mu[c]
+                                for c in range(i + 1, n)])) / m[i][i]
+    return [1 - sum(mu)] + mu
+
+def _gjk_closest(W):
+    # Point of the hull of the simplex W nearest the origin, and the
+    # smallest sub-simplex containing it.
+    best = None
+    for k in range(1, len(W) + 1):
+        for sub in itertools.combinations(W, k):
+            lam = _gjk_barycentric([e[0] for e in sub])
+            if lam is None or min(lam) < 0:
+                continue
+            v = Vector3()
+            for l, e in zip(lam, sub):
+                v += e[0] * l
+            d = v.magnitude_squared()
+            if best is None or d < best[0]:
+                best = (d, v, list(sub), lam)
+    return best
+
+def _gjk(a, b, cache):
+    W = []
+    for d in cache and cache.directions or [Vector3(1., 0., 0.)]:
+        e = _gjk_support(a, b, d)
+        if not [f for f in W if f[0] == e[0]]:
+            W.append(e)
+    dist2, v, W, lam = _gjk_closest(W)
+    iterations = 0
+    overlap = False
+    while iterations < _GJK_MAX_ITERATIONS:
+        scale = max([e[0].magnitude_squared() for e in W])
+        if len(W) == 4 or dist2 <= _GJK_EPS ** 2 * scale:
+            overlap = True
+            break
+        iterations += 1
+        e = _gjk_support(a, b, -v)
+        if dist2 - v.dot(e[0]) <= _GJK_EPS * dist2 or \
+           [f for f in W if f[0] == e[0]]:
+            break
+        dist2, v, W, lam = _gjk_closest(W + [e])
+    if cache is not None:
+        cache.directions = [e[3] for e in W]
+        cache.iterations = iterations
+    return dist2, W, lam, overlap
+
+def _gjk_core(shape):
+    # Spheres are run as their center point grown by the radius, which
+    # converges in a step or two instead of polishing a curved surface.
+    if isinstance(shape, Sphere):
+        return shape.c, shape.r
+    return shape, 0.
+
+def _gjk_closest_points(W, lam, ra, rb):
+    pa = Point3()
+    pb = Point3()
+    for l, e in zip(lam, W):
+        pa += e[1] * l
+        pb += e[2] * l
+    n = (pb - pa).normalized()
+    return pa + n * ra, pb - n * rb
+
+def gjk_connect(a, b, cache=None):
+    '''Shortest LineSegment3 from convex shape a to convex shape b.
+
+    Returns None if the shapes overlap.  Both shapes must provide
+    support(direction); cache is an optional GJKCache.
+    '''
+    a, ra = _gjk_core(a)
+    b, rb = _gjk_core(b)
+    dist2, W, lam, overlap = _gjk(a, b, cache)
+    if overlap or dist2 <= (ra + rb) ** 2:
+        return None
+    return LineSegment3(*_gjk_closest_points(W, lam, ra, rb))
+
+def gjk_distance(a, b, cache=None):
+    '''Distance between convex shapes a and b, or 0 if they overlap.'''
+    a, ra = _gjk_core(a)
+    b, rb = _gjk_core(b)
+    dist2, W, lam, overlap = _gjk(a, b, cache)
+    if overlap:
+        return 0.
+    return max(math.sqrt(dist2) - ra - rb, 0.)
+
+def _epa_face(pts, i, j, k, inside):
+    n = (pts[j][0] - pts[i][0]).cross(pts[k][0] - pts[i][0])
+    if n.dot(pts[i][0] - inside) < 0:
+        i, j = j, i
+        n = -n
+    if not n:
+        # Sliver face; never the nearest, never visible
+        return (i, j, k, n, float('inf'))
+    n.normalize()
+    return (i, j, k, n, n.dot(pts[i][0]))
+
+def epa_penetration(a, b, cache=None):
+    '''Penetration depth of overlapping convex shapes a and b.
+
+    Returns a tuple (depth, normal), where moving b by normal * depth
+    separates the shapes, or None if they do not overlap.
+    '''
+    a, ra = _gjk_core(a)
+    b, rb = _gjk_core(b)
+    margin = ra + rb
+    dist2, pts, lam, overlap = _gjk(a, b, cache)
+    if not overlap:
+        if dist2 > margin ** 2:
+            return None
+        # Only the spheres' margins overlap
+        pa, pb = _gjk_closest_points(pts, lam, 0., 0.)
+        return margin - math.sqrt(dist2), (pb - pa).normalized()
+    # Grow the simplex into a tetrahedron; it still contains the origin.
+    axes = [Vector3(1., 0., 0.), Vector3(0., 1., 0.), Vector3(0., 0., 1.)]
+    while len(pts) < 4:
+        if len(pts) == 1:
+            dirs = axes
+        elif len(pts) == 2:
+            dirs = [(pts[1][0] - pts[0][0]).cross(d) for d in axes]
+        else:
+            n = (pts[1][0] - pts[0][0]).cross(pts[2][0] - pts[0][0])
+            dirs = [n]
+        for d in dirs + [-d for d in dirs]:
+            e = _gjk_support(a, b, d)
+            w = e[0] - pts[0][0]
+            if len(pts) == 1:
+                grows = w.magnitude_squared() > 0
+            elif len(pts) == 2:
+                grows = bool((pts[1][0] - pts[0][0]).cross(w))
+            else:
+                grows = abs(n.dot(w)) > _GJK_EPS * n.magnitude() * abs(w)
+            if grows:
+                pts.append(e)
+                break
+        else:
+            # The Minkowski difference is flat, so the cores only touch.
+            return margin, max(dirs, key=abs).normalized()
+    inside = (pts[0][0] + pts[1][0] + pts[2][0] + pts[3][0]) / 4
+    faces = [_epa_face(pts, i, j, k, inside)
+             for i, j, k in ((0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3))]
+    for iteration in range(_EPA_MAX_ITERATIONS):
+        face = min(faces, key=lambda f: f[4])
+        e = _gjk_support(a, b, face[3])
+        if e[0].dot(face[3]) - face[4] <= _EPA_EPS * (1 + face[4]):
+            break
+        pts.append(e)
+        w = e[0]
+        visible = [f for f in faces if f[3].dot(w - pts[f[0]][0]) > 0]
+        edges = set()
+        for f in visible:
+            for edge in ((f[0], f[1]), (f[1], f[2]), (f[2], f[0])):
+                if (edge[1], edge[0]) in edges:
+                    edges.remove((edge[1], edge[0]))
+                else:
+                    edges.add(edge)
+        faces = [f for f in faces if f not in visible] + \
+                [_epa_face(pts, i, j, len(pts) - 1, inside)
+                 for i, j in edges]
+    return face[4] + margin, face[3]
+
+# Dispatch registry
+# ---------------------------------------------------------------------------
+# a.intersect(b) bounces through b._intersect_<type of a>(a) before reaching
+# the function doing the work.  The registry maps a pair of types straight
+# to that function, resolving subclasses once per pair of concrete types and
+# caching the result in a dictionary of dictionaries keyed by type.
+
+_intersect_functions = {}
+_connect_functions = {}
+_intersect_resolved = {}
+_connect_resolved = {}
+
+def _registered(functions, a, b):
+    # Most specific function registered for the types of a and b, or None
+    for type_a in type(a).__mro__:
+        for type_b in type(b).__mro__:
+            entry = functions.get((type_a, type_b))
+            if entry:
+                return entry[0]
+    return None
+
+def _register(functions, resolved, type_a, type_b, function, reverse):
+    functions[(type_a, type_b)] = (function, True)
+    entry = functions.get((type_b, type_a))
+    if type_a is not type_b and not (entry and entry[1]):
+        functions[(type_b, type_a)] = (reverse(function), False)
+    resolved.clear()
+
+def _reverse_intersect(function):
+    return lambda a, b: function(b, a)
+
+def _reverse_connect(function):
+    def connect(a, b):
+        c = function(b, a)
+        if c:
+            return c._swap()
+    return connect
+
+def register_intersect(type_a, type_b, function):
+    '''Register function(a, b) to intersect instances of type_a and type_b.
+
+    The reverse pair is handled by swapping the arguments, unless it has a
+    function of its own.  Subclasses use the function of their nearest
+    registered base class.
+    '''
+    _register(_intersect_functions, _intersect_resolved,
+              type_a, type_b, function, _reverse_intersect)
+
+def register_connect(type_a, type_b, function):
+    '''Register function(a, b) to connect instances of type_a and type_b.
+
+    function returns a LineSegment2 or LineSegment3 from a to b; the
+    reverse pair swaps the ends of the segment, unless it has a function of
+    its own.
+    '''
+    _register(_connect_functions, _connect_resolved,
+              type_a, type_b, function, _reverse_connect)
+
+def _resolve(functions, resolved, a, b, method):
+    function = _registered(functions, a, b)
+    if function is None:
+        # Fall back to the shapes' own double dispatch
+        function = method
+    if _profiling:
+        function = _profile_wrap(
+            functions is _intersect_functions and 'intersect' or 'connect',
+            function)
+    resolved.setdefault(type(a), {})[type(b)] = function
+    return function
+
+def intersect(a, b):
+    '''Same as a.intersect(b), calling the registered function directly.'''
+    try:
+        function = _intersect_resolved[type(a)][type(b)]
+    except KeyError:
+        function = _resolve(_intersect_functions, _intersect_resolved, a, b,
+                            lambda a, b: a.intersect(b))
+    return function(a, b)
+
+def connect(a, b):
+    '''Same as a.connect(b), calling the registered function directly.'''
+    try:
+        function = _connect_resolved[type(a)][type(b)]
+    except KeyError:
+        function = _resolve(_connect_functions, _connect_resolved, a, b,
+                            lambda a, b: a.connect(b))
+    return function(a, b)
+
+def _contained(point, shape):
+    return shape.contains(point)
+
+def _connect_point2_point2(A, B):
+    return LineSegment2(A, B)
+
+def _connect_point3_point3(A, B):
+    if A != B:
+        return LineSegment3(A, B)
+    return None
+
+for _a, _b, _function in (
+        (Point2, Circle, _intersect_point2_circle),
+        (Point2, Polygon2, _contained),
+        (Point2, AABB2, _contained),
+        (Line2, Line2, _reverse_intersect(_intersect_line2_line2)),
+        (Line2, Circle, _intersect_line2_circle),
+        (Line2, AABB2, _intersect_line2_aabb2),
+        (Circle, AABB2, _intersect_circle_aabb2),
+        (AABB2, AABB2, _intersect_aabb2_aabb2),
+        (Point3, Sphere, _intersect_point3_sphere),
+        (Point3, AABB3, _contained),
+        (Line3, Sphere, _intersect_line3_sphere),
+        (Line3, Plane, _intersect_line3_plane),
+        (Line3, TriangleMesh3, lambda L, M: M._intersect_line3(L)),
+        (Line3, AABB3, _intersect_line3_aabb3),
+        (Sphere, AABB3, _intersect_sphere_aabb3),
+        (Plane, Plane, _reverse_intersect(_intersect_plane_plane)),
+        (Plane, AABB3, _intersect_plane_aabb3),
+        (AABB3, AABB3, _intersect_aabb3_aabb3)):
+    register_intersect(_a, _b, _function)
+
+for _a, _b, _function in (
+        (Point2, Point2, _connect_point2_point2),
+        (Point2, Line2, _connect_point2_line2),
+        (Point2, Circle, _connect_point2_circle),
+        (Point2, Polygon2, _connect_point2_polygon2),
+        (Point2, AABB2, _connect_point2_aabb2),
+        (Line2, Line2, _connect_line2_line2),
+        (Line2, AABB2, _connect_line2_aabb2),
+        (Circle, Line2, _connect_circle_line2),
+        (Circle, Circle, _connect_circle_circle),
+        (Circle, AABB2, _connect_circle_aabb2),
+        (AABB2, AABB2, _connect_aabb2_aabb2),
+        (Point3, Point3, _connect_point3_point3),
+        (Point3, Line3, _connect_point3_line3),
+        (Point3, Sphere, _connect_point3_sphere),
+        (Point3, Plane, _connect_point3_plane),
+        (Point3, AABB3, _connect_point3_aabb3),
+        (Line3, Line3, _connect_line3_line3),
+        (Line3, Plane, _connect_line3_plane),
+        (Line3, AABB3, _connect_line3_aabb3),
+        (Sphere, Line3, _connect_sphere_line3),
+        (Sphere, Sphere, _connect_sphere_sphere),
+        (Sphere, Plane, _connect_sphere_plane),
+        (Sphere, AABB3, _connect_sphere_aabb3),
+        (Plane, Plane, _connect_plane_plane),
+        (Plane, AABB3, _connect_plane_aabb3),
+        (AABB3, AABB3, _connect_aabb3_aabb3)):
+    register_connect(_a, _b, _function)
+del _a, _b, _function
+
+# Streams
+# ---------------------------------------------------------------------------
+# Generators passing points along in chunks, each a flat array('d') of
+# x, y, z triples.  Every stage holds a single chunk at a time, so point
+# clouds of any size pass through in bounded memory.
+
+def stream_chunks(buffers, size=4096):
+    '''Regroup an iterable of flat coordinate buffers into chunks.
+
+    Each chunk yielded holds size points, except perhaps the last.
+    '''
+    n = 3 * size
+    pending = array.array('d')
+    for buf in buffers:
+        if not (isinstance(buf, array.array) and buf.typecode == 'd'):
+            buf = array.array('d', buf)
+        pending.extend(buf)
+        start = 0
+        while len(pending) - start >= n:
+            yield pending[start:start + n]
+            start += n
+        del pending[:start]
+    if pending:
+        assert len(pending) % 3 == 0, 'Buffers do not hold whole points'
+        yield pending
+
+def stream_transform(chunks, matrix):
+    '''Transform each point by the Matrix4, as matrix * Point3 does, with
+    the selected backend.'''
+    m = _pack_affine(matrix)
+    for chunk in chunks:
+        yield _double_array(get_backend().transform_points3(chunk, m))
+
+def stream_project(chunks, matrix):
+    '''Transform each point with perspective division, as
+    Matrix4.transform does.'''
+    a, b, c, d = matrix.a, matrix.b, matrix.c, matrix.d
+    e, f, g, h = matrix.e, matrix.f, matrix.g, matrix.h
+    i, j, k, l = matrix.i, matrix.j, matrix.k, matrix.l
+    m, n, o, p = matrix.m, matrix.n, matrix.o, matrix.p
+    for chunk in chunks:
+        out = array.array('d', chunk)
+        for s in range(0, len(chunk), 3):
+            x, y, z = chunk[s], chunk[s + 1], chunk[s + 2]
+            w = m * x + n * y + o * z + p
+            if w == 0:
+                w = 1
+            out[s] = (a * x + b * y + c * z + d) / w
+            out[s + 1] = (e * x + f * y + g * z + h) / w
+            out[s + 2] = (i * x + j * y + k * z + l) / w
+        yield out
+
+def _stream_select(chunks, keep):
+    for chunk in chunks:
+        out = array.array('d', [v for p in zip(chunk[0::3], chunk[1::3],
+                                                 chunk[2::3])
+                                  if keep(*p) for v in p])
+        if out:
+            yield out
+
+def stream_filter_plane(chunks, plane, front=True):
+    '''Keep the points in front of the Plane (n.p >= k), or with front
+    False, the points behind it.'''
+    nx, ny, nz = plane.n
+    k = plane.k
+    if front:
+        keep = lambda x, y, z: nx * x + ny * y + nz * z >= k
+    else:
+        keep = lambda x, y, z: nx * x + ny * y + nz * z < k
+    return _stream_select(chunks, keep)
+
+def stream_clip_sphere(chunks, sphere, inside=True):
+    '''Keep the points inside the Sphere, or with inside False, the points
+    outside it.'''
+    cx, cy, cz = sphere.c
+    r2 = sphere.r ** 2
+    if inside:
+        keep = lambda x, y, z: (x - cx) ** 2 + (y - cy) ** 2 + \
+                               (z - cz) ** 2 <= r2
+    else:
+        keep = lambda x, y, z: (x - cx) ** 2 + (y - cy) ** 2 + \
+                               (z - cz) ** 2 > r2
+    return _stream_select(chunks, keep)
+
+# Parallel batch execution
+# ---------------------------------------------------------------------------
+# Batches of lines are packed into flat arrays of doubles, eight per line
+# (p, v and the parameter range), and tested against packed planes
+# (n, k) or spheres (c, r), four doubles each; points are packed three
+# doubles each.  A ParallelExecutor splits the batch over a pool of
+# processes which share the packed arrays, and the results, through shared
+# memory; a ThreadedExecutor splits it over a pool of threads.
+
+def pack_lines3(lines):
+    '''Pack Line3, Ray3 and LineSegment3 objects into an array('d').'''
+    if isinstance(lines, array.array):
+        return lines
+    out = array.array('d')
+    for L in lines:
+        tmin, tmax = _line3_range(L)
+        out.extend((L.p.x, L.p.y, L.p.z, L.v.x, L.v.y, L.v.z, tmin, tmax))
+    return out
+
+def pack_planes(planes):
+    '''Pack Plane objects into an array('d').'''
+    if isinstance(planes, array.array):
+        return planes
+    out = array.array('d')
+    for P in planes:
+        out.extend((P.n.x, P.n.y, P.n.z, P.k))
+    return out
+
+def pack_spheres(spheres):
+    '''Pack Sphere objects into an array('d').'''
+    if isinstance(spheres, array.array):
+        return spheres
+    out = array.array('d')
+    for S in spheres:
+        out.extend((S.c.x, S.c.y, S.c.z, S.r))
+    return out
+
+def _kernel_line3_plane(lines, planes, out_u, out_index, start, stop):
+    # Nearest hit of each line on any plane; ties go to the lower index.
+    count = len(planes) // 4
+    for i in range(start, stop):
+        px, py, pz, vx, vy, vz, tmin, tmax = lines[8 * i:8 * i + 8]
+        best = float('nan')
+        index = -1
+        for j in range(count):
+            nx, ny, nz, k = planes[4 * j:4 * j + 4]
+            d = nx * vx + ny * vy + nz * vz
+            if not d:
+                continue
+            u = (k - nx * px - ny * py - nz * pz) / d
+            if tmin <= u <= tmax and (index < 0 or u < best):
+                best = u
+                index = j
+        out_u[i] = best
+        out_index[i] = index
+
+def _kernel_line3_sphere(lines, spheres, out_u, out_index, start, stop):
+    # Nearest point of each line on any sphere's surface
+    count = len(spheres) // 4
+    for i in range(start, stop):
+        px, py, pz, vx, vy, vz, tmin, tmax = lines[8 * i:8 * i + 8]
+        best = float('nan')
+        index = -1
+        for j in range(count):
+            cx, cy, cz, r = spheres[4 * j:4 * j + 4]
+            roots = _line3_sphere_roots(px, py, pz, vx, vy, vz, cx, cy, cz, r)
+            if roots is None:
+                continue
+            for u in (roots[1], roots[0]):
+                if tmin <= u <= tmax:
+                    if index < 0 or u < best:
+                        best = u
+                        index = j
+                    break
+        out_u[i] = best
+        out_index[i] = index
+
+def _backend_point3_transform(backend, points, matrix, out, start, stop):
+    # Affine part of a Matrix4 (a..l, row major) applied to each point
+    values = backend.transform_points3(
+        memoryview(points)[3 * start:3 * stop], matrix)
+    if isinstance(values, list):
+        values = array.array('d', values)
+    memoryview(out)[3 * start:3 * stop] = values
+
+def _kernel_point3_transform(points, matrix, out, out_index, start, stop):
+    _backend_point3_transform(get_backend(), points, matrix, out,
+                              start, stop)
+
+def _kernel_point3_sphere(points, spheres, out_d, out_index, start, stop):
+    # Signed distance of each point to the nearest sphere surface
+    count = len(spheres) // 4
+    sqrt = math.sqrt
+    for i in range(start, stop):
+        x, y, z = points[3 * i:3 * i + 3]
+        best = float('nan')
+        index = -1
+        for j in range(count):
+            cx, cy, cz, r = spheres[4 * j:4 * j + 4]
+            d = sqrt((x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2) - r
+            if index < 0 or d < best:
+                best = d
+                index = j
+        out_d[i] = best
+        out_index[i] = index
+
+_kernels = {
+    'line3_plane': (_kernel_line3_plane, 8, 1),
+    'line3_sphere': (_kernel_line3_sphere, 8, 1),
+    'point3_transform': (_kernel_point3_transform, 3, 3),
+    'point3_sphere': (_kernel_point3_sphere, 3, 1),
+}
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _numpy_point3_transform(points, matrix, out, out_index, start, stop):
+    _backend_point3_transform(_NumpyBackend(), points, matrix, out,
+                              start, stop)
+
+def _numpy_point3_sphere(points, spheres, out_d, out_index, start, stop):
+    numpy = _numpy()
+    p = numpy.frombuffer(points, 'd')[3 * start:3 * stop].reshape(-1, 1, 3)
+    s = numpy.frombuffer(spheres, 'd').reshape(-1, 4)
+    d = numpy.sqrt(((p - s[:, :3]) ** 2).sum(axis=2)) - s[:, 3]
+    index = d.argmin(axis=1)
+    numpy.frombuffer(out_d, 'd')[start:stop] = \
+        d[numpy.arange(len(index)), index]
+    numpy.frombuffer(out_index, 'q')[start:stop] = index
+
+# NumPy releases the GIL inside these, so threads overlap even on builds
+# with a GIL.
+_numpy_kernels = {
+    'point3_transform': _numpy_point3_transform,
+    'point3_sphere': _numpy_point3_sphere,
+}
+
+def pack_points3(points):
+    '''Pack Point3 objects or (x, y, z) tuples into an array('d').'''
+    if isinstance(points, array.array):
+        return points
+    out = array.array('d', [0.0]) * (3 * len(points))
+    out[0::3], out[1::3], out[2::3] = \
+        [array.array('d', c) for c in _coords3(points)]
+    return out
+
+def _pack_affine(matrix):
+    if isinstance(matrix, array.array):
+        return matrix
+    m = matrix
+    return array.array('d', (m.a, m.b, m.c, m.d, m.e, m.f, m.g, m.h,
+                             m.i, m.j, m.k, m.l))
+
+def _shared_memory_attach(name):
+    # Workers share the resource tracker of the process that created the
+    # block, which unlinks it; they only attach.
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def _parallel_task(kernel, names, lengths, start, stop):
+    blocks = [_shared_memory_attach(name) for name in names]
+    views = [block.buf.cast(code)[:length] for block, code, length
+             in zip(blocks, 'ddd', lengths)]
+    views.append(blocks[3].buf.cast('q'))
+    try:
+        _kernels[kernel][0](views[0], views[1], views[2], views[3],
+                            start, stop)
+    finally:
+        for view in views:
+            view.release()
+        for block in blocks:
+            block.close()
+
+class _BatchExecutor(object):
+    # Packs the inputs, allocates the outputs and splits the work into
+    # disjoint ranges of items; subclasses run the ranges in _map.
+    def __init__(self, workers=None, tasks_per_worker=4):
+        if workers is None:
+            import os
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.tasks_per_worker = tasks_per_worker
+        self._pool = None
+
+    def __repr__(self):
+        return '%s(workers=%d)' % (self.__class__.__name__, self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def intersect_lines_planes(self, lines, planes):
+        '''Nearest hit of each line on any of the planes.
+
+        Returns two arrays: the line parameter u of each hit (nan for a
+        miss), and the index of the plane hit (-1 for a miss).
+        '''
+        return self._run('line3_plane', pack_lines3(lines),
+                         pack_planes(planes))
+
+    def intersect_lines_spheres(self, lines, spheres):
+        '''Nearest hit of each line on the surface of any of the spheres,
+        returned as for intersect_lines_planes.'''
+        return self._run('line3_sphere', pack_lines3(lines),
+                         pack_spheres(spheres))
+
+    def transform_points(self, points, matrix):
+        '''Transform points by a Matrix4 (without the projective row),
+        returning the packed results as an array('d').'''
+        return self._run('point3_transform', pack_points3(points),
+                         _pack_affine(matrix))[0]
+
+    def distance_points_spheres(self, points, spheres):
+        '''Distance of each point to the surface of the nearest sphere,
+        negative inside it.
+
+        Returns two arrays: the distances (nan if there are no spheres),
+        and the index of the nearest sphere (-1 if there are none).
+        '''
+        return self._run('point3_sphere', pack_points3(points),
+                         pack_spheres(spheres))
+
+    def _kernel(self, kernel):
+        return _kernels[kernel][0]
+
+    def _run(self, kernel, inputs, targets):
+        function, in_size, out_size = _kernels[kernel]
+        count = len(inputs) // in_size
+        out = array.array('d', [float('nan')]) * (count * out_size)
+        out_index = array.array('q', [-1]) * count
+        if not count or not targets:
+            return out, out_index
+        if self.workers <= 1:
+            self._kernel(kernel)(inputs, targets, out, out_index, 0, count)
+        else:
+            step = -(-count // (self.workers * self.tasks_per_worker))
+            ranges = [(start, min(start + step, count))
+                      for start in range(0, count, step)]
+            self._map(kernel, inputs, targets, out, out_index, ranges)
+        return out, out_index
+
+class ParallelExecutor(_BatchExecutor):
+    '''Batch kernels over packed arrays on a pool of worker processes.
+
+    Inputs are copied once into shared memory and each worker writes its
+    slice of the results into shared output arrays, so nothing is pickled
+    per task.  Results do not depend on the number of workers.
+    '''
+
+    def _map(self, kernel, inputs, targets, out, out_index, ranges):
+        from multiprocessing import shared_memory
+        if self._pool is None:
+            import concurrent.futures
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        sources = (inputs, targets, out, out_index)
+        blocks = []
+        try:
+            for source in sources:
+                block = shared_memory.SharedMemory(
+                    create=True, size=len(source) * source.itemsize)
+                blocks.append(block)
+                view = block.buf.cast(source.typecode)
+                view[:len(source)] = source
+                view.release()
+            names = [block.name for block in blocks]
+            lengths = [len(source) for source in sources[:3]]
+            tasks = [self._pool.submit(_parallel_task, kernel, names, lengths,
+                                       start, stop)
+                     for start, stop in ranges]
+            for task in tasks:
+                task.result()
+            for block, result in zip(blocks[2:], (out, out_index)):
+                view = block.buf.cast(result.typecode)
+                result[:] = array.array(result.typecode, view[:len(result)])
+                view.release()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+class ThreadedExecutor(_BatchExecutor):
+    '''Batch kernels over packed arrays on a pool of threads.
+
+    The threads share the packed inputs read-only and each writes a
+    disjoint slice of the output arrays; no euclid objects are shared.
+    The kernels scale with the number of threads on free-threaded
+    CPython.  On builds with a GIL, the point kernels scale when NumPy is
+    used: with use_numpy None it is used if it can be imported.
+    '''
+
+    def __init__(self, workers=None, tasks_per_worker=4, use_numpy=None):
+        super(ThreadedExecutor, self).__init__(workers, tasks_per_worker)
+        if use_numpy is None:
+            use_numpy = _numpy() is not None
+        elif use_numpy and _numpy() is None:
+            raise ImportError('NumPy is not available')
+        self.use_numpy = use_numpy
+
+    def _kernel(self, kernel):
+        if self.use_numpy and kernel in _numpy_kernels:
+            return _numpy_kernels[kernel]
+        return _kernels[kernel][0]
+
+    def _map(self, kernel, inputs, targets, out, out_index, ranges):
+        if self._pool is None:
+            import concurrent.futures
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        function = self._kernel(kernel)
+        tasks = [self._pool.submit(function, inputs, targets, out, out_index,
+                                   start, stop)
+                 for start, stop in ranges]
+        for task in tasks:
+            task.result()
+
+# Instrumentation
+# ---------------------------------------------------------------------------
+# While enabled, the __init__ of every class in this module is replaced by a
+# wrapper counting constructions by class and by the euclid operation the
+# caller entered the module through.  Disabling restores the original
+# methods, so there is no cost at all when instrumentation is off.
+
+_instrument_counts = {}
+_instrument_inits = {}
+_instrument_memory = {'tracing': False, 'snapshot': None, 'functions': None}
+
+def _instrument_file():
+    return _instrument_file.__code__.co_filename
+
+def _instrument_code_name(code):
+    return getattr(code, 'co_qualname', code.co_name)
+
+def _instrument_operation(frame):
+    # Name of the outermost of the euclid frames starting at frame
+    filename = _instrument_file()
+    entry = None
+    while frame is not None and frame.f_code.co_filename == filename:
+        entry = frame
+        frame = frame.f_back
+    if entry is None:
+        return None
+    if entry.f_code.co_name == '__init__' and \
+       entry.f_code.co_firstlineno == _instrument_wrap_line:
+        # Objects made by a constructor called from outside euclid
+        return type(entry.f_locals['self']).__name__ + '()'
+    return _instrument_code_name(entry.f_code)
+
+def _instrument_wrap(init):
+    def __init__(self, *args, **kwargs):
+        caller = sys._getframe(1)
+        # A subclass __init__ calling its base class is one construction
+        if caller.f_code.co_name != '__init__' or \
+           caller.f_locals.get('self') is not self:
+            name = type(self).__name__
+            key = (name, _instrument_operation(caller) or name + '()')
+            _instrument_counts[key] = _instrument_counts.get(key, 0) + 1
+        init(self, *args, **kwargs)
+    __init__.__doc__ = init.__doc__
+    return __init__
+
+_instrument_wrap_line = _instrument_wrap(None).__code__.co_firstlineno
+
+def _instrument_functions():
+    # Sorted (first line, name) of the functions in this module, to name
+    # the frames of tracemalloc tracebacks.
+    filename = _instrument_file()
+    functions = []
+    def add(function, prefix):
+        code = getattr(function, '__code__', None)
+        if code is not None and code.co_filename == filename and \
+           code.co_firstlineno != _instrument_wrap_line:
+            functions.append((code.co_firstlineno,
+                              prefix + function.__name__))
+    for name, value in list(globals().items()):
+        if isinstance(value, type) and value.__module__ == __name__:
+            attributes = list(value.__dict__.values())
+            if value in _instrument_inits:
+                attributes.append(_instrument_inits[value])
+            for attribute in attributes:
+                if isinstance(attribute, property):
+                    for function in (attribute.fget, attribute.fset):
+                        add(function, value.__name__ + '.')
+                else:
+                    add(getattr(attribute, '__func__', attribute),
+                        value.__name__ + '.')
+        else:
+            add(value, '')
+    functions.sort()
+    return functions
+
+def _instrument_traced_operations(snapshot):
+    # {operation: [blocks, bytes]} of the memory held in snapshot
+    filename = _instrument_file()
+    functions = _instrument_memory['functions']
+    if functions is None:
+        functions = _instrument_memory['functions'] = _instrument_functions()
+    lines = [line for line, name in functions]
+    out = {}
+    for trace in snapshot.traces:
+        # Frames run from the oldest to the most recent
+        frames = list(trace.traceback)
+        names = []
+        while frames and frames[-1].filename == filename:
+            i = bisect.bisect_right(lines, frames.pop().lineno) - 1
+            names.append(i >= 0 and functions[i][1] or '<module>')
+        if names and names[-1] == '_instrument_wrap':
+            # Made by a constructor called from outside euclid
+            names.pop()
+            if not names:
+                continue
+            names[-1] = names[-1].replace('.__init__', '()')
+        if not names:
+            continue
+        operation = names[-1]
+        total = out.setdefault(operation, [0, 0])
+        total[0] += 1
+        total[1] += trace.size
+    return out
+
+def instrument_enable(trace_memory=False, frames=16):
+    '''Start counting the construction of euclid objects.
+
+    With trace_memory, tracemalloc is also started (unless already
+    running), keeping frames frames per allocation, and the report shows
+    the memory held by objects each euclid operation allocated.
+    '''
+    if not _instrument_inits:
+        for value in list(globals().values()):
+            if isinstance(value, type) and value.__module__ == __name__ \
+               and '__init__' in value.__dict__:
+                init = value.__dict__['__init__']
+                _instrument_inits[value] = init
+                value.__init__ = _instrument_wrap(init)
+    if trace_memory and not _instrument_memory['tracing']:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _instrument_memory['tracing'] = True
+        _instrument_memory['snapshot'] = None
+
+def instrument_disable():
+    '''Stop counting, restoring the original constructors.  The counts
+    (and the last memory snapshot) are kept for the report.'''
+    for cls, init in _instrument_inits.items():
+        cls.__init__ = init
+    _instrument_inits.clear()
+    if _instrument_memory['tracing']:
+        import tracemalloc
+        _instrument_memory['snapshot'] = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        _instrument_memory['tracing'] = False
+
+def instrument_reset():
+    '''Clear the counts and memory snapshot.'''
+    _instrument_counts.clear()
+    _instrument_memory['snapshot'] = None
+
+def instrument_counts():
+    '''Constructions counted so far, as a dictionary mapping
+    (class name, operation) to a count.'''
+    return dict(_instrument_counts)
+
+def instrument_report(limit=10):
+    '''Report the euclid operations constructing the most objects.
+
+    Returns a table as a string: for each operation, the number of objects
+    constructed, by class, and when memory is traced, the blocks and bytes
+    still held that the operation allocated.
+    '''
+    operations = {}
+    for (name, operation), count in _instrument_counts.items():
+        operations.setdefault(operation, {})[name] = count
+    memory = None
+    if _instrument_memory['tracing']:
+        import tracemalloc
+        memory = _instrument_traced_operations(tracemalloc.take_snapshot())
+    elif _instrument_memory['snapshot'] is not None:
+        memory = _instrument_traced_operations(_instrument_memory['snapshot'])
+    rows = sorted(operations.items(),
+                  key=lambda item: (-sum(item[1].values()), item[0]))
+    lines = ['%-32s %10s  %s' % ('operation', 'objects', 'classes')]
+    if memory is not None:
+        lines[0] += '  (blocks, bytes held)'
+    for operation, classes in rows[:limit]:
+        line = '%-32s %10d  %s' % (
+            operation, sum(classes.values()),
+            ', '.join(['%s %d' % (name, classes[name])
+                       for name in sorted(classes,
+                                          key=lambda n: -classes[n])]))
+        if memory is not None and operation in memory:
+            line += '  (%d, %d)' % tuple(memory[operation])
+        lines.append(line)
+    return '\n'.join(lines)
+
+# Dispatch profiling
+# ---------------------------------------------------------------------------
+# While profiling is enabled, the intersect and connect methods of the
+# shapes, and the functions the registry resolves for intersect() and
+# connect(), are wrapped to count calls, hits and time per pair of types.
+# Disabling restores the methods and empties the registry caches, so the
+# dispatch runs unchanged when profiling is off.  Only the outermost call is
+# recorded when one dispatch calls another.
+
+_profiling = False
+_profile_stats = {}
+_profile_methods = {}
+_profile_depth = [0]
+
+def _profile_classes():
+    return (Point2, Line2, Circle, Polygon2, AABB2,
+            Point3, Line3, Sphere, Plane, TriangleMesh3, AABB3, OBB3)
+
+def _profile_timer():
+    import time
+    return getattr(time, 'perf_counter', time.time)
+
+def _profile_wrap(operation, function):
+    timer = _profile_timer()
+    def profiled(a, b, *args, **kwargs):
+        if _profile_depth[0]:
+            return function(a, b, *args, **kwargs)
+        _profile_depth[0] += 1
+        result = None
+        start = timer()
+        try:
+            result = function(a, b, *args, **kwargs)
+        finally:
+            elapsed = timer() - start
+            _profile_depth[0] -= 1
+            key = (operation, type(a).__name__, type(b).__name__)
+            stats = _profile_stats.get(key)
+            if stats is None:
+                stats = _profile_stats[key] = [0, 0, 0.0]
+            stats[0] += 1
+            if result is not None and result is not False:
+                stats[1] += 1
+            stats[2] += elapsed
+        return result
+    profiled.__doc__ = function.__doc__
+    return profiled
+
+def profile_enable():
+    '''Start recording intersect and connect calls per pair of types.'''
+    global _profiling
+    if _profiling:
+        return
+    for cls in _profile_classes():
+        for name in ('intersect', 'connect'):
+            if name in cls.__dict__:
+                method = cls.__dict__[name]
+                _profile_methods[(cls, name)] = method
+                setattr(cls, name, _profile_wrap(name, method))
+    _profiling = True
+    _intersect_resolved.clear()
+    _connect_resolved.clear()
+
+def profile_disable():
+    '''Stop recording, restoring the original dispatch.  The statistics
+    are kept.'''
+    global _profiling
+    for (cls, name), method in _profile_methods.items():
+        setattr(cls, name, method)
+    _profile_methods.clear()
+    _profiling = False
+    _intersect_resolved.clear()
+    _connect_resolved.clear()
+
+def profile_reset():
+    '''Clear the statistics.'''
+    _profile_stats.clear()
+
+def profile_stats():
+    '''Statistics recorded so far.
+
+    Returns a dictionary mapping (operation, name of type a, name of type b)
+    to a dictionary of the number of calls, hits (a result other than None
+    or False) and misses, the hit ratio and the cumulative time in seconds.
+    '''
+    out = {}
+    for key, (calls, hits, elapsed) in _profile_stats.items():
+        out[key] = {
+            'calls': calls,
+            'hits': hits,
+            'misses': calls - hits,
+            'hit_ratio': calls and hits / float(calls),
+            'time': elapsed,
+        }
+    return out
+
+def profile_report(limit=10):
+    '''Report the pairs of types taking the most time, as a table in a
+    string.'''
+    rows = sorted(profile_stats().items(),
+                  key=lambda item: (-item[1]['time'], item[0]))
+    lines = ['%-40s %10s %9s %12s' % ('pair', 'calls', 'hit ratio',
+                                       'time (s)')]
+    for (operation, a, b), stats in rows[:limit]:
+        lines.append('%-40s %10d %9.2f %12.6f' % (
+            '%s %s %s' % (operation, a, b), stats['calls'],
+            stats['hit_ratio'], stats['time']))
+    return '\n'.join(lines)
+
+# Numeric backends
+# ---------------------------------------------------------------------------
+# Bulk operations on many points, vectors, matrices or quaternions take flat
+# sequences of coordinates and are run by the selected backend:
+#
+#   python    lists of floats
+#   array     array('d') (the default)
+#   numpy     NumPy arrays, imported only when first used
+#
+# The backend is chosen with set_backend(), or the EUCLID_BACKEND
+# environment variable read on first use.  Every backend evaluates the same
+# expressions as the object API, in the same order.
+
+def pack_matrices4(matrices):
+    '''Pack Matrix4 objects into an array('d'), 16 values each in row
+    order.'''
+    if isinstance(matrices, array.array):
+        return matrices
+    out = array.array('d')
+    for M in matrices:
+        out.extend((M.a, M.b, M.c, M.d, M.e, M.f, M.g, M.h,
+                    M.i, M.j, M.k, M.l, M.m, M.n, M.o, M.p))
+    return out
+
+def pack_quaternions(quaternions):
+    '''Pack Quaternion objects into an array('d'), as w, x, y, z.'''
+    if isinstance(quaternions, array.array):
+        return quaternions
+    out = array.array('d')
+    for q in quaternions:
+        out.extend((q.w, q.x, q.y, q.z))
+    return out
+
+def _double_array(values):
+    # A backend's flat result as an array('d')
+    if isinstance(values, array.array):
+        return values
+    out = array.array('d')
+    if hasattr(values, '__array_interface__'):
+        out.frombytes(values.tobytes())
+    else:
+        out.extend(values)
+    return out
+
+def _bulk(values, pack):
+    # Flat buffers (arrays, lists of numbers, NumPy arrays) pass through
+    if isinstance(values, array.array) or \
+       hasattr(values, '__array_interface__'):
+        return values
+    if not hasattr(values, '__len__'):
+        values = list(values)
+    if len(values) and isinstance(values[0], numbers.Real):
+        return values
+    return pack(values)
+
+class _PythonBackend(object):
+    name = 'python'
+
+    def _new(self, n):
+        return [0.0] * n
+
+    def transform_points3(self, points, m):
+        a, b, c, d, e, f, g, h, i, j, k, l = m[:12]
+        out = self._new(len(points))
+        for s in range(0, len(points), 3):
+            x = points[s]
+            y = points[s + 1]
+            z = points[s + 2]
+            out[s] = a * x + b * y + c * z + d
+            out[s + 1] = e * x + f * y + g * z + h
+            out[s + 2] = i * x + j * y + k * z + l
+        return out
+
+    def transform_vectors3(self, vectors, m):
+        a, b, c, d, e, f, g, h, i, j, k, l = m[:12]
+        out = self._new(len(vectors))
+        for s in range(0, len(vectors), 3):
+            x = vectors[s]
+            y = vectors[s + 1]
+            z = vectors[s + 2]
+            out[s] = a * x + b * y + c * z
+            out[s + 1] = e * x + f * y + g * z
+            out[s + 2] = i * x + j * y + k * z
+        return out
+
+    def project_points3(self, points, m):
+        a, b, c, d, e, f, g, h, i, j, k, l, m_, n, o, p = m[:16]
+        out = self._new(len(points))
+        for s in range(0, len(points), 3):
+            x = points[s]
+            y = points[s + 1]
+            z = points[s + 2]
+            px = a * x + b * y + c * z + d
+            py = e * x + f * y + g * z + h
+            pz = i * x + j * y + k * z + l
+            w = m_ * x + n * y + o * z + p
+            if w != 0:
+                px /= w
+                py /= w
+                pz /= w
+            out[s] = px
+            out[s + 1] = py
+            out[s + 2] = pz
+        return out
+
+    def rotate_vectors3(self, vectors, q):
+        w, x, y, z = q[:4]
+        ww = w * w
+        w2 = w * 2
+        wx2 = w2 * x
+        wy2 = w2 * y
+        wz2 = w2 * z
+        xx = x * x
+        x2 = x * 2
+        xy2 = x2 * y
+        xz2 = x2 * z
+        yy = y * y
+        yz2 = 2 * y * z
+        zz = z * z
+        out = self._new(len(vectors))
+        for s in range(0, len(vectors), 3):
+            Vx = vectors[s]
+            Vy = vectors[s + 1]
+            Vz = vectors[s + 2]
+            out[s] = ww * Vx + wy2 * Vz - wz2 * Vy + \
+                     xx * Vx + xy2 * Vy + xz2 * Vz - \
+                     zz * Vx - yy * Vx
+            out[s + 1] = xy2 * Vx + yy * Vy + yz2 * Vz + \
+                         wz2 * Vx - zz * Vy + ww * Vy - \
+                         wx2 * Vz - xx * Vy
+            out[s + 2] = xz2 * Vx + yz2 * Vy + \
+                         zz * Vz - wy2 * Vx - yy * Vz + \
+                         wx2 * Vy - xx * Vz + ww * Vz
+        return out
+
+    def multiply_matrices4(self, A, B):
+        out = self._new(len(A))
+        for s in range(0, len(A), 16):
+            for r in range(s, s + 16, 4):
+                A0, A1, A2, A3 = A[r:r + 4]
+                for c in range(4):
+                    out[r + c] = A0 * B[s + c] + A1 * B[s + 4 + c] + \
+                                 A2 * B[s + 8 + c] + A3 * B[s + 12 + c]
+        return out
+
+    def multiply_quaternions(self, A, B):
+        out = self._new(len(A))
+        for s in range(0, len(A), 4):
+            Aw, Ax, Ay, Az = A[s:s + 4]
+            Bw, Bx, By, Bz = B[s:s + 4]
+            out[s] = -Ax * Bx - Ay * By - Az * Bz + Aw * Bw
+            out[s + 1] = Ax * Bw + Ay * Bz - Az * By + Aw * Bx
+            out[s + 2] = -Ax * Bz + Ay * Bw + Az * Bx + Aw * By
+            out[s + 3] = Ax * By - Ay * Bx + Az * Bw + Aw * Bz
+        return out
+
+class _ArrayBackend(_PythonBackend):
+    name = 'array'
+
+    def _new(self, n):
+        return array.array('d', [0.0]) * n
+
+class _NumpyBackend(object):
+    name = 'numpy'
+
+    def __init__(self):
+        import numpy
+        self.numpy = numpy
+
+    def _columns(self, values, size):
+        if isinstance(values, array.array):
+            values = self.numpy.frombuffer(values, 'd')
+        values = self.numpy.asarray(values, dtype='d').reshape(-1, size)
+        return [values[:, i] for i in range(size)]
+
+    def _stack(self, columns):
+        return self.numpy.stack(columns, axis=1).ravel()
+
+    def transform_points3(self, points, m):
+        a, b, c, d, e, f, g, h, i, j, k, l = m[:12]
+        x, y, z = self._columns(points, 3)
+        return self._stack([a * x + b * y + c * z + d,
+                            e * x + f * y + g * z + h,
+                            i * x + j * y + k * z + l])
+
+    def transform_vectors3(self, vectors, m):
+        a, b, c, d, e, f, g, h, i, j, k, l = m[:12]
+        x, y, z = self._columns(vectors, 3)
+        return self._stack([a * x + b * y + c * z,
+                            e * x + f * y + g * z,
+                            i * x + j * y + k * z])
+
+    def project_points3(self, points, m):
+        a, b, c, d, e, f, g, h, i, j, k, l, m_, n, o, p = m[:16]
+        x, y, z = self._columns(points, 3)
+        w = m_ * x + n * y + o * z + p
+        w = self.numpy.where(w != 0, w, 1.0)
+        return self._stack([(a * x + b * y + c * z + d) / w,
+                            (e * x + f * y + g * z + h) / w,
+                            (i * x + j * y + k * z + l) / w])
+
+    def rotate_vectors3(self, vectors, q):
+        w, x, y, z = q[:4]
+        ww = w * w
+        w2 = w * 2
+        wx2 = w2 * x
+        wy2 = w2 * y
+        wz2 = w2 * z
+        xx = x * x
+        x2 = x * 2
+        xy2 = x2 * y
+        xz2 = x2 * z
+        yy = y * y
+        yz2 = 2 * y * z
+        zz = z * z
+        Vx, Vy, Vz = self._columns(vectors, 3)
+        return self._stack([
+            ww * Vx + wy2 * Vz - wz2 * Vy + xx * Vx + xy2 * Vy + xz2 * Vz -
+            zz * Vx - yy * Vx,
+            xy2 * Vx + yy * Vy + yz2 * Vz + wz2 * Vx - zz * Vy + ww * Vy -
+            wx2 * Vz - xx * Vy,
+            xz2 * Vx + yz2 * Vy + zz * Vz - wy2 * Vx - yy * Vz + wx2 * Vy -
+            xx * Vz + ww * Vz])
+
+    def multiply_matrices4(self, A, B):
+        A = self._columns(A, 16)
+        B = self._columns(B, 16)
+        return self._stack([A[r] * B[c] + A[r + 1] * B[4 + c] +
+                            A[r + 2] * B[8 + c] + A[r + 3] * B[12 + c]
+                            for r in range(0, 16, 4) for c in range(4)])
+
+    def multiply_quaternions(self, A, B):
+        Aw, Ax, Ay, Az = self._columns(A, 4)
+        Bw, Bx, By, Bz = self._columns(B, 4)
+        return self._stack([-Ax * Bx - Ay * By - Az * Bz + Aw * Bw,
+                            Ax * Bw + Ay * Bz - Az * By + Aw * Bx,
+                            -Ax * Bz + Ay * Bw + Az * Bx + Aw * By,
+                            Ax * By - Ay * Bx + Az * Bw + Aw * Bz])
+
+_backend_classes = {
+    'python': _PythonBackend,
+    'array': _ArrayBackend,
+    'numpy': _NumpyBackend,
+}
+_backend = [None]
+
+def backend_names():
+    '''Names of the backends which can be used here.'''
+    return sorted([name for name in _backend_classes
+                   if name != 'numpy' or _numpy() is not None])
+
+def set_backend(name):
+    '''Select the backend for bulk operations: 'python', 'array', 'numpy',
+    or 'auto' for NumPy if it can be imported and array otherwise.'''
+    if name == 'auto':
+        name = _numpy() is not None and 'numpy' or 'array'
+    if name not in _backend_classes:
+        raise ValueError('Unknown backend %r' % name)
+    _backend[0] = _backend_classes[name]()
+    return _backend[0]
+
+def get_backend():
+    '''The backend for bulk operations, chosen on first use from the
+    EUCLID_BACKEND environment variable (by default 'array').'''
+    if _backend[0] is None:
+        import os
+        set_backend(os.environ.get('EUCLID_BACKEND') or 'array')
+    return _backend[0]
+
+def transform_points3(points, matrix):
+    '''Points transformed by a Matrix4, as by matrix * Point3, as a flat
+    sequence of the backend.'''
+    return get_backend().transform_points3(_bulk(points, pack_points3),
+                                           pack_matrices4([matrix]))
+
+def transform_vectors3(vectors, matrix):
+    '''Vectors transformed by a Matrix4, as by matrix * Vector3.'''
+    return get_backend().transform_vectors3(_bulk(vectors, pack_points3),
+                                            pack_matrices4([matrix]))
+
+def project_points3(points, matrix):
+    '''Points transformed by a Matrix4 with the division by w, as by
+    matrix.transform(point).'''
+    return get_backend().project_points3(_bulk(points, pack_points3),
+                                         pack_matrices4([matrix]))
+
+def rotate_vectors3(vectors, quaternion):
+    '''Vectors rotated by a Quaternion, as by quaternion * Vector3.'''
+    return get_backend().rotate_vectors3(_bulk(vectors, pack_points3),
+                                         pack_quaternions([quaternion]))
+
+def multiply_matrices4(a, b):
+    '''Products of two equally long sequences of Matrix4, pairwise, as a
+    flat sequence of 16 values per matrix.'''
+    a = _bulk(a, pack_matrices4)
+    b = _bulk(b, pack_matrices4)
+    assert len(a) == len(b), 'Sequences differ in length'
+    return get_backend().multiply_matrices4(a, b)
+
+def multiply_quaternions(a, b):
+    '''Products of two equally long sequences of Quaternion, pairwise, as a
+    flat sequence of w, x, y, z per quaternion.'''
+    a = _bulk(a, pack_quaternions)
+    b = _bulk(b, pack_quaternions)
+    assert len(a) == len(b), 'Sequences differ in length'
+    return get_backend().multiply_quaternions(a, b)
+
+# Single precision arrays
+# ---------------------------------------------------------------------------
+# Compact containers holding many vectors, matrices or quaternions as 32-bit
+# floats in an array('f'), half the size of array('d') and a small fraction
+# of the size of the objects.  Items are read and written as the usual
+# objects, with Python floats, and the data can be handed as it is to
+# anything taking a buffer of floats.
+
+class _Float32Array(Slotted):
+    __slots__ = ['data']
+
+    def __init__(self, items=()):
+        if isinstance(items, _Float32Array):
+            items = items.data
+        elif not isinstance(items, array.array):
+            items = _bulk(items, self._pack)
+        assert len(items) % self._size == 0, \
+            'Values are not a multiple of %d' % self._size
+        self.data = array.array('f', items)
+
+    def __copy__(self):
+        return self.__class__(self.data)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return '%s(%d items)' % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        return len(self.data) // self._size
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.data == other.data
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __getitem__(self, key):
+        n = self._size
+        if isinstance(key, slice):
+            items = self.__class__()
+            for i in range(*key.indices(len(self))):
+                items.data.extend(self.data[n * i:n * i + n])
+            return items
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('index out of range')
+        return self._unpack(self.data[n * key:n * key + n])
+
+    def __setitem__(self, key, value):
+        n = self._size
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('index out of range')
+        self.data[n * key:n * key + n] = array.array('f', self._pack([value]))
+
+    def __iter__(self):
+        n = self._size
+        data = self.data
+        for s in range(0, len(data), n):
+            yield self._unpack(data[s:s + n])
+
+    def append(self, item):
+        self.data.extend(array.array('f', self._pack([item])))
+
+    def extend(self, items):
+        self.data.extend(self.__class__(items).data)
+
+    def tobytes(self):
+        '''The data as bytes of 32-bit floats in native byte order.'''
+        return self.data.tobytes()
+
+    def __array__(self, dtype=None, copy=None):
+        # NumPy view of the data, one row per item
+        import numpy
+        view = numpy.frombuffer(self.data, 'f').reshape(-1, self._size)
+        if dtype is not None:
+            return view.astype(dtype)
+        return view
+
+class Vector3Array(_Float32Array):
+    '''A sequence of 3D vectors (or points) stored as 32-bit floats, x, y, z
+    per vector.'''
+    __slots__ = []
+    _size = 3
+
+    def _pack(self, vectors):
+        return pack_points3(vectors)
+
+    def _unpack(self, values):
+        return Vector3(*values)
+
+    def transform_points(self, matrix):
+        '''New array of the items transformed as points by a Matrix4.'''
+        return Vector3Array(array.array('f', transform_points3(
+            array.array('d', self.data), matrix)))
+
+    def transform_vectors(self, matrix):
+        '''New array of the items transformed as vectors by a Matrix4.'''
+        return Vector3Array(array.array('f', transform_vectors3(
+            array.array('d', self.data), matrix)))
+
+    def rotate(self, quaternion):
+        '''New array of the items rotated by a Quaternion.'''
+        return Vector3Array(array.array('f', rotate_vectors3(
+            array.array('d', self.data), quaternion)))
+
+def _column_major(matrices):
+    out = array.array('d')
+    for M in matrices:
+        out.extend(M[:])
+    return out
+
+class Matrix4Array(_Float32Array):
+    '''A sequence of 4x4 matrices stored as 32-bit floats, 16 per matrix in
+    the column major order of Matrix4[:], as OpenGL expects.'''
+    __slots__ = []
+    _size = 16
+
+    def _pack(self, matrices):
+        return _column_major(matrices)
+
+    def _unpack(self, values):
+        M = Matrix4()
+        M[:] = list(values)
+        return M
+
+    def __mul__(self, other):
+        '''Products of the matrices with those of another Matrix4Array of
+        the same length, pairwise.'''
+        assert isinstance(other, Matrix4Array) and len(other) == len(self)
+        # Column major data are the transposes in row order, and
+        # (A B)' = B' A'
+        return Matrix4Array(array.array('f', multiply_matrices4(
+            array.array('d', other.data), array.array('d', self.data))))
+
+class QuaternionArray(_Float32Array):
+    '''A sequence of quaternions stored as 32-bit floats, w, x, y, z per
+    quaternion.'''
+    __slots__ = []
+    _size = 4
+
+    def _pack(self, quaternions):
+        return pack_quaternions(quaternions)
+
+    def _unpack(self, values):
+        return Quaternion(*values)
+
+    def __mul__(self, other):
+        '''Products of the quaternions with those of another
+        QuaternionArray of the same length, pairwise.'''
+        assert isinstance(other, QuaternionArray) and len(other) == len(self)
+        return QuaternionArray(array.array('f', multiply_quaternions(
+            array.array('d', self.data), array.array('d', other.data))))
+
+# Cameras
+# ---------------------------------------------------------------------------
+
+def unproject_rays(pixels, matrix, width, height, inverse=False):
+    '''Rays through pixels of a width x height viewport, given as Point2 or
+    flat x, y pairs, for the view projection matrix.
+
+    The matrix is inverted once, unless inverse is true, in which case it
+    is already the inverse view projection.  Returns two array('d') of
+    flat x, y, z triples: the origins on the near plane, and the directions
+    reaching the far plane.
+    '''
+    if not inverse:
+        matrix = matrix.inverse()
+    xs, ys = _coords2(pixels)
+    count = len(xs)
+    xs = array.array('d', [2 * x / width - 1 for x in xs])
+    ys = array.array('d', [1 - 2 * y / height for y in ys])
+    # Near points, then far points, in one pass
+    ndc = array.array('d', [-1.0]) * (6 * count)
+    ndc[0::3] = xs + xs
+    ndc[1::3] = ys + ys
+    ndc[3 * count + 2::3] = array.array('d', [1.0]) * count
+    world = array.array('d', project_points3(ndc, matrix))
+    origins = world[:3 * count]
+    directions = array.array('d', map(operator.sub, world[3 * count:],
+                                      origins))
+    return origins, directions
+
+class Ray3Sequence(Slotted):
+    '''A sequence of Ray3 stored as flat arrays of origins and
+    directions; the Ray3 objects are created only when accessed.'''
+    __slots__ = ['origins', 'directions']
+
+    def __init__(self, origins, directions):
+        assert len(origins) == len(directions) and len(origins) % 3 == 0
+        self.origins = origins
+        self.directions = directions
+
+    def __repr__(self):
+        return 'Ray3Sequence(%d rays)' % len(self)
+
+    def __len__(self):
+        return len(self.origins) // 3
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return Ray3Sequence(self.origins[3 * start:3 * stop],
+                                    self.directions[3 * start:3 * stop])
+            indices = range(start, stop, step)
+            return Ray3Sequence(
+                array.array('d', [self.origins[3 * i + j]
+                                  for i in indices for j in range(3)]),
+                array.array('d', [self.directions[3 * i + j]
+                                  for i in indices for j in range(3)]))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('ray index out of range')
+        s = 3 * key
+        o = self.origins
+        d = self.directions
+        return Ray3(Point3(o[s], o[s + 1], o[s + 2]),
+                    Vector3(d[s], d[s + 1], d[s + 2]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class Camera(Slotted):
+    '''A perspective camera looking from eye towards target.
+
+    The view, projection and view-projection matrices and their inverses
+    are computed when first needed and kept until a parameter they depend
+    on changes.  The inverses are computed directly from the parameters
+    rather than by inverting the matrices.  The matrices returned are
+    shared, and must not be modified.
+
+    Screen coordinates are in pixels from the top left corner, with y
+    pointing down; depths are normalized device z, -1 at the near plane and
+    1 at the far plane.
+    '''
+    __slots__ = ['_eye', '_target', '_up', '_fov_y', '_aspect', '_near',
+                 '_far', '_view', '_inverse_view', '_projection',
+                 '_inverse_projection', '_view_projection',
+                 '_inverse_view_projection']
+
+    def __init__(self, eye, target, up=None, fov_y=math.pi / 3, aspect=1.0,
+                 near=0.1, far=1000.0):
+        assert isinstance(eye, Vector3) and isinstance(target, Vector3)
+        self._eye = Point3(eye.x, eye.y, eye.z)
+        self._target = Point3(target.x, target.y, target.z)
+        if up is None:
+            up = Vector3(0., 1., 0.)
+        self._up = Vector3(up.x, up.y, up.z)
+        self._fov_y = fov_y
+        self._aspect = aspect
+        self._near = near
+        self._far = far
+        self._changed_view()
+        self._changed_projection()
+
+    def __copy__(self):
+        return self.__class__(self._eye, self._target, self._up, self._fov_y,
+                              self._aspect, self._near, self._far)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'Camera(eye=%r, target=%r, fov_y=%.2f, aspect=%.2f, ' \
+               'near=%g, far=%g)' % (self._eye, self._target, self._fov_y,
+                                     self._aspect, self._near, self._far)
+
+    def _changed_view(self):
+        self._view = self._inverse_view = None
+        self._view_projection = self._inverse_view_projection = None
+
+    def _changed_projection(self):
+        self._projection = self._inverse_projection = None
+        self._view_projection = self._inverse_view_projection = None
+
+    def _point_property(name, changed, doc):
+        def get(self):
+            return getattr(self, name).copy()
+        def set(self, value):
+            assert isinstance(value, Vector3)
+            setattr(self, name, getattr(self, name).__class__(
+                value.x, value.y, value.z))
+            changed(self)
+        return property(get, set, doc=doc)
+
+    def _number_property(name, changed, doc):
+        def get(self):
+            return getattr(self, name)
+        def set(self, value):
+            setattr(self, name, value)
+            changed(self)
+        return property(get, set, doc=doc)
+
+    eye = _point_property('_eye', _changed_view, 'Position of the camera.')
+    target = _point_property('_target', _changed_view,
+                             'Point the camera looks at.')
+    up = _point_property('_up', _changed_view, 'Up direction.')
+    fov_y = _number_property('_fov_y', _changed_projection,
+                             'Vertical field of view, in radians.')
+    aspect = _number_property('_aspect', _changed_projection,
+                              'Width over height of the viewport.')
+    near = _number_property('_near', _changed_projection,
+                            'Distance to the near clipping plane.')
+    far = _number_property('_far', _changed_projection,
+                           'Distance to the far clipping plane.')
+    del _point_property, _number_property
+
+    def _get_inverse_view(self):
+        if self._inverse_view is None:
+            self._inverse_view = Matrix4.new_look_at(self._eye, self._target,
+                                                     self._up)
+        return self._inverse_view
+    inverse_view = property(_get_inverse_view,
+        doc='Camera to world transform, as by Matrix4.new_look_at.')
+
+    def _get_view(self):
+        if self._view is None:
+            # Transpose of the rotation, and the eye moved to the origin
+            C = self._get_inverse_view()
+            V = Matrix4()
+            V.a, V.b, V.c = C.a, C.e, C.i
+            V.e, V.f, V.g = C.b, C.f, C.j
+            V.i, V.j, V.k = C.c, C.g, C.k
+            V.d = -(V.a * C.d + V.b * C.h + V.c * C.l)
+            V.h = -(V.e * C.d + V.f * C.h + V.g * C.l)
+            V.l = -(V.i * C.d + V.j * C.h + V.k * C.l)
+            self._view = V
+        return self._view
+    view = property(_get_view, doc='World to camera transform.')
+
+    def _get_projection(self):
+        if self._projection is None:
+            self._projection = Matrix4.new_perspective(
+                self._fov_y, self._aspect, self._near, self._far)
+        return self._projection
+    projection = property(_get_projection,
+        doc='Perspective projection, as by Matrix4.new_perspective.')
+
+    def _get_inverse_projection(self):
+        if self._inverse_projection is None:
+            P = self._get_projection()
+            M = Matrix4()
+            M.a = 1 / P.a
+            M.f = 1 / P.f
+            M.k = 0.
+            M.l = -1.
+            M.o = 1 / P.l
+            M.p = P.k / P.l
+            self._inverse_projection = M
+        return self._inverse_projection
+    inverse_projection = property(_get_inverse_projection,
+        doc='Inverse of the projection.')
+
+    def _get_view_projection(self):
+        if self._view_projection is None:
+            self._view_projection = self._get_projection() * \
+                                    self._get_view()
+        return self._view_projection
+    view_projection = property(_get_view_projection,
+        doc='World to clip space transform, projection * view.')
+
+    def _get_inverse_view_projection(self):
+        if self._inverse_view_projection is None:
+            self._inverse_view_projection = self._get_inverse_view() * \
+                                            self._get_inverse_projection()
+        return self._inverse_view_projection
+    inverse_view_projection = property(_get_inverse_view_projection,
+        doc='Inverse of the view projection.')
+
+    def world_to_screen(self, points, width, height):
+        '''Project points onto a viewport of width x height pixels.
+
+        Returns an array('d') of x, y and depth per point.
+        '''
+        ndc = project_points3(points, self._get_view_projection())
+        out = array.array('d', ndc)
+        out[0::3] = array.array('d', [(x + 1) * 0.5 * width
+                                      for x in out[0::3]])
+        out[1::3] = array.array('d', [(1 - y) * 0.5 * height
+                                      for y in out[1::3]])
+        return out
+
+    def screen_to_world(self, coords, width, height):
+        '''Inverse of world_to_screen: the world positions of flat x, y and
+        depth triples, as an array('d').'''
+        ndc = array.array('d', coords)
+        ndc[0::3] = array.array('d', [2 * x / width - 1 for x in ndc[0::3]])
+        ndc[1::3] = array.array('d', [1 - 2 * y / height for y in ndc[1::3]])
+        return array.array('d', project_points3(
+            ndc, self._get_inverse_view_projection()))
+
+    def pick_rays(self, pixels, width, height):
+        '''Rays from the near plane through the far plane at each pixel,
+        given as Point2 or as flat x, y pairs, as a Ray3Sequence.'''
+        return Ray3Sequence(*unproject_rays(
+            pixels, self._get_inverse_view_projection(), width, height,
+            inverse=True))
+
+# Matrix stacks
+# ---------------------------------------------------------------------------
+
+_identity_columns = array.array('d', Matrix4()[:])
+
+class MatrixStack(Slotted):
+    '''A stack of up to capacity 4x4 matrices, starting with the identity,
+    like the OpenGL matrix stacks.
+
+    The matrices are stored in one preallocated array('d'), 16 values each
+    in the column major order of Matrix4[:].  Pushing and popping copy
+    values within it, and the transformations multiply the top matrix in
+    place with the same results as the Matrix4 methods of the same names.
+    '''
+    __slots__ = ['data', '_view', '_top', '_capacity']
+
+    def __init__(self, capacity=32):
+        assert capacity >= 1
+        self.data = array.array('d', [0.0]) * (16 * capacity)
+        self._view = memoryview(self.data)
+        self._top = 0
+        self._capacity = capacity
+        self.identity()
+
+    def __repr__(self):
+        return 'MatrixStack(%d of %d)' % (self._top // 16 + 1,
+                                          self._capacity)
+
+    def __len__(self):
+        return self._top // 16 + 1
+
+    def _get_capacity(self):
+        return self._capacity
+    capacity = property(_get_capacity,
+        doc='Maximum number of matrices on the stack.')
+
+    def _get_top(self):
+        return self._view[self._top:self._top + 16]
+    top = property(_get_top,
+        doc='''Memoryview of the 16 values of the top matrix, in column
+        major order.  It reflects later changes to the top matrix.''')
+
+    def push(self):
+        '''Push a copy of the top matrix.'''
+        s = self._top
+        if s + 16 >= len(self.data):
+            raise IndexError('matrix stack overflow')
+        self._view[s + 16:s + 32] = self._view[s:s + 16]
+        self._top = s + 16
+        return self
+
+    def pop(self):
+        '''Discard the top matrix.'''
+        if self._top == 0:
+            raise IndexError('matrix stack underflow')
+        self._top -= 16
+        return self
+
+    def get_matrix(self):
+        '''A Matrix4 copy of the top matrix.'''
+        M = Matrix4()
+        M[:] = self._view[self._top:self._top + 16].tolist()
+        return M
+
+    def load(self, matrix):
+        '''Replace the top matrix with a Matrix4.'''
+        assert isinstance(matrix, Matrix4)
+        M = self.data
+        s = self._top
+        M[s], M[s + 1], M[s + 2], M[s + 3] = \
+            matrix.a, matrix.e, matrix.i, matrix.m
+        M[s + 4], M[s + 5], M[s + 6], M[s + 7] = \
+            matrix.b, matrix.f, matrix.j, matrix.n
+        M[s + 8], M[s + 9], M[s + 10], M[s + 11] = \
+            matrix.c, matrix.g, matrix.k, matrix.o
+        M[s + 12], M[s + 13], M[s + 14], M[s + 15] = \
+            matrix.d, matrix.h, matrix.l, matrix.p
+        return self
+
+    def identity(self):
+        s = self._top
+        self._view[s:s + 16] = _identity_columns
+        return self
+
+    def multiply(self, matrix):
+        '''Multiply the top matrix by a Matrix4, as top *= matrix.'''
+        assert isinstance(matrix, Matrix4)
+        M = self.data
+        Ba, Bb, Bc, Bd = matrix.a, matrix.b, matrix.c, matrix.d
+        Be, Bf, Bg, Bh = matrix.e, matrix.f, matrix.g, matrix.h
+        Bi, Bj, Bk, Bl = matrix.i, matrix.j, matrix.k, matrix.l
+        Bm, Bn, Bo, Bp = matrix.m, matrix.n, matrix.o, matrix.p
+        for r in range(self._top, self._top + 4):
+            A0 = M[r]
+            A1 = M[r + 4]
+            A2 = M[r + 8]
+            A3 = M[r + 12]
+            M[r] = A0 * Ba + A1 * Be + A2 * Bi + A3 * Bm
+            M[r + 4] = A0 * Bb + A1 * Bf + A2 * Bj + A3 * Bn
+            M[r + 8] = A0 * Bc + A1 * Bg + A2 * Bk + A3 * Bo
+            M[r + 12] = A0 * Bd + A1 * Bh + A2 * Bl + A3 * Bp
+        return self
+
+    def _rotate(self, a, b, c, e, f, g, i, j, k):
+        # Multiply by a rotation: only the first three columns change.
+        M = self.data
+        for r in range(self._top, self._top + 4):
+            A0 = M[r]
+            A1 = M[r + 4]
+            A2 = M[r + 8]
+            M[r] = A0 * a + A1 * e + A2 * i
+            M[r + 4] = A0 * b + A1 * f + A2 * j
+            M[r + 8] = A0 * c + A1 * g + A2 * k
+        return self
+
+    def scale(self, x, y, z):
+        M = self.data
+        for r in range(self._top, self._top + 4):
+            M[r] *= x
+            M[r + 4] *= y
+            M[r + 8] *= z
+        return self
+
+    def translate(self, x, y, z):
+        M = self.data
+        for r in range(self._top, self._top + 4):
+            M[r + 12] = M[r] * x + M[r + 4] * y + M[r + 8] * z + M[r + 12]
+        return self
+
+    def rotatex(self, angle):
+        s = math.sin(angle)
+        c = math.cos(angle)
+        return self._rotate(1., 0., 0., 0., c, -s, 0., s, c)
+
+    def rotatey(self, angle):
+        s = math.sin(angle)
+        c = math.cos(angle)
+        return self._rotate(c, 0., s, 0., 1., 0., -s, 0., c)
+
+    def rotatez(self, angle):
+        s = math.sin(angle)
+        c = math.cos(angle)
+        return self._rotate(c, -s, 0., s, c, 0., 0., 0., 1.)
+
+    def rotate_axis(self, angle, axis):
+        assert isinstance(axis, Vector3)
+        vector = axis.normalized()
+        x = vector.x
+        y = vector.y
+        z = vector.z
+        s = math.sin(angle)
+        c = math.cos(angle)
+        c1 = 1. - c
+        return self._rotate(x * x * c1 + c, x * y * c1 - z * s,
+                            x * z * c1 + y * s, y * x * c1 + z * s,
+                            y * y * c1 + c, y * z * c1 - x * s,
+                            x * z * c1 - y * s, y * z * c1 + x * s,
+                            z * z * c1 + c)
+
+    def rotate_euler(self, heading, attitude, bank):
+        ch = math.cos(heading)
+        sh = math.sin(heading)
+        ca = math.cos(attitude)
+        sa = math.sin(attitude)
+        cb = math.cos(bank)
+        sb = math.sin(bank)
+        return self._rotate(ch * ca, sh * sb - ch * sa * cb,
+                            ch * sa * sb + sh * cb, sa, ca * cb, -ca * sb,
+                            -sh * ca, sh * sa * cb + ch * sb,
+                            -sh * sa * sb + ch * cb)
+
+    def rotate_triple_axis(self, x, y, z):
+        return self._rotate(x.x, y.x, z.x, x.y, y.y, z.y, x.z, y.z, z.z)
+
+
+# Lazy expressions
+# ---------------------------------------------------------------------------
+# expr() traces a function once per kind of arguments, calling it with
+# _ExprNode operands that record each operation as lines of scalar code,
+# and compiles the lines into a function that evaluates the whole
+# expression without intermediate vectors.  A vector node is held in three
+# locals, name + 'x', 'y' and 'z'; a scalar node in one.  The class of a
+# vector node is known when tracing, except after normalized() of a Point3,
+# which gives a Point3 only for zero length; such a node also names a local
+# holding its class.
+
+class _ExprBuilder(object):
+    def __init__(self):
+        self.lines = []
+        self.constants = []
+        self.count = 0
+
+    def node(self, cls, *components):
+        name = 't%d' % self.count
+        self.count += 1
+        if cls is None:
+            self.lines.append('%s = %s' % (name, components[0]))
+        else:
+            for axis, component in zip('xyz', components):
+                self.lines.append('%s%s = %s' % (name, axis, component))
+        return _ExprNode(self, name, cls)
+
+    def class_of(self, node, code):
+        # Give node a class chosen when evaluated by code
+        node.clsvar = node.name + 'k'
+        self.lines.append('%s = %s' % (node.clsvar, code))
+        return node
+
+    def wrap(self, value):
+        if isinstance(value, _ExprNode):
+            return value
+        if type(value) in scalar_types or isinstance(value, Vector3):
+            name = 'c%d' % len(self.constants)
+            self.constants.append(value)
+            cls = value.__class__ if isinstance(value, Vector3) else None
+            return _ExprNode(self, name, cls)
+        return None
+
+class _ExprNode(Slotted):
+    __slots__ = ['_builder', 'name', 'cls', 'clsvar']
+
+    def __init__(self, builder, name, cls):
+        self._builder = builder
+        self.name = name
+        self.cls = cls
+        self.clsvar = None
+
+    def __repr__(self):
+        return '_ExprNode(%s)' % self.name
+
+    def __bool__(self):
+        raise TypeError('expressions cannot depend on the values of vectors')
+    __nonzero__ = __bool__
+
+    def _c(self):
+        n = self.name
+        return n + 'x', n + 'y', n + 'z'
+
+    def _cls_code(self):
+        return self.clsvar or self.cls.__name__
+
+    def _binary(self, other, op, reverse=False):
+        other = self._builder.wrap(other)
+        if other is None:
+            return NotImplemented
+        A, B = (other, self) if reverse else (self, other)
+        if A.cls is None and B.cls is None:
+            return self._builder.node(None, '%s %s %s' % (A.name, op, B.name))
+        if A.cls is None or B.cls is None:
+            if op == '*':
+                # Scalar times vector multiplies as vector times scalar
+                if A.cls is None:
+                    A, B = B, A
+                return self._builder.node(Vector3, *['%s * %s' % (a, B.name)
+                                                     for a in A._c()])
+            if op == '/':
+                if B.cls is None:
+                    return self._builder.node(Vector3,
+                        *['%s / %s' % (a, B.name) for a in A._c()])
+                return self._builder.node(Vector3,
+                    *['%s / %s' % (A.name, b) for b in B._c()])
+            return NotImplemented
+        if op == '/':
+            return NotImplemented
+        if op == '*':
+            cls = Point3 if Point3 in (A.cls, B.cls) else Vector3
+            rule = 'Point3 if Point3 in (%s, %s) else Vector3'
+        else:
+            cls = Vector3 if A.cls is B.cls else Point3
+            rule = 'Vector3 if %s is %s else Point3'
+        node = self._builder.node(cls, *['%s %s %s' % (a, op, b)
+                                         for a, b in zip(A._c(), B._c())])
+        if A.clsvar or B.clsvar:
+            self._builder.class_of(node, rule % (A._cls_code(),
+                                                 B._cls_code()))
+        return node
+
+    def __add__(self, other):
+        return self._binary(other, '+')
+
+    def __radd__(self, other):
+        return self._binary(other, '+', True)
+
+    def __sub__(self, other):
+        return self._binary(other, '-')
+
+    def __rsub__(self, other):
+        return self._binary(other, '-', True)
+
+    def __mul__(self, other):
+        return self._binary(other, '*')
+
+    def __rmul__(self, other):
+        return self._binary(other, '*', True)
+
+    def __truediv__(self, other):
+        return self._binary(other, '/')
+
+    def __rtruediv__(self, other):
+        return self._binary(other, '/', True)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        if self.cls is None:
+            return self._builder.node(None, '-' + self.name)
+        return self._builder.node(Vector3, *['-' + a for a in self._c()])
+
+    def __pos__(self):
+        return self
+
+    def _vector(self, other=None):
+        if other is not None:
+            other = self._builder.wrap(other)
+        if self.cls is None or other is not None and other.cls is None:
+            raise TypeError('operation needs vectors')
+        return other
+
+    def magnitude_squared(self):
+        self._vector()
+        return self._builder.node(None, '%s ** 2 + %s ** 2 + %s ** 2' %
+                                  self._c())
+
+    def __abs__(self):
+        if self.cls is None:
+            return self._builder.node(None, 'abs(%s)' % self.name)
+        return self._builder.node(None, '_sqrt(%s ** 2 + %s ** 2 + '
+                                  '%s ** 2)' % self._c())
+
+    def magnitude(self):
+        self._vector()
+        return abs(self)
+
+    def dot(self, other):
+        other = self._vector(other)
+        return self._builder.node(None, '%s * %s + %s * %s + %s * %s' %
+                                  sum(zip(self._c(), other._c()), ()))
+
+    def cross(self, other):
+        other = self._vector(other)
+        sx, sy, sz = self._c()
+        ox, oy, oz = other._c()
+        return self._builder.node(Vector3,
+                                  '%s * %s - %s * %s' % (sy, oz, sz, oy),
+                                  '-%s * %s + %s * %s' % (sx, oz, sz, ox),
+                                  '%s * %s - %s * %s' % (sx, oy, sy, ox))
+
+    def normalized(self):
+        d = self.magnitude()
+        node = self._builder.node(Vector3,
+            *['%s / %s if %s else %s' % (a, d.name, d.name, a)
+              for a in self._c()])
+        if self.cls is Point3 or self.clsvar:
+            # A zero length vector is copied, keeping its class
+            node.cls = self.cls
+            self._builder.class_of(node, 'Vector3 if %s else %s' %
+                                   (d.name, self._cls_code()))
+        return node
+
+def _expr_compile(function, kinds):
+    # kinds holds, per argument, a vector class, None for a scalar or
+    # 'array' for flat x, y, z triples; returns the compiled function.
+    builder = _ExprBuilder()
+    args = ['a%d' % i for i in range(len(kinds))]
+    nodes = [_ExprNode(builder, name, Vector3 if kind == 'array' else kind)
+             for name, kind in zip(args, kinds)]
+    result = builder.wrap(function(*nodes))
+    if result is None:
+        raise TypeError('expression must give a vector or a number')
+
+    arrays = [name for name, kind in zip(args, kinds) if kind == 'array']
+    source = ['def _expr(%s):' % ', '.join(args)]
+    for i, value in enumerate(builder.constants):
+        if isinstance(value, Vector3):
+            source += ['    c%d%s = _constants[%d].%s' % (i, axis, i, axis)
+                       for axis in 'xyz']
+        else:
+            source += ['    c%d = _constants[%d]' % (i, i)]
+    for name, kind in zip(args, kinds):
+        if kind not in (None, 'array'):
+            source += ['    %sx = %s.x' % (name, name),
+                       '    %sy = %s.y' % (name, name),
+                       '    %sz = %s.z' % (name, name)]
+    indent = '    '
+    if arrays:
+        source += ['    %s = _bulk(%s, _pack)' % (name, name)
+                   for name in arrays]
+        source += ['    n = len(%s)' % arrays[0]]
+        if arrays[1:]:
+            source += ['    if %s:' % ' or '.join(
+                           'len(%s) != n' % name for name in arrays[1:]),
+                       '        raise ValueError('
+                       '"arrays must have the same length")']
+        source += ['    out = _new(%s)' %
+                   ('n // 3' if result.cls is None else 'n'),
+                   '    for s in range(0, n, 3):']
+        indent = '        '
+        for name in arrays:
+            source += [indent + '%sx = %s[s]' % (name, name),
+                       indent + '%sy = %s[s + 1]' % (name, name),
+                       indent + '%sz = %s[s + 2]' % (name, name)]
+    source += [indent + line for line in builder.lines]
+    r = result.name
+    if not arrays:
+        if result.cls is None:
+            source += ['    return %s' % r]
+        else:
+            source += ['    return %s(%sx, %sy, %sz)' %
+                       (result._cls_code(), r, r, r)]
+    else:
+        if result.cls is None:
+            source += [indent + 'out[s // 3] = %s' % r]
+        else:
+            source += [indent + 'out[s] = %sx' % r,
+                       indent + 'out[s + 1] = %sy' % r,
+                       indent + 'out[s + 2] = %sz' % r]
+        source += ['    return out']
+    namespace = {'Vector3': Vector3, 'Point3': Point3, '_sqrt': math.sqrt,
+                 '_bulk': _bulk, '_pack': pack_points3,
+                 '_new': _expr_array, '_constants': builder.constants}
+    source = '\n'.join(source) + '\n'
+    exec(compile(source, '<euclid expr>', 'exec'), namespace)
+    compiled = namespace['_expr']
+    compiled.source = source
+    return compiled
+
+def _expr_array(n):
+    return array.array('d', [0.0]) * n
+
+class _Expression(Slotted):
+    __slots__ = ['function', '_compiled']
+
+    def __init__(self, function):
+        self.function = function
+        self._compiled = {}
+
+    def __repr__(self):
+        return 'expr(%r)' % self.function
+
+    def __call__(self, *args):
+        compiled = self._compiled.get(tuple(map(type, args)))
+        if compiled is None:
+            compiled = self.specialize(*args)
+        return compiled(*args)
+
+    def specialize(self, *args):
+        '''The compiled function for arguments of the kinds of args, to call
+        directly in inner loops.'''
+        key = tuple(map(type, args))
+        if key in self._compiled:
+            return self._compiled[key]
+        kinds = []
+        for arg in args:
+            if isinstance(arg, Vector3):
+                kinds.append(arg.__class__)
+            elif type(arg) in scalar_types:
+                kinds.append(None)
+            elif isinstance(arg, (Slotted, Geometry)) and \
+                 not isinstance(arg, Vector3Array):
+                # Other euclid objects, such as Vector2, are not arrays
+                raise TypeError('cannot evaluate an expression on %r' % arg)
+            elif hasattr(arg, '__len__') or hasattr(arg, '__iter__'):
+                kinds.append('array')
+            else:
+                raise TypeError('cannot evaluate an expression on %r' % arg)
+        compiled = self._compiled[key] = _expr_compile(self.function, kinds)
+        return compiled
+
+def expr(function):
+    '''Compile a function of vectors and numbers into a fused evaluator.
+
+    The returned callable takes the same arguments.  On its first call with
+    a given kind of each argument, the function is called once with
+    placeholders that record its operations; the recording is compiled
+    into code that works on the coordinates directly and creates only the
+    result.  Arguments that are flat sequences of x, y, z triples (or of
+    vectors) are evaluated together in one loop, with vector and number
+    arguments applying to every item, giving an array('d') of results.
+
+    Numbers the function takes from elsewhere, such as from a closure or a
+    global, are fixed when it is traced: later changes to them are not
+    seen.  Vectors taken that way are read on each call.
+    '''
+    return _Expression(function)
+
+# Point statistics and oriented boxes
+# ---------------------------------------------------------------------------
+
+class PointStatistics3(Slotted):
+    '''Centroid and covariance of a stream of 3D points.
+
+    Points are added one at a time or in bulk, in a single pass using
+    Welford's updates, which stay accurate for points far from the origin
+    without keeping them.  Two sets of statistics can be merged.
+    '''
+    __slots__ = ['count', 'mx', 'my', 'mz',
+                 'cxx', 'cxy', 'cxz', 'cyy', 'cyz', 'czz']
+
+    def __init__(self, points=()):
+        self.reset()
+        self.add_many(points)
+
+    def __copy__(self):
+        S = self.__class__()
+        S.merge(self)
+        return S
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'PointStatistics3(%d points, centroid=<%.2f, %.2f, %.2f>)' % \
+            (self.count, self.mx, self.my, self.mz)
+
+    def reset(self):
+        self.count = 0
+        self.mx = self.my = self.mz = 0.
+        self.cxx = self.cxy = self.cxz = self.cyy = self.cyz = self.czz = 0.
+        return self
+
+    def add(self, point):
+        n = self.count = self.count + 1
+        dx = point.x - self.mx
+        dy = point.y - self.my
+        dz = point.z - self.mz
+        self.mx += dx / n
+        self.my += dy / n
+        self.mz += dz / n
+        ex = point.x - self.mx
+        ey = point.y - self.my
+        ez = point.z - self.mz
+        self.cxx += dx * ex
+        self.cxy += dx * ey
+        self.cxz += dx * ez
+        self.cyy += dy * ey
+        self.cyz += dy * ez
+        self.czz += dz * ez
+        return self
+
+    def add_many(self, points):
+        '''Add Point3 objects or a flat buffer of coordinates.'''
+        P = _bulk(points, pack_points3)
+        n = self.count
+        mx, my, mz = self.mx, self.my, self.mz
+        cxx, cxy, cxz = self.cxx, self.cxy, self.cxz
+        cyy, cyz, czz = self.cyy, self.cyz, self.czz
+        for x, y, z in zip(P[0::3], P[1::3], P[2::3]):
+            n += 1
+            dx = x - mx
+            dy = y - my
+            dz = z - mz
+            mx += dx / n
+            my += dy / n
+            mz += dz / n
+            ex = x - mx
+            ey = y - my
+            ez = z - mz
+            cxx += dx * ex
+            cxy += dx * ey
+            cxz += dx * ez
+            cyy += dy * ey
+            cyz += dy * ez
+            czz += dz * ez
+        self.count = n
+        self.mx, self.my, self.mz = mx, my, mz
+        self.cxx, self.cxy, self.cxz = cxx, cxy, cxz
+        self.cyy, self.cyz, self.czz = cyy, cyz, czz
+        return self
+
+    def merge(self, other):
+        '''Add the points counted by other PointStatistics3.'''
+        assert isinstance(other, PointStatistics3)
+        na = self.count
+        nb = other.count
+        if not nb:
+            return self
+        n = na + nb
+        dx = other.mx - self.mx
+        dy = other.my - self.my
+        dz = other.mz - self.mz
+        f = na * nb / n
+        self.cxx += other.cxx + dx * dx * f
+        self.cxy += other.cxy + dx * dy * f
+        self.cxz += other.cxz + dx * dz * f
+        self.cyy += other.cyy + dy * dy * f
+        self.cyz += other.cyz + dy * dz * f
+        self.czz += other.czz + dz * dz * f
+        self.mx += dx * nb / n
+        self.my += dy * nb / n
+        self.mz += dz * nb / n
+        self.count = n
+        return self
+
+    def _get_centroid(self):
+        if not self.count:
+            raise AttributeError('No points')
+        return Point3(self.mx, self.my, self.mz)
+    centroid = property(_get_centroid, doc='Mean of the points.')
+
+    def covariance(self):
+        '''The population covariance of the points as a symmetric
+        Matrix3.'''
+        if not self.count:
+            raise AttributeError('No points')
+        n = self.count
+        M = Matrix3()
+        M.a = self.cxx / n
+        M.b = M.e = self.cxy / n
+        M.c = M.i = self.cxz / n
+        M.f = self.cyy / n
+        M.g = M.j = self.cyz / n
+        M.k = self.czz / n
+        return M
+
+    def principal_axes(self):
+        '''The eigenvalues and unit eigenvectors of the covariance, as a
+        list of (variance, Vector3) by decreasing variance.  The vectors
+        form a right-handed orthonormal basis.'''
+        M = self.covariance()
+        values, vectors = _symmetric_eigen3(M.a, M.b, M.c, M.f, M.g, M.k)
+        axes = sorted(zip(values, vectors), key=lambda a: -a[0])
+        # Keep the basis right-handed
+        axes[2] = (axes[2][0], axes[0][1].cross(axes[1][1]))
+        return axes
+
+_JACOBI_MAX_SWEEPS = 32
+
+def _symmetric_eigen3(a00, a01, a02, a11, a12, a22):
+    # Cyclic Jacobi rotations of a symmetric 3x3 matrix; returns the
+    # eigenvalues and the unit eigenvectors, in matching order.
+    A = [[a00, a01, a02], [a01, a11, a12], [a02, a12, a22]]
+    V = [[1., 0., 0.], [0., 1., 0.], [0., 0., 1.]]
+    for sweep in range(_JACOBI_MAX_SWEEPS):
+        off = A[0][1] ** 2 + A[0][2] ** 2 + A[1][2] ** 2
+        diagonal = A[0][0] ** 2 + A[1][1] ** 2 + A[2][2] ** 2
+        if off <= 1e-30 * diagonal or not off:
+            break
+        for p, q in ((0, 1), (0, 2), (1, 2)):
+            apq = A[p][q]
+            if not apq:
+                continue
+            theta = (A[q][q] - A[p][p]) / (2 * apq)
+            t = 1 / (abs(theta) + math.sqrt(theta * theta + 1))
+            if theta < 0:
+                t = -t
+            c = 1 / math.sqrt(t * t + 1)
+            s = t * c
+            for row in A:
+                rp = row[p]
+                rq = row[q]
+                row[p] = c * rp - s * rq
+                row[q] = s * rp + c * rq
+            Ap = A[p]
+            Aq = A[q]
+            for k in range(3):
+                pk = Ap[k]
+                qk = Aq[k]
+                Ap[k] = c * pk - s * qk
+                Aq[k] = s * pk + c * qk
+            for row in V:
+                rp = row[p]
+                rq = row[q]
+                row[p] = c * rp - s * rq
+                row[q] = s * rp + c * rq
+    return ([A[0][0], A[1][1], A[2][2]],
+            [Vector3(V[0][i], V[1][i], V[2][i]).normalize() for i in range(3)])
+
+class OBB3(Slotted):
+    '''Oriented bounding box in 3D: a center, three orthonormal axes and
+    the half extents of the box along them.'''
+    __slots__ = ['c', 'axes', 'half_extents']
+
+    def __init__(self, center, axes, half_extents):
+        assert isinstance(center, Vector3) and len(axes) == 3 and \
+               len(half_extents) == 3
+        self.c = Point3(center.x, center.y, center.z)
+        self.axes = tuple(Vector3(a.x, a.y, a.z) for a in axes)
+        self.half_extents = tuple(float(e) for e in half_extents)
+
+    def __copy__(self):
+        return self.__class__(self.c, self.axes, self.half_extents)
+
+    copy = __copy__
+
+    def __repr__(self):
+        return 'OBB3(<%.2f, %.2f, %.2f>, half_extents=<%.2f, %.2f, %.2f>)' % \
+            ((self.c.x, self.c.y, self.c.z) + self.half_extents)
+
+    def new_bounding(cls, points, statistics=None):
+        '''The box around points aligned with their principal axes.
+
+        statistics is the PointStatistics3 of the points if already known;
+        otherwise they are computed first.
+        '''
+        P = _bulk(points, pack_points3)
+        if statistics is None:
+            statistics = PointStatistics3(P)
+        c = statistics.centroid
+        axes = [axis for variance, axis in statistics.principal_axes()]
+        lo = []
+        hi = []
+        for a in axes:
+            ax, ay, az = a.x, a.y, a.z
+            d = [(x - c.x) * ax + (y - c.y) * ay + (z - c.z) * az
+                 for x, y, z in zip(P[0::3], P[1::3], P[2::3])]
+            lo.append(min(d))
+            hi.append(max(d))
+        for a, l, h in zip(axes, lo, hi):
+            c += a * ((l + h) / 2)
+        return cls(c, axes, [(h - l) / 2 for l, h in zip(lo, hi)])
+    new_bounding = classmethod(new_bounding)
+
+    def _apply_transform(self, t):
+        # Keeps a box for rotations, translations and uniform scales
+        self.c = t * self.c
+        axes = []
+        half_extents = []
+        for a, e in zip(self.axes, self.half_extents):
+            v = t * (a * e)
+            e = abs(v)
+            axes.append(v / e if e else t * a)
+            half_extents.append(e)
+        self.axes = tuple(axes)
+        self.half_extents = tuple(half_extents)
+
+    def _corners(self):
+        u, v, w = [a * e for a, e in zip(self.axes, self.half_extents)]
+        return [self.c + u * i + v * j + w * k
+                for i in (-1, 1) for j in (-1, 1) for k in (-1, 1)]
+
+    def _get_bounds(self):
+        c = self.c
+        r = [sum(abs(a[i]) * e for a, e in zip(self.axes,
+                                                self.half_extents))
+             for i in range(3)]
+        return AABB3(Point3(c.x - r[0], c.y - r[1], c.z - r[2]),
+                     Point3(c.x + r[0], c.y + r[1], c.z + r[2]))
+    bounds = property(_get_bounds, doc='AABB3 containing the box')
+
+    def _local(self, point):
+        # Coordinates of point along the axes, from the center
+        dx = point.x - self.c.x
+        dy = point.y - self.c.y
+        dz = point.z - self.c.z
+        return [a.x * dx + a.y * dy + a.z * dz for a in self.axes]
+
+    def contains(self, point):
+        return all(abs(d) <= e for d, e in zip(self._local(point),
+                                               self.half_extents))
+
+    def closest_point(self, point):
+        '''The point of the box closest to point.'''
+        p = self.c.copy()
+        for a, d, e in zip(self.axes, self._local(point), self.half_extents):
+            p += a * _clamp(d, -e, e)
+        return p
+
+    def support(self, direction):
+        p = self.c.copy()
+        for a, e in zip(self.axes, self.half_extents):
+            p += a * (e if a.dot(direction) > 0 else -e)
+        return p
+
+    def overlaps(self, other):
+        '''True if the box and another OBB3 or AABB3 overlap, by the
+        separating axis test.'''
+        return _intersect_obb3_obb3(self, _as_obb3(other))
+
+    def intersect(self, other):
+        return other._intersect_obb3(self)
+
+    def _intersect_point3(self, other):
+        return self.contains(other)
+
+    def _intersect_line3(self, other):
+        return _intersect_line3_obb3(other, self)
+
+    def _intersect_sphere(self, other):
+        return _intersect_sphere_obb3(other, self)
+
+    def _intersect_plane(self, other):
+        return _intersect_plane_obb3(other, self)
+
+    def _intersect_aabb3(self, other):
+        return _intersect_aabb3_obb3(other, self)
+
+    def _intersect_obb3(self, other):
+        return _intersect_obb3_obb3(other, self)
+
+_OBB_EPS = 1e-12
+
+def _as_obb3(box):
+    if isinstance(box, OBB3):
+        return box
+    assert isinstance(box, AABB3)
+    return OBB3(box.center, (Vector3(1., 0., 0.), Vector3(0., 1., 0.),
+                             Vector3(0., 0., 1.)),
+                ((box.maxx - box.minx) / 2, (box.maxy - box.miny) / 2,
+                 (box.maxz - box.minz) / 2))
+
+def _intersect_line3_obb3(L, B):
+    # Slabs of the box, in its own frame
+    u0, u1 = _line3_range(L)
+    for d, a, e in zip(B._local(L.p), B.axes, B.half_extents):
+        v = a.x * L.v.x + a.y * L.v.y + a.z * L.v.z
+        if v:
+            ua = (-e - d) / v
+            ub = (e - d) / v
+            if ua > ub:
+                ua, ub = ub, ua
+            if ua > u0:
+                u0 = ua
+            if ub < u1:
+                u1 = ub
+        elif d < -e or d > e:
+            return None
+    if u0 > u1:
+        return None
+    return LineSegment3(Point3(L.p.x + u0 * L.v.x,
+                               L.p.y + u0 * L.v.y,
+                               L.p.z + u0 * L.v.z),
+                        Point3(L.p.x + u1 * L.v.x,
+                               L.p.y + u1 * L.v.y,
+                               L.p.z + u1 * L.v.z))
+
+def _intersect_sphere_obb3(S, B):
+    p = B.closest_point(S.c)
+    return (p.x - S.c.x) ** 2 + (p.y - S.c.y) ** 2 + \
+           (p.z - S.c.z) ** 2 <= S.r ** 2
+
+def _intersect_plane_obb3(P, B):
+    n = P.n
+    r = sum(e * abs(n.dot(a)) for a, e in zip(B.axes, B.half_extents))
+    return abs(n.dot(B.c) - P.k) <= r
+
+def _intersect_aabb3_obb3(A, B):
+    return _intersect_obb3_obb3(_as_obb3(A), B)
+
+def _intersect_obb3_obb3(A, B):
+    # Separating axis test over the 15 candidate axes: the face normals of
+    # both boxes and the cross products of their edges.  The epsilon keeps
+    # near parallel edges, whose cross products vanish, from separating.
+    a = A.half_extents
+    b = B.half_extents
+    R = [[Ai.dot(Bj) for Bj in B.axes] for Ai in A.axes]
+    absR = [[abs(r) + _OBB_EPS for r in row] for row in R]
+    t = B.c - A.c
+    T = [t.dot(Ai) for Ai in A.axes]
+    for i in range(3):
+        if abs(T[i]) > a[i] + b[0] * absR[i][0] + b[1] * absR[i][1] + \
+                       b[2] * absR[i][2]:
+            return False
+    for j in range(3):
+        if abs(T[0] * R[0][j] + T[1] * R[1][j] + T[2] * R[2][j]) > \
+           a[0] * absR[0][j] + a[1] * absR[1][j] + a[2] * absR[2][j] + b[j]:
+            return False
+    for i in range(3):
+        i1 = (i + 1) % 3
+        i2 = (i + 2) % 3
+        for j in range(3):
+            j1 = (j + 1) % 3
+            j2 = (j + 2) % 3
+            ra = a[i1] * absR[i2][j] + a[i2] * absR[i1][j]
+            rb = b[j1] * absR[i][j2] + b[j2] * absR[i][j1]
+            if abs(T[i2] * R[i1][j] - T[i1] * R[i2][j]) > ra + rb:
+                return False
+    return True
+
+for _a, _b, _function in (
+        (Point3, OBB3, _contained),
+        (Line3, OBB3, _intersect_line3_obb3),
+        (Sphere, OBB3, _intersect_sphere_obb3),
+        (Plane, OBB3, _intersect_plane_obb3),
+        (AABB3, OBB3, _intersect_aabb3_obb3),
+        (OBB3, OBB3, _intersect_obb3_obb3)):
+    register_intersect(_a, _b, _function)
+del _a, _b, _function
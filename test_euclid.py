@@ -1,12 +1,16 @@
 from __future__ import division, print_function, unicode_literals
 
+import array
 import copy
 import io
+import math
+import os
 from math import sqrt, sin, cos, radians, degrees, hypot
 try:
     import cPickle as pickle
 except Exception:
     import pickle
+import random
 import unittest
 
 import euclid as eu
@@ -904,6 +908,14 @@ class Test_Line2_family(unittest.TestCase):
         b = eu.LineSegment2(a)
         self.assertTrue(linesegment2_qeq(a, b, fe))
 
+    def test_connect_parallel(self):
+        a = eu.Line2(eu.Point2(0.0, 0.0), eu.Vector2(1.0, 0.0))
+        b = eu.Ray2(eu.Point2(2.0, 1.0), eu.Vector2(1.0, 0.0))
+        c = eu.LineSegment2(eu.Point2(2.0, 0.0), eu.Point2(2.0, 1.0))
+        self.assertTrue(linesegment2_qeq(a.connect(b), c, fe))
+        self.assertEqual(a.connect(b).p, c.p)
+        self.assertEqual(b.connect(a).p, c.p + c.v)
+
 def circle_qec(c1, c2, qe):
     assert isinstance(c1, eu.Circle) and isinstance(c2, eu.Circle)
     return abs(c1.c - c2.c) + abs(c1.r - c2.r) < qe
@@ -1174,5 +1186,1635 @@ class Test_Line3_family(unittest.TestCase):
         b = eu.LineSegment3(a)
         self.assertTrue(linesegment3_qeq(a, b, fe))
 
+class Test_Predicates(unittest.TestCase):
+    def test_orient2d(self):
+        a = eu.Point2(0.0, 0.0)
+        b = eu.Point2(1.0, 0.0)
+        self.assertTrue(eu.orient2d(a, b, eu.Point2(0.0, 1.0)) > 0)
+        self.assertTrue(eu.orient2d(a, b, eu.Point2(0.0, -1.0)) < 0)
+        self.assertEqual(eu.orient2d(a, b, eu.Point2(2.0, 0.0)), 0)
+
+    def test_orient2d_near_degenerate(self):
+        # a naive float determinant gets the sign of these wrong
+        b = eu.Point2(12.0, 12.0)
+        c = eu.Point2(24.0, 24.0)
+        above = eu.Point2(0.5, 0.5 + 2 ** -53)
+        below = eu.Point2(0.5 + 2 ** -53, 0.5)
+        on = eu.Point2(0.5, 0.5)
+        self.assertTrue(eu.orient2d(above, b, c) > 0)
+        self.assertTrue(eu.orient2d(below, b, c) < 0)
+        self.assertEqual(eu.orient2d(on, b, c), 0)
+
+    def test_incircle(self):
+        a = eu.Point2(1.0, 0.0)
+        b = eu.Point2(0.0, 1.0)
+        c = eu.Point2(-1.0, 0.0)
+        self.assertTrue(eu.incircle(a, b, c, eu.Point2(0.0, 0.0)) > 0)
+        self.assertTrue(eu.incircle(a, b, c, eu.Point2(2.0, 0.0)) < 0)
+        self.assertEqual(eu.incircle(a, b, c, eu.Point2(0.0, -1.0)), 0)
+        self.assertTrue(eu.incircle(a, b, c, eu.Point2(0.0, -1.0 + 2 ** -52)) > 0)
+
+    def test_robust_intersect(self):
+        a = eu.LineSegment2(eu.Point2(0.0, 0.0), eu.Point2(1.0, 1.0))
+        b = eu.LineSegment2(eu.Point2(0.0, 1.0), eu.Point2(1.0, 0.0))
+        p = a.intersect(b, robust=True)
+        self.assertTrue(abs(p - eu.Point2(0.5, 0.5)) < fe)
+        # touching at an endpoint
+        b = eu.LineSegment2(eu.Point2(1.0, 1.0), eu.Point2(2.0, 0.0))
+        p = a.intersect(b, robust=True)
+        self.assertTrue(abs(p - eu.Point2(1.0, 1.0)) < fe)
+        # just missing the endpoint
+        b = eu.LineSegment2(eu.Point2(1.0 + 2 ** -52, 1.0),
+                            eu.Point2(2.0, 0.0))
+        self.assertEqual(a.intersect(b, robust=True), None)
+        # parallel
+        b = eu.Line2(eu.Point2(0.0, 1.0), eu.Vector2(3.0, 3.0))
+        self.assertEqual(a.intersect(b, robust=True), None)
+        # ray pointing away
+        r = eu.Ray2(eu.Point2(0.0, 1.0), eu.Vector2(-1.0, 1.0))
+        self.assertEqual(a.intersect(r, robust=True), None)
+        # non line arguments use the ordinary dispatch
+        c = eu.Circle(eu.Point2(0.0, 0.0), 0.5)
+        self.assertTrue(a.intersect(c, robust=True) is not None)
+
+class Test_ConvexHull(unittest.TestCase):
+    def test_convex_hull2(self):
+        pts = [eu.Point2(0, 0), eu.Point2(1, 0), eu.Point2(0.5, 0.5),
+               eu.Point2(1, 1), eu.Point2(0, 1), eu.Point2(0.5, 0)]
+        indices, edges = eu.convex_hull2(pts)
+        self.assertEqual(indices, [0, 1, 3, 4])
+        self.assertEqual(edges, [(0, 1), (1, 3), (3, 4), (4, 0)])
+
+    def test_convex_hull2_buffer(self):
+        buf = array.array('d', [0, 0, 1, 0, 0.5, 0.5, 1, 1, 0, 1, 0.5, 0])
+        self.assertEqual(eu.convex_hull2(buf)[0], [0, 1, 3, 4])
+
+    def test_convex_hull2_degenerate(self):
+        self.assertEqual(eu.convex_hull2([]), ([], []))
+        self.assertEqual(eu.convex_hull2([(1, 1)] * 3), ([0], []))
+        self.assertEqual(eu.convex_hull2([(0, 0), (1, 1), (2, 2)]),
+                         ([0, 2], [(0, 2)]))
+
+    def test_incremental(self):
+        pts = [(0, 0), (4, 0), (4, 4), (0, 4), (1, 1), (2, 3)]
+        hull = eu.ConvexHull2(pts)
+        self.assertEqual(hull.indices, [0, 1, 2, 3])
+        hull.add((2, -1))
+        hull.add((1, 2))
+        self.assertEqual(len(hull), 8)
+        self.assertEqual(hull.indices, [0, 6, 1, 2, 3])
+        hull.extend([(5, 5), (3, 3)])
+        self.assertEqual(hull.indices, [0, 6, 1, 8, 3])
+        self.assertEqual(hull.points[3], eu.Point2(5, 5))
+
+    def test_convex_hull3(self):
+        pts = [eu.Point3(x, y, z) for x in (0, 1) for y in (0, 1)
+                                  for z in (0, 1)]
+        pts.append(eu.Point3(0.5, 0.5, 0.5))
+        indices, faces = eu.convex_hull3(pts)
+        self.assertEqual(indices, list(range(8)))
+        self.assertEqual(len(faces), 12)
+        # faces are wound counterclockwise seen from outside
+        center = eu.Point3(0.5, 0.5, 0.5)
+        for a, b, c in faces:
+            n = (pts[b] - pts[a]).cross(pts[c] - pts[a])
+            self.assertTrue(n.dot(pts[a] - center) > 0)
+
+    def test_convex_hull3_degenerate(self):
+        self.assertRaises(AttributeError, eu.convex_hull3,
+                          [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)])
+
+class Test_Polygon2(unittest.TestCase):
+    def setUp(self):
+        # a U shape, counterclockwise
+        self.poly = eu.Polygon2([eu.Point2(0, 0), eu.Point2(3, 0),
+                                 eu.Point2(3, 3), eu.Point2(2, 3),
+                                 eu.Point2(2, 1), eu.Point2(1, 1),
+                                 eu.Point2(1, 3), eu.Point2(0, 3)])
+
+    def test_area_centroid(self):
+        self.assertEqual(self.poly.area, 7.0)
+        self.assertEqual(self.poly.signed_area, 7.0)
+        c = self.poly.centroid
+        self.assertTrue(abs(c - eu.Point2(1.5, 9.5 / 7)) < fe)
+
+    def test_contains(self):
+        self.assertTrue(self.poly.contains(eu.Point2(0.5, 2.5)))
+        self.assertTrue(self.poly.contains(eu.Point2(1.5, 0.5)))
+        self.assertFalse(self.poly.contains(eu.Point2(1.5, 2)))
+        self.assertFalse(self.poly.contains(eu.Point2(-1, 1)))
+        self.assertTrue(eu.Point2(2.5, 2).intersect(self.poly))
+
+    def test_contains_many(self):
+        pts = [eu.Point2(0.5, 2.5), eu.Point2(1.5, 2), eu.Point2(2.5, 0.5)]
+        self.assertEqual(self.poly.contains_many(pts), [True, False, True])
+        buf = array.array('d', [0.5, 2.5, 1.5, 2, 2.5, 0.5])
+        self.assertEqual(self.poly.contains_many(buf), [True, False, True])
+
+    def test_contains_large(self):
+        n = 1000
+        pts = [(math.cos(2 * math.pi * i / n), math.sin(2 * math.pi * i / n))
+               for i in range(n)]
+        poly = eu.Polygon2(pts)
+        self.assertTrue(abs(poly.area - math.pi) < 1e-4)
+        for i in range(50):
+            a = 0.3 * i
+            r = 0.02 * i
+            self.assertEqual(poly.contains(eu.Point2(r * math.cos(a),
+                                                     r * math.sin(a))),
+                             r < 0.999)
+
+    def test_contains_comb(self):
+        # Tall teeth: every slab is crossed by many edges
+        pts = [eu.Point2(0, 0)]
+        for i in range(20):
+            pts += [eu.Point2(2 * i + 1, 0), eu.Point2(2 * i + 1, 10),
+                    eu.Point2(2 * i + 2, 10), eu.Point2(2 * i + 2, 0)]
+        pts += [eu.Point2(41, 0), eu.Point2(41, -1), eu.Point2(0, -1)]
+        for poly in (eu.Polygon2(pts), eu.Polygon2(pts, index=True)):
+            for i in range(20):
+                self.assertTrue(poly.contains(eu.Point2(2 * i + 1.5, 5)))
+                self.assertFalse(poly.contains(eu.Point2(2 * i + 0.5, 5)))
+                self.assertTrue(poly.contains(eu.Point2(2 * i + 0.5, -0.5)))
+            self.assertFalse(poly.contains(eu.Point2(41.5, 5)))
+            self.assertFalse(poly.contains(eu.Point2(5, 10.5)))
+            self.assertFalse(poly.contains(eu.Point2(5, -1.5)))
+
+    def test_index(self):
+        poly = eu.Polygon2(self.poly.vertices)
+        self.assertTrue(poly.contains(eu.Point2(0.5, 2.5)))
+        self.assertTrue(poly._index is None)
+        poly.build_index()
+        self.assertFalse(poly._index is None)
+        self.assertTrue(poly.contains(eu.Point2(0.5, 2.5)))
+        self.assertFalse(poly.contains(eu.Point2(1.5, 2)))
+        poly = eu.Matrix3.new_translate(10, 0) * poly
+        self.assertTrue(poly.contains(eu.Point2(10.5, 2.5)))
+        self.assertFalse(poly._index is None)
+        copy = poly.copy()
+        self.assertFalse(copy.contains(eu.Point2(11.5, 2)))
+        self.assertFalse(copy._index is None)
+
+    def test_index_jagged(self):
+        # A jagged star: most horizontal lines cross many edges
+        n = 4000
+        pts = [((1 + 0.5 * (i % 2)) * math.cos(2 * math.pi * i / n),
+                (1 + 0.5 * (i % 2)) * math.sin(2 * math.pi * i / n))
+               for i in range(n)]
+        scan = eu.Polygon2(pts)
+        indexed = eu.Polygon2(pts, index=True)
+        rnd = random.Random(4)
+        points = [eu.Point2(rnd.uniform(-1.6, 1.6), rnd.uniform(-1.6, 1.6))
+                  for i in range(500)]
+        points += [eu.Point2(rnd.uniform(-1.6, 1.6), y)
+                   for x, y in pts[:200]]
+        self.assertEqual(indexed.contains_many(points),
+                         scan.contains_many(points))
+        entries = sum([len(edges) for edges in indexed._index[2] if edges])
+        self.assertTrue(entries <= 2 * n * math.ceil(math.log(n, 2)))
+        self.assertTrue(entries < 10 * n)
+
+    def test_connect(self):
+        p = eu.Point2(1.4, 2)
+        c = p.connect(self.poly)
+        self.assertTrue(linesegment2_qeq(
+            c, eu.LineSegment2(p, eu.Point2(1, 2)), fe))
+        c = self.poly.connect(p)
+        self.assertTrue(linesegment2_qeq(
+            c, eu.LineSegment2(eu.Point2(1, 2), p), fe))
+        self.assertTrue(abs(self.poly.distance(eu.Point2(4, 0)) - 1) < fe)
+
+    def test_transform(self):
+        poly = eu.Matrix3.new_translate(10, 0) * self.poly
+        self.assertTrue(poly.contains(eu.Point2(10.5, 2.5)))
+        self.assertFalse(poly.contains(eu.Point2(0.5, 2.5)))
+
+class Test_TriangleMesh3(unittest.TestCase):
+    def setUp(self):
+        # unit cube, 12 triangles
+        verts = [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+        faces = [(0, 1, 3), (0, 3, 2), (4, 6, 7), (4, 7, 5),
+                 (0, 4, 5), (0, 5, 1), (2, 3, 7), (2, 7, 6),
+                 (0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3)]
+        self.mesh = eu.TriangleMesh3(verts, faces)
+
+    def test_basics(self):
+        self.assertEqual(len(self.mesh), 12)
+        self.assertEqual(len(self.mesh.vertices), 24)
+        self.assertEqual(repr(self.mesh),
+                         'TriangleMesh3(8 vertices, 12 triangles)')
+
+    def test_ray(self):
+        r = eu.Ray3(eu.Point3(0.25, 0.5, -1), eu.Vector3(0, 0, 1))
+        t, index, u, v = r.intersect(self.mesh)
+        self.assertTrue(abs(t - 1) < fe)
+        self.assertTrue(index in (8, 9))
+        # barycentrics reproduce the hit point
+        a, b, c = self.mesh.triangles[3 * index:3 * index + 3]
+        pts = [eu.Point3(*self.mesh.vertices[3 * i:3 * i + 3])
+               for i in (a, b, c)]
+        hit = pts[0] * (1 - u - v) + pts[1] * u + pts[2] * v
+        self.assertTrue(abs(hit - eu.Point3(0.25, 0.5, 0)) < fe)
+        # pointing away
+        r = eu.Ray3(eu.Point3(0.25, 0.5, -1), eu.Vector3(0, 0, -1))
+        self.assertEqual(self.mesh.intersect(r), None)
+
+    def test_line_and_segment(self):
+        L = eu.Line3(eu.Point3(0.5, 0.25, 3), eu.Vector3(0, 0, 1))
+        self.assertTrue(abs(self.mesh.intersect(L)[0] + 3) < fe)
+        s = eu.LineSegment3(eu.Point3(0.5, 0.25, 3), eu.Point3(0.5, 0.25, 2))
+        self.assertEqual(self.mesh.intersect(s), None)
+        s = eu.LineSegment3(eu.Point3(0.5, 0.25, 3), eu.Point3(0.5, 0.25, 0.5))
+        self.assertTrue(abs(self.mesh.intersect(s)[0] - 0.8) < fe)
+
+    def test_intersect_many(self):
+        rays = [eu.Ray3(eu.Point3(0.1 * i, 0.5, 2), eu.Vector3(0, 0, -1))
+                for i in range(15)]
+        hits = self.mesh.intersect_many(rays)
+        self.assertEqual(hits, [r.intersect(self.mesh) for r in rays])
+        self.assertEqual([h is not None for h in hits],
+                         [i <= 10 for i in range(15)])
+        self.assertEqual(self.mesh.intersect_many(eu.pack_lines3(rays)),
+                         hits)
+        self.assertEqual(self.mesh.intersect_many(iter(rays)), hits)
+        self.assertEqual(self.mesh.intersect_many([]), [])
+        self.assertRaises(AttributeError, self.mesh.intersect_many,
+                          eu.pack_lines3(rays)[:-1])
+
+    def test_distance(self):
+        r = eu.Ray3(eu.Point3(0.25, 0.5, -1), eu.Vector3(0, 0, 4))
+        t, index, u, v = self.mesh.intersect(r)
+        self.assertTrue(abs(t * abs(r.v) - 1) < fe)
+
+    def test_transform(self):
+        mesh = eu.Matrix4.new_translate(0, 0, 10) * self.mesh
+        r = eu.Ray3(eu.Point3(0.25, 0.5, 0), eu.Vector3(0, 0, 1))
+        self.assertTrue(abs(mesh.intersect(r)[0] - 10) < fe)
+
+class Test_AABB(unittest.TestCase):
+    def setUp(self):
+        self.box2 = eu.AABB2(eu.Point2(0, 0), eu.Point2(2, 1))
+        self.box3 = eu.AABB3(eu.Point3(0, 0, 0), eu.Point3(1, 1, 1))
+
+    def test_bounds(self):
+        self.assertEqual(eu.AABB2(eu.Point2(2, 1), eu.Point2(0, 0)),
+                         self.box2)
+        self.assertEqual(eu.Circle(eu.Point2(1, 1), 1.).bounds,
+                         eu.AABB2(eu.Point2(0, 0), eu.Point2(2, 2)))
+        b = eu.Ray2(eu.Point2(0, 0), eu.Vector2(1, 0)).bounds
+        self.assertEqual((b.minx, b.maxx, b.maxy), (0, float('inf'), 0))
+        b = eu.Plane(eu.Vector3(0, 0, 1), 2.).bounds
+        self.assertEqual((b.minz, b.maxz, b.maxx), (2, 2, float('inf')))
+        self.assertEqual(eu.AABB3.new_bounding([(0, 1, 2), (3, -4, 5)]),
+                         eu.AABB3(eu.Point3(0, -4, 2), eu.Point3(3, 1, 5)))
+
+    def test_infinite_bounds(self):
+        P = eu.Plane(eu.Vector3(0, 0, 1), 2.)
+        self.assertTrue(P.intersect(P.bounds))
+        self.assertTrue(P.bounds.intersect(P))
+        L = eu.Line3(eu.Point3(0, 0, 0), eu.Vector3(1, 0, 0))
+        self.assertTrue(eu.Plane(eu.Vector3(1, 0, 0), 5.).intersect(L.bounds))
+        R = eu.Ray3(eu.Point3(0, 0, 0), eu.Vector3(1, 0, 0))
+        self.assertFalse(eu.Plane(eu.Vector3(1, 0, 0), -5.).intersect(
+            R.bounds))
+        c = eu.Plane(eu.Vector3(0, 0, 1), 7.).connect(
+            eu.Plane(eu.Vector3(0, 0, 1), 5.).bounds)
+        self.assertEqual((c.p1.z, c.p2.z), (7, 5))
+        self.assertEqual((c.p1.x, c.p1.y), (0, 0))
+        c = eu.Plane(eu.Vector3(1, 0, 0), -5.).connect(R.bounds)
+        self.assertEqual((c.p1.x, c.p2.x), (-5, 0))
+
+    def test_bounds_follow_changes(self):
+        s = eu.Sphere(eu.Point3(0, 0, 0), 1.)
+        t = eu.Matrix4.new_translate(1, 0, 0) * s
+        self.assertEqual(t.bounds,
+                         eu.AABB3(eu.Point3(0, -1, -1), eu.Point3(2, 1, 1)))
+        self.assertEqual(s.bounds.minx, -1)
+        s.r = 2.
+        self.assertEqual(s.bounds.minx, -2)
+        s.c.x = 100
+        self.assertEqual(s.bounds.minx, 98)
+        c = eu.Circle(eu.Point2(0, 0), 1.)
+        c.r = 10.
+        self.assertEqual(c.bounds.maxx, 10)
+        c.c.y = 5
+        self.assertEqual(c.bounds.maxy, 15)
+        L = eu.LineSegment2(eu.Point2(0, 0), eu.Vector2(1, 1))
+        L.p = eu.Point2(5, 5)
+        self.assertEqual(L.bounds, eu.AABB2(eu.Point2(5, 5), eu.Point2(6, 6)))
+        p = eu.Point3(0, 0, 0)
+        M = eu.LineSegment3.new_borrowed(p, eu.Vector3(1, 1, 1))
+        p.z = -3
+        self.assertEqual(M.bounds.minz, -3)
+        P = eu.Plane(eu.Vector3(0, 0, 1), 2.)
+        P.k = 3.
+        self.assertEqual(P.bounds.minz, 3)
+
+    def test_intersect2(self):
+        b = self.box2
+        self.assertTrue(b.intersect(eu.Point2(1, 0.5)))
+        self.assertFalse(eu.Point2(3, 3).intersect(b))
+        s = eu.LineSegment2(eu.Point2(-1, 0.5), eu.Point2(3, 0.5))
+        self.assertTrue(linesegment2_qeq(s.intersect(b), eu.LineSegment2(
+            eu.Point2(0, 0.5), eu.Point2(2, 0.5)), fe))
+        s = eu.LineSegment2(eu.Point2(-1, 2), eu.Point2(3, 2))
+        self.assertEqual(b.intersect(s), None)
+        self.assertTrue(b.intersect(eu.Circle(eu.Point2(2.5, 0.5), 0.6)))
+        self.assertFalse(b.intersect(eu.Circle(eu.Point2(3, 3), 1.)))
+        o = eu.AABB2(eu.Point2(1, 0.5), eu.Point2(4, 4))
+        self.assertEqual(b.intersect(o),
+                         eu.AABB2(eu.Point2(1, 0.5), eu.Point2(2, 1)))
+        self.assertTrue(b.overlaps(o))
+
+    def test_connect2(self):
+        b = self.box2
+        self.assertEqual(b.connect(eu.Point2(1, 0.5)), None)
+        c = eu.Circle(eu.Point2(4, 0.5), 1.).connect(b)
+        self.assertTrue(linesegment2_qeq(c, eu.LineSegment2(
+            eu.Point2(3, 0.5), eu.Point2(2, 0.5)), fe))
+        L = eu.Line2(eu.Point2(0, 3), eu.Vector2(1, 1))
+        self.assertTrue(linesegment2_qeq(b.connect(L), eu.LineSegment2(
+            eu.Point2(0, 1), eu.Point2(-1, 2)), fe))
+        self.assertTrue(abs(b.distance(L) - math.sqrt(2)) < fe)
+
+    def test_intersect3(self):
+        b = self.box3
+        r = eu.Ray3(eu.Point3(0.5, 0.5, -1), eu.Vector3(0, 0, 1))
+        self.assertTrue(linesegment3_qeq(b.intersect(r), eu.LineSegment3(
+            eu.Point3(0.5, 0.5, 0), eu.Point3(0.5, 0.5, 1)), fe))
+        r = eu.Ray3(eu.Point3(0.5, 0.5, -1), eu.Vector3(0, 0, -1))
+        self.assertEqual(r.intersect(b), None)
+        self.assertFalse(eu.Sphere(eu.Point3(2, 2, 2), 1.).intersect(b))
+        self.assertTrue(eu.Sphere(eu.Point3(1.5, 0.5, 0.5), 1.).intersect(b))
+        self.assertTrue(eu.Plane(eu.Vector3(0, 0, 1), 0.5).intersect(b))
+        self.assertFalse(b.intersect(eu.Plane(eu.Vector3(0, 0, 1), 2.)))
+        self.assertTrue(b.contains(eu.Point3(0.5, 0.5, 0.5)))
+
+    def test_connect3(self):
+        b = self.box3
+        self.assertTrue(linesegment3_qeq(b.connect(eu.Point3(2, 0.5, 0.5)),
+            eu.LineSegment3(eu.Point3(1, 0.5, 0.5),
+                            eu.Point3(2, 0.5, 0.5)), fe))
+        s = eu.LineSegment3(eu.Point3(2, 2, 0), eu.Point3(2, 3, 5))
+        self.assertTrue(abs(s.connect(b).length - math.sqrt(2)) < fe)
+        c = b.connect(eu.Plane(eu.Vector3(0, 0, 1), 2.))
+        self.assertTrue(abs(c.length - 1) < fe)
+        o = eu.AABB3(eu.Point3(2, 2, 2), eu.Point3(3, 3, 3))
+        self.assertTrue(abs(b.connect(o).length - math.sqrt(3)) < fe)
+
+class Test_BoundingBall(unittest.TestCase):
+    def check(self, ball, pts, coords):
+        c = coords(ball.c)
+        for p in pts:
+            self.assertTrue(math.sqrt(eu._dist2(coords(p), c)) < ball.r + fe)
+
+    def test_circle(self):
+        pts = [eu.Point2(0, 0), eu.Point2(4, 0), eu.Point2(2, 1),
+               eu.Point2(1, -1), eu.Point2(3, 0.5)]
+        c = eu.Circle.new_bounding(pts, exact=True)
+        self.assertTrue(abs(c.c - eu.Point2(2, 0)) < fe)
+        self.assertTrue(abs(c.r - 2) < fe)
+        a = eu.Circle.new_bounding(pts)
+        self.check(a, pts, tuple)
+        self.assertTrue(a.r >= c.r - fe)
+        # acute triangle: circumcircle
+        c = eu.Circle.new_bounding(array.array('d', [0, 0, 2, 0, 1, 1.5]),
+                                   exact=True)
+        self.assertTrue(abs(c.r - 1.0833333) < fe)
+
+    def test_sphere(self):
+        pts = [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+        s = eu.Sphere.new_bounding(pts + [(0.5, 0.5, 0.5)], exact=True)
+        self.assertTrue(abs(s.c - eu.Point3(0.5, 0.5, 0.5)) < fe)
+        self.assertTrue(abs(s.r - math.sqrt(0.75)) < fe)
+        self.check(eu.Sphere.new_bounding(pts), pts, tuple)
+
+    def test_degenerate(self):
+        s = eu.Sphere.new_bounding([(1, 2, 3)] * 4, exact=True)
+        self.assertEqual((s.c, s.r), (eu.Point3(1, 2, 3), 0.))
+        pts = [(i, 2 * i, 0) for i in range(5)]
+        s = eu.Sphere.new_bounding(pts, exact=True)
+        self.assertTrue(abs(s.c - eu.Point3(2, 4, 0)) < fe)
+        self.assertTrue(abs(s.r - math.sqrt(20)) < fe)
+        pts = [(math.cos(a), math.sin(a), 0) for a in range(10)]
+        s = eu.Sphere.new_bounding(pts, exact=True)
+        self.assertTrue(abs(s.r - 1) < fe)
+
+    def test_random(self):
+        rnd = random.Random(1)
+        for i in range(20):
+            pts = [(rnd.random(), rnd.random(), rnd.random())
+                   for j in range(30)]
+            s = eu.Sphere.new_bounding(pts, exact=True)
+            self.check(s, pts, tuple)
+            self.assertTrue(s.r <= eu.Sphere.new_bounding(pts).r + fe)
+
+class Test_TimeOfImpact(unittest.TestCase):
+    def test_sphere_sphere(self):
+        a = eu.Sphere(eu.Point3(0, 0, 0), 1.)
+        b = eu.Sphere(eu.Point3(10, 0, 0), 1.)
+        t, p = a.time_of_impact(eu.Vector3(20, 0, 0), b)
+        self.assertTrue(abs(t - 0.4) < fe)
+        self.assertTrue(abs(p - eu.Point3(9, 0, 0)) < fe)
+        t, p = a.time_of_impact(eu.Vector3(20, 0, 0), b,
+                                eu.Vector3(-20, 0, 0))
+        self.assertTrue(abs(t - 0.2) < fe)
+        self.assertTrue(abs(p - eu.Point3(5, 0, 0)) < fe)
+        self.assertEqual(a.time_of_impact(eu.Vector3(0, 20, 0), b), None)
+        # too slow to reach
+        self.assertEqual(a.time_of_impact(eu.Vector3(7, 0, 0), b), None)
+        # overlapping at the start
+        c = eu.Sphere(eu.Point3(1.5, 0, 0), 1.)
+        self.assertEqual(a.time_of_impact(eu.Vector3(), c)[0], 0)
+
+    def test_sphere_plane(self):
+        s = eu.Sphere(eu.Point3(0, 0, 0), 1.)
+        p = eu.Plane(eu.Vector3(0, 0, 1), -5.)
+        t, q = s.time_of_impact(eu.Vector3(0, 0, -10), p)
+        self.assertTrue(abs(t - 0.4) < fe)
+        self.assertTrue(abs(q - eu.Point3(0, 0, -5)) < fe)
+        self.assertEqual(s.time_of_impact(eu.Vector3(0, 0, 10), p), None)
+        t, q = s.time_of_impact(eu.Vector3(), p, eu.Vector3(0, 0, 8))
+        self.assertTrue(abs(t - 0.5) < fe)
+        self.assertTrue(abs(q - eu.Point3(0, 0, -1)) < fe)
+
+    def test_circle_segment(self):
+        c = eu.Circle(eu.Point2(0, 0), 1.)
+        seg = eu.LineSegment2(eu.Point2(5, -1), eu.Point2(5, 1))
+        t, p = c.time_of_impact(eu.Vector2(10, 0), seg)
+        self.assertTrue(abs(t - 0.4) < fe)
+        self.assertTrue(abs(p - eu.Point2(5, 0)) < fe)
+        # glancing the end cap
+        t, p = c.time_of_impact(eu.Vector2(10, 3), seg)
+        self.assertTrue(abs(p - eu.Point2(5, 1)) < fe)
+        self.assertTrue(abs(abs(c.c + eu.Vector2(10, 3) * t - p) - 1) < fe)
+        self.assertEqual(c.time_of_impact(eu.Vector2(10, 5), seg), None)
+
+    def test_circle_circle(self):
+        a = eu.Circle(eu.Point2(0, 0), 1.)
+        b = eu.Circle(eu.Point2(5, 0), 1.)
+        t, p = a.time_of_impact(eu.Vector2(10, 0), b, eu.Vector2(-10, 0))
+        self.assertTrue(abs(t - 0.15) < fe)
+        self.assertTrue(abs(p - eu.Point2(2.5, 0)) < fe)
+        self.assertRaises(AttributeError, a.time_of_impact,
+                          eu.Vector2(1, 0), eu.Point2(2, 0))
+
+    def test_many(self):
+        plane = eu.Plane(eu.Vector3(0, 0, 1), -5.)
+        spheres = [eu.Sphere(eu.Point3(i, 0, 0), 1.) for i in range(3)]
+        velocities = array.array('d', [0, 0, -10, 0, 0, -1, 0, 0, -5])
+        hits = eu.time_of_impact_many(spheres, velocities, plane)
+        self.assertEqual(hits, [s.time_of_impact(eu.Vector3(*velocities[
+            3 * i:3 * i + 3]), plane) for i, s in enumerate(spheres)])
+        self.assertEqual([h and h[0] for h in hits], [0.4, None, 0.8])
+
+class Test_GJK(unittest.TestCase):
+    def test_support(self):
+        d = eu.Vector3(1, 2, -1)
+        self.assertEqual(eu.Point3(1, 2, 3).support(d), eu.Point3(1, 2, 3))
+        s = eu.LineSegment3(eu.Point3(0, 0, 0), eu.Point3(1, 0, 0))
+        self.assertEqual(s.support(d), eu.Point3(1, 0, 0))
+        self.assertEqual(s.support(-d), eu.Point3(0, 0, 0))
+        b = eu.AABB3(eu.Point3(0, 0, 0), eu.Point3(1, 1, 1))
+        self.assertEqual(b.support(d), eu.Point3(1, 1, 0))
+        sp = eu.Sphere(eu.Point3(1, 1, 1), 2.)
+        self.assertTrue(abs(sp.support(eu.Vector3(0, 0, 3)) -
+                            eu.Point3(1, 1, 3)) < fe)
+
+    def test_spheres(self):
+        a = eu.Sphere(eu.Point3(0, 0, 0), 1.)
+        b = eu.Sphere(eu.Point3(3, 0.5, 0), 1.)
+        c = eu.gjk_connect(a, b)
+        self.assertTrue(linesegment3_qeq(c, a.connect(b), fe))
+        self.assertTrue(abs(eu.gjk_distance(a, b) - abs(a.connect(b))) < fe)
+        b = eu.Sphere(eu.Point3(1.5, 0, 0), 1.)
+        self.assertEqual(eu.gjk_connect(a, b), None)
+        self.assertEqual(eu.gjk_distance(a, b), 0)
+        depth, n = eu.epa_penetration(a, b)
+        self.assertTrue(abs(depth - 0.5) < fe)
+        self.assertTrue(abs(n - eu.Vector3(1, 0, 0)) < fe)
+
+    def test_segments(self):
+        rnd = random.Random(4)
+        for i in range(10):
+            s1, s2 = [eu.LineSegment3(
+                eu.Point3(*[rnd.uniform(-3, 3) for j in range(3)]),
+                eu.Point3(*[rnd.uniform(-3, 3) for j in range(3)]))
+                for k in range(2)]
+            c = eu.gjk_connect(s1, s2)
+            # both ends lie on the segments, and nothing is closer
+            for s, p in ((s1, c.p1), (s2, c.p2)):
+                self.assertTrue(abs(eu._connect_point3_line3(p, s)) < fe)
+            steps = [k / 40. for k in range(41)]
+            best = min([abs(s1.p + s1.v * u - s2.p - s2.v * w)
+                        for u in steps for w in steps])
+            self.assertTrue(c.length <= best + fe)
+
+    def test_penetration(self):
+        a = eu.AABB3(eu.Point3(0, 0, 0), eu.Point3(1, 1, 1))
+        b = eu.AABB3(eu.Point3(0.8, 0.2, 0.1), eu.Point3(2, 2, 2))
+        depth, n = eu.epa_penetration(a, b)
+        self.assertTrue(abs(depth - 0.2) < fe)
+        self.assertTrue(abs(n - eu.Vector3(1, 0, 0)) < fe)
+        p = eu.Point3(0.2, 0.5, 0.5)
+        depth, n = eu.epa_penetration(p, a)
+        self.assertTrue(abs(depth - 0.2) < fe)
+        self.assertTrue(abs(n - eu.Vector3(1, 0, 0)) < fe)
+        s = eu.LineSegment3(eu.Point3(-1, 0, 0.5), eu.Point3(1, 0, 0.5))
+        depth, n = eu.epa_penetration(s, eu.Sphere(eu.Point3(0, 0, 0), 1.))
+        self.assertTrue(abs(depth - 0.5) < fe)
+        self.assertTrue(abs(n - eu.Vector3(0, 0, -1)) < fe)
+        self.assertEqual(eu.epa_penetration(eu.Point3(2, 2, 2), a), None)
+
+    def test_mesh(self):
+        verts = [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)]
+        mesh = eu.TriangleMesh3(verts, [(0, 1, 2)])
+        c = eu.gjk_connect(mesh, eu.Sphere(eu.Point3(3, 0.5, 0.5), 1.))
+        self.assertTrue(abs(c.length - 1) < fe)
+
+    def test_cache(self):
+        cache = eu.GJKCache()
+        a = eu.AABB3(eu.Point3(0, 0, 0), eu.Point3(1, 1, 1))
+        for i in range(4):
+            b = eu.AABB3(eu.Point3(2 + 0.01 * i, 0.3, 0.2),
+                         eu.Point3(3, 2, 2))
+            d = eu.gjk_distance(a, b, cache)
+            self.assertTrue(abs(d - (1 + 0.01 * i)) < fe)
+        self.assertEqual(cache.iterations, 1)
+
+class Test_Registry(unittest.TestCase):
+    def setUp(self):
+        self.shapes = [
+            eu.Point2(0.5, 0.2), eu.Line2(eu.Point2(0, 0), eu.Vector2(1, 1)),
+            eu.Ray2(eu.Point2(-1, 0.3), eu.Vector2(1, 0)),
+            eu.LineSegment2(eu.Point2(-1, -1), eu.Point2(0.2, 0.3)),
+            eu.Circle(eu.Point2(0, 0), 1.),
+            eu.Polygon2([eu.Point2(0, 0), eu.Point2(2, 0), eu.Point2(2, 2)]),
+            eu.AABB2(eu.Point2(0, 0), eu.Point2(1, 1)),
+            eu.Point3(5, 5, 5),
+            eu.Line3(eu.Point3(0, 0, 0), eu.Vector3(1, 1, 0)),
+            eu.LineSegment3(eu.Point3(3, 3, 3), eu.Point3(4, 4, 5)),
+            eu.Sphere(eu.Point3(0, 0, 0), 1.),
+            eu.Plane(eu.Vector3(0, 0, 1), 2.),
+            eu.AABB3(eu.Point3(0, 0, 0), eu.Point3(1, 1, 1))]
+
+    def same(self, f, g):
+        try:
+            r = repr(f())
+        except AttributeError:
+            r = AttributeError
+        try:
+            s = repr(g())
+        except AttributeError:
+            s = AttributeError
+        self.assertEqual(r, s)
+
+    def test_builtin(self):
+        for a in self.shapes:
+            for b in self.shapes:
+                self.same(lambda: a.intersect(b), lambda: eu.intersect(a, b))
+                self.same(lambda: a.connect(b), lambda: eu.connect(a, b))
+
+    def test_point2_point2(self):
+        a = eu.Point2(1, 2)
+        b = eu.Point2(4, 6)
+        self.assertEqual(repr(eu.connect(a, b)), repr(a.connect(b)))
+        self.assertEqual(eu.connect(a, b).length, 5)
+        import bench_euclid
+        names = [name for name, f in bench_euclid.benchmarks()]
+        self.assertTrue('connect Point2 Point2' in names)
+
+    def test_plane_connect(self):
+        p = eu.Plane(eu.Vector3(0, 0, 1), 2.)
+        s = eu.Sphere(eu.Point3(0, 0, 0), 1.)
+        self.assertEqual(p.connect(s).p1.z, 2)
+        self.assertEqual(p.connect(s).p2.z, 1)
+        self.assertEqual(s.connect(p).p1.z, 1)
+        L = eu.LineSegment3(eu.Point3(0, 0, 0), eu.Point3(1, 0, 0))
+        self.assertEqual(p.connect(L).p1.z, 2)
+        self.assertEqual(p.connect(L).p2.z, 0)
+        self.assertEqual(L.connect(p).p1.z, 0)
+
+    def test_subclass(self):
+        class Segment(eu.LineSegment2):
+            pass
+        s = Segment(eu.Point2(-2, 0), eu.Point2(2, 0))
+        c = eu.Circle(eu.Point2(0, 0), 1.)
+        self.assertEqual(repr(eu.intersect(s, c)), repr(s.intersect(c)))
+
+    def test_user_type(self):
+        class Dot(eu.Geometry):
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+        def intersect_dot_circle(d, c):
+            return (d.x - c.c.x) ** 2 + (d.y - c.c.y) ** 2 <= c.r ** 2
+
+        def connect_dot_circle(d, c):
+            return eu.Point2(d.x, d.y).connect(c)
+
+        eu.register_intersect(Dot, eu.Circle, intersect_dot_circle)
+        eu.register_connect(Dot, eu.Circle, connect_dot_circle)
+        c = eu.Circle(eu.Point2(0, 0), 1.)
+        self.assertTrue(eu.intersect(Dot(0.5, 0.5), c))
+        self.assertFalse(eu.intersect(c, Dot(2, 2)))
+        # the built in shapes find the registration too
+        self.assertFalse(c.intersect(Dot(2, 2)))
+        s = eu.connect(c, Dot(2, 0))
+        self.assertTrue(linesegment2_qeq(s, eu.LineSegment2(
+            eu.Point2(1, 0), eu.Point2(2, 0)), fe))
+        self.assertEqual(s.p1, eu.Point2(1, 0))
+        self.assertEqual(c.connect(Dot(2, 0)).p1, eu.Point2(1, 0))
+        self.assertRaises(AttributeError, eu.intersect,
+                          eu.Point2(0, 0), Dot(0, 0))
+
+class Test_Stream(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(5)
+        self.buffers = [array.array('d', [rnd.uniform(-2, 2)
+                                          for i in range(3 * n)])
+                        for n in (5, 1, 10, 0, 7)]
+        self.points = [eu.Point3(*b[i:i + 3]) for b in self.buffers
+                       for i in range(0, len(b), 3)]
+
+    def flatten(self, chunks):
+        return [eu.Point3(*c[i:i + 3]) for c in chunks
+                for i in range(0, len(c), 3)]
+
+    def test_chunks(self):
+        chunks = list(eu.stream_chunks(self.buffers, 4))
+        self.assertEqual([len(c) for c in chunks], [12] * 5 + [9])
+        self.assertEqual(self.flatten(chunks), self.points)
+        chunks = list(eu.stream_chunks([[1, 2, 3, 4, 5, 6]], 4))
+        self.assertEqual(chunks, [array.array('d', [1, 2, 3, 4, 5, 6])])
+
+    def test_transform(self):
+        m = eu.Matrix4.new_translate(1, 2, 3) * eu.Matrix4.new_rotatez(0.3)
+        out = self.flatten(eu.stream_transform(
+            eu.stream_chunks(self.buffers, 4), m))
+        for p, q in zip(self.points, out):
+            self.assertTrue(abs(m * p - q) < fe)
+        m = eu.Matrix4.new_perspective(1., 1., 0.1, 100.)
+        out = self.flatten(eu.stream_project(
+            eu.stream_chunks(self.buffers, 4), m))
+        for p, q in zip(self.points, out):
+            self.assertTrue(abs(m.transform(p) - q) < fe)
+
+    def test_filters(self):
+        plane = eu.Plane(eu.Vector3(1, 0, 0), 0.5)
+        sphere = eu.Sphere(eu.Point3(0, 0, 0), 2.)
+        out = self.flatten(eu.stream_clip_sphere(eu.stream_filter_plane(
+            eu.stream_chunks(self.buffers, 4), plane), sphere))
+        self.assertEqual(out, [p for p in self.points
+                               if p.x >= 0.5 and sphere.intersect(p)])
+        out = self.flatten(eu.stream_filter_plane(
+            eu.stream_chunks(self.buffers, 4), plane, front=False))
+        self.assertEqual(out, [p for p in self.points if p.x < 0.5])
+        out = self.flatten(eu.stream_clip_sphere(
+            eu.stream_chunks(self.buffers, 4), sphere, inside=False))
+        self.assertEqual(out, [p for p in self.points
+                               if not sphere.intersect(p)])
+
+    def test_lazy(self):
+        def source():
+            while True:
+                yield [1., 2., 3.] * 100
+        stream = eu.stream_transform(eu.stream_chunks(source(), 50),
+                                     eu.Matrix4.new_translate(1, 1, 1))
+        chunk = next(stream)
+        self.assertEqual(len(chunk), 150)
+        self.assertEqual(list(chunk[:3]), [2., 3., 4.])
+
+class Test_Parallel(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(6)
+        def point():
+            return eu.Point3(*[rnd.uniform(-5, 5) for i in range(3)])
+        self.lines = [cls(point(), point()) for cls in
+                      (eu.Line3, eu.Ray3, eu.LineSegment3) for i in range(40)]
+        self.planes = [eu.Plane(point(), point() - eu.Point3())
+                       for i in range(8)]
+        self.spheres = [eu.Sphere(point(), rnd.uniform(0.5, 2))
+                        for i in range(8)]
+
+    def test_planes(self):
+        u, index = eu.ParallelExecutor(1).intersect_lines_planes(
+            self.lines, self.planes)
+        for L, ui, i in zip(self.lines, u, index):
+            hits = [P for P in self.planes if L.intersect(P) is not None]
+            self.assertEqual(i < 0, not hits)
+            if i >= 0:
+                hit = L.intersect(self.planes[i])
+                self.assertTrue(abs(L.p + L.v * ui - hit) < fe)
+
+    def test_spheres(self):
+        u, index = eu.ParallelExecutor(1).intersect_lines_spheres(
+            self.lines, self.spheres)
+        self.assertTrue(max(index) >= 0)
+        for L, ui, i in zip(self.lines, u, index):
+            if i >= 0:
+                S = self.spheres[i]
+                self.assertTrue(abs(abs(L.p + L.v * ui - S.c) - S.r) < fe)
+            else:
+                self.assertTrue(math.isnan(ui))
+
+    def test_workers(self):
+        serial = eu.ParallelExecutor(1)
+        with eu.ParallelExecutor(2, tasks_per_worker=3) as executor:
+            for method in ('intersect_lines_planes',
+                           'intersect_lines_spheres'):
+                targets = method.endswith('planes') and self.planes or \
+                          self.spheres
+                u1, i1 = getattr(serial, method)(self.lines, targets)
+                u2, i2 = getattr(executor, method)(
+                    eu.pack_lines3(self.lines), targets)
+                self.assertEqual(i1, i2)
+                self.assertEqual([repr(x) for x in u1],
+                                 [repr(x) for x in u2])
+        u, index = serial.intersect_lines_planes(self.lines, [])
+        self.assertEqual(list(index), [-1] * len(self.lines))
+
+class Test_Threaded(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(7)
+        def point():
+            return eu.Point3(*[rnd.uniform(-5, 5) for i in range(3)])
+        self.points = [point() for i in range(100)]
+        self.lines = [eu.Ray3(point(), point()) for i in range(50)]
+        self.spheres = [eu.Sphere(point(), rnd.uniform(0.5, 2))
+                        for i in range(8)]
+        self.matrix = eu.Matrix4.new_rotate_axis(0.7, eu.Vector3(1, 2, 3))
+        self.matrix.translate(1, -2, 3)
+
+    def test_transform(self):
+        out = eu.ThreadedExecutor(1, use_numpy=False).transform_points(
+            self.points, self.matrix)
+        self.assertEqual(len(out), 3 * len(self.points))
+        for i, p in enumerate(self.points):
+            self.assertTrue(abs(eu.Point3(*out[3 * i:3 * i + 3]) -
+                                self.matrix * p) < fe)
+
+    def test_distance(self):
+        d, index = eu.ThreadedExecutor(1, use_numpy=False).\
+            distance_points_spheres(self.points, self.spheres)
+        for p, di, i in zip(self.points, d, index):
+            best = min([abs(p - S.c) - S.r for S in self.spheres])
+            self.assertTrue(abs(di - best) < fe)
+            S = self.spheres[i]
+            self.assertTrue(abs(abs(p - S.c) - S.r - best) < fe)
+        d, index = eu.ThreadedExecutor(1).distance_points_spheres(
+            self.points, [])
+        self.assertTrue(all([math.isnan(x) for x in d]))
+
+    def test_workers(self):
+        serial = eu.ParallelExecutor(1)
+        packed = eu.pack_points3(self.points)
+        self.assertEqual(list(packed),
+                         [c for p in self.points for c in p])
+        with eu.ThreadedExecutor(3, tasks_per_worker=2) as executor:
+            self.assertEqual(
+                repr(serial.intersect_lines_spheres(self.lines,
+                                                    self.spheres)),
+                repr(executor.intersect_lines_spheres(self.lines,
+                                                      self.spheres)))
+            self.assertEqual(
+                serial.distance_points_spheres(self.points, self.spheres)[1],
+                executor.distance_points_spheres(packed, self.spheres)[1])
+            out1 = serial.transform_points(packed, self.matrix)
+            out2 = executor.transform_points(self.points, self.matrix)
+            self.assertTrue(max([abs(a - b) for a, b in zip(out1, out2)]) <
+                            fe)
+        with eu.ParallelExecutor(2) as executor:
+            self.assertEqual(
+                list(serial.transform_points(packed, self.matrix)),
+                list(executor.transform_points(packed, self.matrix)))
+
+class Test_Bench(unittest.TestCase):
+    def test_coverage(self):
+        import bench_euclid
+        names = set([name for name, function in bench_euclid.benchmarks()])
+        shapes = bench_euclid.sample_shapes()
+        # every built in type with a registered function has a sample
+        for functions in (eu._intersect_functions, eu._connect_functions):
+            for pair in functions:
+                for cls in pair:
+                    if cls.__module__ == eu.__name__:
+                        self.assertTrue(cls.__name__ in shapes, cls)
+                        self.assertTrue(cls.__name__ in
+                                        bench_euclid.SHAPES_2D +
+                                        bench_euclid.SHAPES_3D, cls)
+        for operation, functions in (('intersect', eu._intersect_functions),
+                                     ('connect', eu._connect_functions)):
+            for group in (bench_euclid.SHAPES_2D, bench_euclid.SHAPES_3D):
+                for a in group:
+                    for b in group:
+                        if eu._registered(functions, shapes[a], shapes[b]):
+                            self.assertTrue('%s %s %s' % (operation, a, b)
+                                            in names)
+        for name, function in bench_euclid.benchmarks():
+            function()
+
+    def test_run_compare(self):
+        import bench_euclid
+        baseline = bench_euclid.run('Vector3.cross', min_time=0.001)
+        result = baseline['results']['Vector3.cross']
+        self.assertTrue(result['ops_per_sec'] > 0)
+        self.assertTrue(result['blocks_per_op'] >= 1)
+        current = {'results': {'Vector3.cross': dict(
+            result, ops_per_sec=0.5 * result['ops_per_sec'])}}
+        self.assertEqual(bench_euclid.compare(baseline, current)[0][3],
+                         'slower')
+        current['results']['Vector3.cross'] = dict(
+            result, blocks_per_op=result['blocks_per_op'] + 1)
+        self.assertEqual(bench_euclid.compare(baseline, current)[0][3],
+                         'allocates')
+        self.assertEqual(bench_euclid.compare(baseline, baseline)[0][3], 'ok')
+
+class Test_Instrument(unittest.TestCase):
+    def tearDown(self):
+        eu.instrument_disable()
+        eu.instrument_reset()
+
+    def test_counts(self):
+        init = eu.Vector3.__dict__['__init__']
+        L = eu.Line3(eu.Point3(0, 0, 0), eu.Vector3(1, 0, 0))
+        eu.instrument_enable()
+        v = eu.Vector3(1, 2, 3)
+        for i in range(10):
+            v + v
+        L.connect(eu.Point3(1, 2, 3))
+        eu.ThreadedExecutor(1, use_numpy=False)
+        eu.instrument_disable()
+        v + v
+        self.assertTrue(eu.Vector3.__dict__['__init__'] is init)
+        counts = eu.instrument_counts()
+        self.assertEqual(counts[('Vector3', 'Vector3()')], 1)
+        self.assertEqual(counts[('Vector3', 'Vector3.__add__')], 10)
+        self.assertEqual(counts[('LineSegment3', 'Line3.connect')], 1)
+        # Base class constructors are not counted again
+        self.assertEqual(counts[('ThreadedExecutor', 'ThreadedExecutor()')],
+                         1)
+        self.assertFalse(('_BatchExecutor', 'ThreadedExecutor()') in counts)
+        report = eu.instrument_report(limit=2).splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertTrue(report[1].startswith('Vector3.__add__'))
+        eu.instrument_reset()
+        self.assertEqual(eu.instrument_counts(), {})
+
+    def test_memory(self):
+        eu.instrument_enable(trace_memory=True)
+        v = eu.Vector3(1, 2, 3)
+        kept = [v * 2 for i in range(10)]
+        eu.instrument_disable()
+        lines = eu.instrument_report().splitlines()
+        self.assertTrue('bytes held' in lines[0])
+        row = [line for line in lines if line.startswith('Vector3.__mul__')]
+        self.assertTrue(row[0].endswith(')'))
+        self.assertEqual(len(kept), 10)
+
+class Test_Profile(unittest.TestCase):
+    def setUp(self):
+        self.ray = eu.Ray3(eu.Point3(0, 0, 0), eu.Vector3(1, 0, 0))
+        self.hit = eu.Sphere(eu.Point3(3, 0, 0), 1.)
+        self.miss = eu.Sphere(eu.Point3(0, 3, 0), 1.)
+
+    def tearDown(self):
+        eu.profile_disable()
+        eu.profile_reset()
+
+    def test_stats(self):
+        method = eu.Line3.__dict__['intersect']
+        eu.profile_enable()
+        for i in range(3):
+            self.ray.intersect(self.hit)
+            self.ray.intersect(self.miss)
+            self.miss.intersect(self.ray)
+        eu.intersect(self.ray, self.hit)
+        eu.connect(eu.Point2(0, 0), eu.Circle(eu.Point2(3, 0), 1.))
+        eu.profile_disable()
+        self.ray.intersect(self.hit)
+        self.assertTrue(eu.Line3.__dict__['intersect'] is method)
+        stats = eu.profile_stats()
+        self.assertEqual(sorted(stats), [
+            ('connect', 'Point2', 'Circle'),
+            ('intersect', 'Ray3', 'Sphere'),
+            ('intersect', 'Sphere', 'Ray3')])
+        pair = stats[('intersect', 'Ray3', 'Sphere')]
+        self.assertEqual((pair['calls'], pair['hits'], pair['misses']),
+                         (7, 4, 3))
+        self.assertTrue(abs(pair['hit_ratio'] - 4 / 7.) < fe)
+        self.assertTrue(pair['time'] > 0)
+        self.assertEqual(stats[('intersect', 'Sphere', 'Ray3')]['hits'], 0)
+        report = eu.profile_report(limit=1).splitlines()
+        self.assertEqual(len(report), 2)
+        eu.profile_reset()
+        self.assertEqual(eu.profile_stats(), {})
+
+    def test_results(self):
+        eu.profile_enable()
+        pairs = [(self.ray, self.hit), (self.hit, self.ray),
+                 (self.ray, self.miss)]
+        profiled = [eu.intersect(a, b) for a, b in pairs] + \
+                   [a.intersect(b) for a, b in pairs]
+        eu.profile_disable()
+        plain = [eu.intersect(a, b) for a, b in pairs] * 2
+        self.assertEqual([repr(x) for x in profiled],
+                         [repr(x) for x in plain])
+
+class Test_Backends(unittest.TestCase):
+    # Results of the python and array backends equal those of the objects;
+    # those of the numpy backend agree within a relative 1e-12.
+    tolerance = {'python': 0., 'array': 0., 'numpy': 1e-12}
+
+    def setUp(self):
+        self.saved = eu._backend[0]
+        rnd = random.Random(9)
+        def vector():
+            return eu.Vector3(*[rnd.uniform(-10, 10) for i in range(3)])
+        def matrix():
+            M = eu.Matrix4.new_rotate_axis(rnd.uniform(0, 6), vector())
+            M.translate(*vector())
+            M.scale(*[rnd.uniform(0.5, 2) for i in range(3)])
+            M.m, M.n, M.o = [rnd.uniform(-0.1, 0.1) for i in range(3)]
+            return M
+        def quaternion():
+            return eu.Quaternion.new_rotate_axis(rnd.uniform(0, 6), vector())
+        self.points = [eu.Point3(*vector()) for i in range(50)]
+        self.vectors = [vector() for i in range(50)]
+        self.matrices = [matrix() for i in range(20)]
+        self.quaternions = [quaternion() for i in range(20)]
+
+    def tearDown(self):
+        eu._backend[0] = self.saved
+
+    def check(self, name, result, expected):
+        result = list(result)
+        self.assertEqual(len(result), len(expected))
+        for x, y in zip(result, expected):
+            self.assertTrue(
+                abs(x - y) <= self.tolerance[name] * max(1, abs(y)),
+                (name, x, y))
+
+    def test_conformance(self):
+        M = self.matrices[0]
+        q = self.quaternions[0]
+        for name in ('python', 'array', 'numpy'):
+            if name not in eu.backend_names():
+                continue
+            eu.set_backend(name)
+            self.check(name, eu.transform_points3(self.points, M),
+                       [c for p in self.points for c in M * p])
+            self.check(name, eu.transform_vectors3(self.vectors, M),
+                       [c for v in self.vectors for c in M * v])
+            self.check(name, eu.project_points3(
+                           eu.pack_points3(self.points), M),
+                       [c for p in self.points for c in M.transform(p)])
+            self.check(name, eu.rotate_vectors3(self.vectors, q),
+                       [c for v in self.vectors for c in q * v])
+            products = [A * B for A, B in zip(self.matrices,
+                                              self.matrices[::-1])]
+            self.check(name, eu.multiply_matrices4(self.matrices,
+                                                   self.matrices[::-1]),
+                       list(eu.pack_matrices4(products)))
+            products = [a * b for a, b in zip(self.quaternions,
+                                              self.quaternions[::-1])]
+            self.check(name, eu.multiply_quaternions(self.quaternions,
+                                                     self.quaternions[::-1]),
+                       list(eu.pack_quaternions(products)))
+
+    def test_select(self):
+        self.assertEqual(eu.set_backend('python').name, 'python')
+        self.assertTrue(isinstance(eu.transform_points3([1., 2., 3.],
+                                                        eu.Matrix4()), list))
+        self.assertTrue(isinstance(eu.set_backend('auto'),
+                                   (eu._ArrayBackend, eu._NumpyBackend)))
+        self.assertRaises(ValueError, eu.set_backend, 'fortran')
+        environ = os.environ.get('EUCLID_BACKEND')
+        try:
+            os.environ['EUCLID_BACKEND'] = 'python'
+            eu._backend[0] = None
+            self.assertEqual(eu.get_backend().name, 'python')
+        finally:
+            if environ is None:
+                del os.environ['EUCLID_BACKEND']
+            else:
+                os.environ['EUCLID_BACKEND'] = environ
+
+class Test_Float32Array(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(10)
+        def vector():
+            return eu.Vector3(*[rnd.uniform(-10, 10) for i in range(3)])
+        self.vectors = [vector() for i in range(20)]
+        self.matrices = []
+        self.quaternions = []
+        for i in range(20):
+            M = eu.Matrix4.new_rotate_axis(rnd.uniform(0, 6), vector())
+            M.translate(*vector())
+            self.matrices.append(M)
+            self.quaternions.append(eu.Quaternion.new_rotate_axis(
+                rnd.uniform(0, 6), vector()))
+
+    def assertClose(self, a, b):
+        # Single precision keeps about 7 significant digits
+        for x, y in zip(a, b):
+            self.assertTrue(abs(x - y) <= 1e-5 * max(1, abs(y)), (x, y))
+
+    def test_vectors(self):
+        vectors = eu.Vector3Array(self.vectors)
+        self.assertEqual(len(vectors), 20)
+        self.assertEqual(vectors.data.typecode, 'f')
+        self.assertEqual(len(vectors.tobytes()), 20 * 3 * 4)
+        self.assertTrue(isinstance(vectors[3], eu.Vector3))
+        self.assertTrue(isinstance(vectors[3].x, float))
+        self.assertClose(vectors[-1], self.vectors[-1])
+        self.assertEqual(len(vectors[2:8:2]), 3)
+        self.assertEqual(list(vectors[2:8:2]), list(vectors)[2:8:2])
+        vectors[0] = eu.Vector3(0.5, 0.25, 2.)
+        self.assertEqual(vectors[0], eu.Vector3(0.5, 0.25, 2.))
+        self.assertRaises(IndexError, lambda: vectors[20])
+        copy = vectors.copy()
+        copy.append(eu.Point3(1, 2, 3))
+        copy.extend([1., 2., 3.])
+        self.assertEqual(len(copy), 22)
+        self.assertNotEqual(copy, vectors)
+        self.assertEqual(copy[:20], vectors)
+
+        M = self.matrices[0]
+        q = self.quaternions[0]
+        for result, expected in (
+                (vectors.transform_points(M),
+                 [M * eu.Point3(*v) for v in vectors]),
+                (vectors.transform_vectors(M), [M * v for v in vectors]),
+                (vectors.rotate(q), [q * v for v in vectors])):
+            self.assertTrue(isinstance(result, eu.Vector3Array))
+            self.assertClose([c for v in result for c in v],
+                             [c for v in expected for c in v])
+
+    def test_matrices(self):
+        matrices = eu.Matrix4Array(self.matrices)
+        self.assertEqual(matrices.data[:16],
+                         array.array('f', self.matrices[0][:]))
+        self.assertTrue(isinstance(matrices[1], eu.Matrix4))
+        self.assertClose(matrices[1][:], self.matrices[1][:])
+        products = matrices * eu.Matrix4Array(self.matrices[::-1])
+        for P, A, B in zip(products, self.matrices, self.matrices[::-1]):
+            self.assertClose(P[:], (A * B)[:])
+
+    def test_quaternions(self):
+        quaternions = eu.QuaternionArray(self.quaternions)
+        self.assertEqual(len(quaternions.tobytes()), 20 * 4 * 4)
+        products = quaternions * eu.QuaternionArray(self.quaternions[::-1])
+        for p, a, b in zip(products, self.quaternions,
+                           self.quaternions[::-1]):
+            q = a * b
+            self.assertClose((p.w, p.x, p.y, p.z), (q.w, q.x, q.y, q.z))
+
+class Test_Camera(unittest.TestCase):
+    def setUp(self):
+        self.camera = eu.Camera(eu.Point3(1., 2., 10.), eu.Point3(0., 0., 0.),
+                                aspect=4 / 3., near=0.01, far=100.)
+
+    def assertIdentity(self, m):
+        for a, b in zip(m[:], eu.Matrix4()[:]):
+            self.assertAlmostEqual(a, b, 9)
+
+    def test_matrices(self):
+        c = self.camera
+        self.assertIdentity(c.view * c.inverse_view)
+        self.assertIdentity(c.projection * c.inverse_projection)
+        self.assertIdentity(c.view_projection * c.inverse_view_projection)
+        eye = c.view * c.eye
+        self.assertAlmostEqual(abs(eye), 0.)
+
+    def test_cache(self):
+        c = self.camera
+        view, projection = c.view, c.projection
+        vp = c.view_projection
+        self.assertTrue(c.view is view and c.view_projection is vp)
+        c.near = 0.1
+        self.assertTrue(c.view is view)
+        self.assertFalse(c.projection is projection)
+        self.assertFalse(c.view_projection is vp)
+        projection = c.projection
+        c.eye = eu.Point3(0., 0., 5.)
+        self.assertTrue(c.projection is projection)
+        self.assertFalse(c.view is view)
+        self.assertEqual(c.eye, eu.Point3(0., 0., 5.))
+        eye = c.eye
+        eye.x = 3.
+        self.assertEqual(c.eye, eu.Point3(0., 0., 5.))
+
+    def test_screen(self):
+        c = self.camera
+        points = [eu.Point3(0., 0., 0.), eu.Point3(1., 1., 1.),
+                  eu.Point3(-2., 0.5, 3.)]
+        screen = c.world_to_screen(points, 800, 600)
+        self.assertEqual(len(screen), 9)
+        self.assertAlmostEqual(screen[0], 400.)
+        self.assertAlmostEqual(screen[1], 300.)
+        ndc = c.view_projection.transform(points[2])
+        self.assertAlmostEqual(screen[6], (ndc.x + 1) * 400.)
+        self.assertAlmostEqual(screen[7], (1 - ndc.y) * 300.)
+        self.assertAlmostEqual(screen[8], ndc.z)
+        world = c.screen_to_world(screen, 800, 600)
+        for i, p in enumerate(points):
+            for a, b in zip(world[3 * i:3 * i + 3], p):
+                self.assertAlmostEqual(a, b, 6)
+
+    def test_pick_rays(self):
+        c = self.camera
+        points = [eu.Point3(0., 0., 0.), eu.Point3(-2., 0.5, 3.)]
+        screen = c.world_to_screen(points, 800, 600)
+        rays = c.pick_rays([screen[0], screen[1], screen[3], screen[4]],
+                           800, 600)
+        self.assertEqual(len(rays), 2)
+        for ray, p in zip(rays, points):
+            self.assertTrue(isinstance(ray, eu.Ray3))
+            self.assertAlmostEqual(abs(ray.p - c.eye), 0.01, 2)
+            self.assertAlmostEqual(ray.connect(p).length, 0., 6)
+
+class Test_Unproject(unittest.TestCase):
+    def setUp(self):
+        self.camera = eu.Camera(eu.Point3(1., 2., 10.), eu.Point3(0., 0., 0.),
+                                aspect=4 / 3., near=0.1, far=100.)
+        rnd = random.Random(4)
+        self.pixels = [eu.Point2(rnd.uniform(0, 800), rnd.uniform(0, 600))
+                       for i in range(50)]
+
+    def test_unproject_rays(self):
+        vp = self.camera.view_projection
+        inverse = vp.inverse()
+        origins, directions = eu.unproject_rays(self.pixels, vp, 800, 600)
+        self.assertEqual(len(origins), 150)
+        self.assertEqual(len(directions), 150)
+        for i, p in enumerate(self.pixels):
+            x = 2 * p.x / 800 - 1
+            y = 1 - 2 * p.y / 600
+            near = inverse.transform(eu.Point3(x, y, -1.))
+            far = inverse.transform(eu.Point3(x, y, 1.))
+            self.assertEqual(tuple(origins[3 * i:3 * i + 3]), tuple(near))
+            self.assertEqual(tuple(directions[3 * i:3 * i + 3]),
+                             tuple(far - near))
+        flat = []
+        for p in self.pixels:
+            flat.extend([p.x, p.y])
+        self.assertEqual(eu.unproject_rays(flat, vp, 800, 600),
+                         (origins, directions))
+        self.assertEqual(eu.unproject_rays([], vp, 800, 600),
+                         (array.array('d'), array.array('d')))
+
+    def test_inverse(self):
+        c = self.camera
+        a = eu.unproject_rays(self.pixels, c.view_projection, 800, 600)
+        b = eu.unproject_rays(self.pixels, c.inverse_view_projection, 800, 600,
+                              inverse=True)
+        for x, y in zip(a[0] + a[1], b[0] + b[1]):
+            self.assertAlmostEqual(x, y, 6)
+
+    def test_sequence(self):
+        origins, directions = eu.unproject_rays(
+            self.pixels, self.camera.view_projection, 800, 600)
+        rays = eu.Ray3Sequence(origins, directions)
+        self.assertEqual(len(rays), 50)
+        self.assertTrue(isinstance(rays[0], eu.Ray3))
+        self.assertEqual(tuple(rays[-1].p), tuple(origins[-3:]))
+        self.assertEqual(tuple(rays[-1].v), tuple(directions[-3:]))
+        self.assertRaises(IndexError, lambda: rays[50])
+        listed = list(rays)
+        self.assertEqual(len(listed), 50)
+        for part in (rays[10:20], rays[::7], rays[-5:]):
+            self.assertTrue(isinstance(part, eu.Ray3Sequence))
+        for key in (slice(10, 20), slice(None, None, 7), slice(-5, None)):
+            self.assertEqual([repr(r) for r in rays[key]],
+                             [repr(r) for r in listed[key]])
+        picked = self.camera.pick_rays(self.pixels, 800, 600)
+        self.assertTrue(isinstance(picked, eu.Ray3Sequence))
+
+class Test_MatrixStack(unittest.TestCase):
+    def operations(self):
+        rnd = random.Random(7)
+        axis = eu.Vector3(1., 2., -3.)
+        x, y, z = eu.Vector3(0., 1., 0.), eu.Vector3(-1., 0., 0.), \
+                  eu.Vector3(0., 0., 1.)
+        for i in range(3):
+            yield 'translate', (rnd.uniform(-5, 5), 2., -1.)
+            yield 'scale', (rnd.uniform(0.5, 2), 2., 3.)
+            yield 'rotatex', (rnd.uniform(0, 6),)
+            yield 'rotatey', (rnd.uniform(0, 6),)
+            yield 'rotatez', (rnd.uniform(0, 6),)
+            yield 'rotate_axis', (rnd.uniform(0, 6), axis)
+            yield 'rotate_euler', (rnd.uniform(0, 6), 0.5, -1.)
+            yield 'rotate_triple_axis', (x, y, z)
+
+    def test_operations(self):
+        stack = eu.MatrixStack(4)
+        M = eu.Matrix4()
+        self.assertEqual(list(stack.top), M[:])
+        for name, args in self.operations():
+            self.assertTrue(getattr(stack, name)(*args) is stack)
+            getattr(M, name)(*args)
+            self.assertEqual(list(stack.top), M[:])
+        N = eu.Matrix4.new_rotate_axis(1., eu.Vector3(1., 1., 0.))
+        N.translate(1., 2., 3.)
+        stack.multiply(N)
+        M *= N
+        self.assertEqual(list(stack.top), M[:])
+        self.assertEqual(stack.get_matrix()[:], M[:])
+        stack.load(N)
+        self.assertEqual(list(stack.top), N[:])
+        stack.identity()
+        self.assertEqual(list(stack.top), eu.Matrix4()[:])
+
+    def test_push_pop(self):
+        stack = eu.MatrixStack(3)
+        data = stack.data
+        self.assertEqual(len(stack), 1)
+        self.assertEqual(stack.capacity, 3)
+        self.assertRaises(IndexError, stack.pop)
+        stack.translate(1., 2., 3.)
+        top = stack.top
+        stack.push().rotatez(1.)
+        self.assertEqual(len(stack), 2)
+        stack.push().scale(2., 2., 2.)
+        self.assertRaises(IndexError, stack.push)
+        self.assertEqual(len(stack), 3)
+        stack.pop().pop()
+        self.assertEqual(len(stack), 1)
+        self.assertEqual(list(stack.top),
+                         eu.Matrix4.new_translate(1., 2., 3.)[:])
+        self.assertTrue(stack.data is data)
+        stack.scale(2., 1., 1.)
+        self.assertEqual(top[0], 2.)
+
+class Test_Expr(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2)
+        def vector():
+            return eu.Vector3(*[rnd.uniform(-10, 10) for i in range(3)])
+        self.vectors = [vector() for i in range(12)]
+
+    def assertSame(self, a, b):
+        self.assertEqual(a.__class__, b.__class__)
+        self.assertEqual(repr(a), repr(b))
+        if isinstance(a, eu.Vector3):
+            self.assertEqual(tuple(a), tuple(b))
+        else:
+            self.assertEqual(a, b)
+
+    def test_vectors(self):
+        up = eu.Vector3(0., 0., 1.)
+        functions = [
+            lambda a, b, s, c, d: a + b * s - c.cross(d),
+            lambda a, b, s, c, d: (a - b).normalized() * abs(c) / s,
+            lambda a, b, s, c, d: a.dot(b) * 2 - d.magnitude_squared() + s,
+            lambda a, b, s, c, d: -a * b + 1 / s * c.cross(up) - (+d),
+            lambda a, b, s, c, d: (c - c).normalized() * d.magnitude(),
+        ]
+        a, b, c, d = self.vectors[:4]
+        for function in functions:
+            f = eu.expr(function)
+            self.assertSame(f(a, b, 2.5, c, d), function(a, b, 2.5, c, d))
+            self.assertSame(f(d, c, 3, b, a), function(d, c, 3, b, a))
+
+    def test_points(self):
+        f = eu.expr(lambda a, b: a - b)
+        p = eu.Point3(1., 2., 3.)
+        q = eu.Point3(0., 1., 1.)
+        v = eu.Vector3(1., 1., 1.)
+        for args in [(p, q), (p, v), (v, v)]:
+            self.assertSame(f(*args), args[0] - args[1])
+        self.assertEqual(len(f._compiled), 3)
+
+    def test_normalized_points(self):
+        # A zero length Point3 normalizes to a Point3, others to Vector3
+        functions = [
+            lambda a, b: a.normalized(),
+            lambda a, b: a.normalized().normalized(),
+            lambda a, b: a.normalized() - b,
+            lambda a, b: b + a.normalized(),
+            lambda a, b: a.normalized() * b,
+            lambda a, b: a.normalized() * 2.,
+        ]
+        zero = eu.Point3(0., 0., 0.)
+        p = eu.Point3(1., 2., 2.)
+        v = eu.Vector3(0., 3., 4.)
+        for function in functions:
+            f = eu.expr(function)
+            for args in [(zero, p), (zero, v), (p, p), (p, v),
+                         (eu.Vector3(), v)]:
+                self.assertSame(f(*args), function(*args))
+
+    def test_arrays(self):
+        function = lambda a, b, s, c: a + b * s - c.cross(b)
+        f = eu.expr(function)
+        a = self.vectors[:6]
+        c = self.vectors[6:]
+        b = eu.Vector3(1., 2., 3.)
+        out = f(eu.pack_points3(a), b, 0.5, c)
+        self.assertTrue(isinstance(out, array.array))
+        self.assertEqual(len(out), 18)
+        for i in range(6):
+            self.assertEqual(tuple(out[3 * i:3 * i + 3]),
+                             tuple(function(a[i], b, 0.5, c[i])))
+        dot = eu.expr(lambda a, b: a.dot(b))
+        out = dot(a, c)
+        self.assertEqual(list(out), [a[i].dot(c[i]) for i in range(6)])
+        self.assertRaises(ValueError, f, a, b, 0.5, c[:3])
+        three = eu.expr(lambda a, b, c: a + b - c)
+        out = three(a, c, a)
+        self.assertEqual(list(out), list(eu.pack_points3(
+            [a[i] + c[i] - a[i] for i in range(6)])))
+        self.assertRaises(ValueError, three, a, c, a[:2])
+        self.assertRaises(ValueError, three, a, c[:2], a)
+
+    def test_errors(self):
+        a = self.vectors[0]
+        self.assertRaises(TypeError, eu.expr(lambda a: a if a else -a), a)
+        self.assertRaises(TypeError, eu.expr(lambda a: a.dot(2)), a)
+        self.assertRaises(TypeError, eu.expr(lambda a, s: a + s), a, 1.)
+        self.assertRaises(TypeError, eu.expr(lambda a: 'a'), a)
+        f = eu.expr(lambda a, b: a + b)
+        self.assertRaises(TypeError, f, a, eu.Vector2(1., 2.))
+        self.assertRaises(TypeError, f, a, eu.Point2(1., 2.))
+        self.assertRaises(TypeError, f, a, eu.Quaternion())
+        out = f(eu.Vector3Array([a]), a)
+        self.assertEqual(tuple(out), tuple(eu.Vector3Array([a])[0] + a))
+
+    def test_constants(self):
+        offset = eu.Vector3(1., 0., 0.)
+        s = 2.
+        f = eu.expr(lambda a: a * s + offset)
+        a = self.vectors[0]
+        self.assertSame(f(a), a * 2. + offset)
+        # numbers are fixed when traced; vectors are read on each call
+        s = 3.
+        offset.x = 5.
+        self.assertSame(f(a), a * 2. + offset)
+
+    def test_specialize(self):
+        f = eu.expr(lambda a, s: a * s)
+        a = self.vectors[0]
+        compiled = f.specialize(a, 2.)
+        self.assertTrue(f.specialize(a, 3.) is compiled)
+        self.assertSame(compiled(a, 2.), a * 2.)
+
+class Test_Borrowed(unittest.TestCase):
+    def test_new_borrowed(self):
+        cases = [
+            (eu.Line2, eu.Point2(1., 2.), eu.Vector2(3., 4.)),
+            (eu.Ray2, eu.Point2(1., 2.), eu.Vector2(3., 4.)),
+            (eu.LineSegment2, eu.Point2(1., 2.), eu.Vector2(3., 4.)),
+            (eu.Line3, eu.Point3(1., 2., 3.), eu.Vector3(4., 5., 6.)),
+            (eu.Ray3, eu.Point3(1., 2., 3.), eu.Vector3(4., 5., 6.)),
+            (eu.LineSegment3, eu.Point3(1., 2., 3.), eu.Vector3(4., 5., 6.)),
+        ]
+        for cls, p, v in cases:
+            L = cls.new_borrowed(p, v)
+            self.assertTrue(L.__class__ is cls)
+            self.assertTrue(L.p is p and L.v is v)
+            self.assertEqual(repr(L), repr(cls(p, v)))
+            self.assertEqual(L.bounds, cls(p, v).bounds)
+        for cls, c in [(eu.Circle, eu.Point2(1., 2.)),
+                       (eu.Sphere, eu.Point3(1., 2., 3.))]:
+            B = cls.new_borrowed(c, 2.)
+            self.assertTrue(B.c is c)
+            self.assertEqual(repr(B), repr(cls(c, 2.)))
+            self.assertEqual(B.bounds, cls(c, 2.).bounds)
+
+    def test_new_many(self):
+        lines = eu.LineSegment2.new_many(array.array('d', [0, 0, 1, 1,
+                                                           2, 2, -1, 0]))
+        self.assertEqual([repr(L) for L in lines],
+                         [repr(eu.LineSegment2(eu.Point2(0., 0.),
+                                               eu.Vector2(1., 1.))),
+                          repr(eu.LineSegment2(eu.Point2(2., 2.),
+                                               eu.Vector2(-1., 0.)))])
+        lines = eu.Line3.new_many([1, 2, 3, 4, 5, 6])
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(isinstance(lines[0].p, eu.Point3))
+        self.assertTrue(isinstance(lines[0].v, eu.Vector3))
+        self.assertEqual(tuple(lines[0].v), (4, 5, 6))
+        self.assertEqual(eu.Line3.new_many([]), [])
+        circles = eu.Circle.new_many([1, 2, 3])
+        self.assertEqual(repr(circles[0]),
+                         repr(eu.Circle(eu.Point2(1., 2.), 3.)))
+        spheres = [eu.Sphere(eu.Point3(1., 2., 3.), 4.),
+                   eu.Sphere(eu.Point3(-1., 0., 5.), 0.5)]
+        again = eu.Sphere.new_many(eu.pack_spheres(spheres))
+        self.assertEqual([repr(S) for S in again], [repr(S) for S in spheres])
+        ray = eu.Ray3(eu.Point3(0., 0., 5.), eu.Vector3(0., 0., -1.))
+        self.assertEqual(repr(again[0].intersect(ray)),
+                         repr(spheres[0].intersect(ray)))
+
+    def test_new_many_lines3(self):
+        rays = [eu.Ray3(eu.Point3(1., 2., 3.), eu.Vector3(0., 1., 0.)),
+                eu.Ray3(eu.Point3(-1., 0., 5.), eu.Vector3(2., 0., 1.))]
+        again = eu.Ray3.new_many(eu.pack_lines3(rays), 8)
+        self.assertEqual([repr(L) for L in again], [repr(L) for L in rays])
+        self.assertEqual(eu.Ray3.new_many(eu.pack_lines3([]), 8), [])
+        self.assertRaises(AssertionError, eu.Line3.new_many, [0] * 7, 7)
+
+    def test_new_many_partial(self):
+        for cls, size in [(eu.Line2, 4), (eu.Circle, 3), (eu.Line3, 6),
+                          (eu.Sphere, 4), (eu.Plane, 4)]:
+            self.assertEqual(len(cls.new_many([1.] * (2 * size))), 2)
+            self.assertRaises(AttributeError, cls.new_many,
+                              [1.] * (2 * size + 1))
+            self.assertRaises(AttributeError, cls.new_many,
+                              iter([1.] * (size - 1)))
+        self.assertRaises(AttributeError, eu.Line3.new_many, [1.] * 12, 8)
+
+class Test_Planes(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(5)
+        def vector(cls=eu.Vector3):
+            return cls(*[rnd.uniform(-5, 5) for i in range(3)])
+        self.planes = [eu.Plane(vector(eu.Point3), vector())
+                       for i in range(30)]
+        self.points = [vector(eu.Point3) for i in range(30)]
+
+    def test_signed_distance_many(self):
+        for plane in self.planes[:5]:
+            d = plane.signed_distance_many(self.points)
+            self.assertEqual(len(d), len(self.points))
+            for p, dp in zip(self.points, d):
+                self.assertEqual(dp, p.dot(plane.n) - plane.k)
+                self.assertAlmostEqual(abs(dp), plane.connect(p).length)
+            self.assertEqual(
+                plane.signed_distance_many(eu.pack_points3(self.points)), d)
+
+    def check(self, matrix):
+        planes = eu.Plane.new_many(eu.transform_planes(self.planes, matrix))
+        for P, Q in zip(self.planes, planes):
+            self.assertAlmostEqual(abs(Q.n), 1.)
+            p = P._get_point()
+            t1 = P.n.cross(eu.Vector3(0., 0., 1.))
+            t2 = P.n.cross(t1)
+            on = [matrix * q for q in (p, p + t1, p + t2 * 3.)]
+            for d in Q.signed_distance_many(on):
+                self.assertAlmostEqual(d, 0.)
+            front = matrix * (p + P.n)
+            self.assertTrue(Q.signed_distance_many([front])[0] > 0)
+        return planes
+
+    def test_transform_planes(self):
+        M = eu.Matrix4.new_rotate_axis(0.7, eu.Vector3(1., 2., 3.))
+        M.translate(1., 2., 3.)
+        planes = self.check(M)
+        for P, Q in zip(self.planes, planes):
+            R = M * P
+            for a, b in zip(list(R.n) + [R.k], list(Q.n) + [Q.k]):
+                self.assertAlmostEqual(a, b)
+        S = eu.Matrix4.new_scale(2., 0.5, -3.)
+        S.translate(1., -1., 2.)
+        S.b = 0.7
+        self.check(S)
+        packed = eu.pack_planes(self.planes)
+        self.assertEqual(eu.transform_planes(packed, S),
+                         eu.transform_planes(self.planes, S))
+        self.assertRaises(AttributeError, eu.transform_planes, self.planes,
+                          eu.Matrix4.new_scale(1., 0., 1.))
+
+class Test_PointStatistics3(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(6)
+        M = eu.Matrix4.new_rotate_axis(0.8, eu.Vector3(1., 2., 0.5))
+        M.translate(1e6, -2e5, 3e5)
+        self.points = [M * eu.Point3(rnd.gauss(0, 3), rnd.gauss(0, 1),
+                                     rnd.gauss(0, 0.1)) for i in range(100)]
+        self.rotation = M
+
+    def test_statistics(self):
+        points = self.points
+        stats = eu.PointStatistics3(points)
+        self.assertEqual(stats.count, 100)
+        n = len(points)
+        mean = [sum(p[i] for p in points) / n for i in range(3)]
+        for a, b in zip(stats.centroid, mean):
+            self.assertAlmostEqual(a, b, 6)
+        C = stats.covariance()
+        rows = [[C.a, C.b, C.c], [C.e, C.f, C.g], [C.i, C.j, C.k]]
+        for i in range(3):
+            for j in range(3):
+                cij = sum((p[i] - mean[i]) * (p[j] - mean[j])
+                          for p in points) / n
+                self.assertAlmostEqual(rows[i][j], cij, 6)
+        one = eu.PointStatistics3()
+        for p in points:
+            one.add(p)
+        self.assertEqual(repr(one.covariance()), repr(C))
+        flat = eu.PointStatistics3(eu.pack_points3(points))
+        self.assertEqual(flat.centroid, stats.centroid)
+        merged = eu.PointStatistics3(points[:30])
+        merged.merge(eu.PointStatistics3(points[30:]))
+        self.assertEqual(merged.count, 100)
+        self.assertAlmostEqual(merged.cxx, stats.cxx, 6)
+        self.assertAlmostEqual(merged.cyz, stats.cyz, 6)
+        self.assertRaises(AttributeError, eu.PointStatistics3().covariance)
+
+    def test_principal_axes(self):
+        stats = eu.PointStatistics3(self.points)
+        C = stats.covariance()
+        axes = stats.principal_axes()
+        self.assertTrue(axes[0][0] >= axes[1][0] >= axes[2][0])
+        for variance, v in axes:
+            self.assertAlmostEqual(abs(v), 1.)
+            Cv = eu.Vector3(C.a * v.x + C.b * v.y + C.c * v.z,
+                            C.e * v.x + C.f * v.y + C.g * v.z,
+                            C.i * v.x + C.j * v.y + C.k * v.z)
+            self.assertAlmostEqual(abs(Cv - v * variance), 0., 9)
+        x, y, z = [v for variance, v in axes]
+        self.assertAlmostEqual(x.cross(y).dot(z), 1.)
+        # The widest spread is along the rotated x axis
+        widest = self.rotation * eu.Vector3(1., 0., 0.)
+        self.assertAlmostEqual(abs(x.dot(widest)), 1., 2)
+
+class Test_OBB3(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(8)
+
+    def box(self):
+        rnd = self.rnd
+        R = eu.Matrix4.new_rotate_euler(rnd.uniform(0, 6), rnd.uniform(0, 6),
+                                        rnd.uniform(0, 6))
+        axes = [eu.Vector3(R.a, R.e, R.i), eu.Vector3(R.b, R.f, R.j),
+                eu.Vector3(R.c, R.g, R.k)]
+        center = eu.Point3(*[rnd.uniform(-3, 3) for i in range(3)])
+        return eu.OBB3(center, axes, [rnd.uniform(0.2, 2) for i in range(3)])
+
+    def test_new_bounding(self):
+        rnd = self.rnd
+        M = eu.Matrix4.new_rotate_axis(1.1, eu.Vector3(0., 1., 1.))
+        M.translate(5., 0., -5.)
+        points = [M * eu.Point3(rnd.uniform(-4, 4), rnd.uniform(-1, 1),
+                                rnd.uniform(-.5, .5)) for i in range(200)]
+        box = eu.OBB3.new_bounding(points)
+        for p in points:
+            local = box._local(p)
+            for d, e in zip(local, box.half_extents):
+                self.assertTrue(abs(d) <= e + 1e-9)
+        e = box.half_extents
+        self.assertTrue(e[0] > e[1] > e[2])
+        self.assertTrue(e[0] < 4.01 and e[2] < 0.75)
+        for corner in box._corners():
+            self.assertTrue(box.bounds.contains(corner))
+
+    def test_overlaps(self):
+        # Against the distance between the boxes found by GJK
+        for i in range(300):
+            A = self.box()
+            B = self.box()
+            distance = eu.gjk_distance(A, B)
+            if abs(distance) > 1e-6:
+                self.assertEqual(A.intersect(B), distance <= 0)
+                self.assertEqual(eu.intersect(A, B), distance <= 0)
+        A = eu.AABB3(eu.Point3(0., 0., 0.), eu.Point3(1., 1., 1.))
+        axes = [eu.Vector3(1., 0., 0.), eu.Vector3(0., 1., 0.),
+                eu.Vector3(0., 0., 1.)]
+        B = eu.OBB3(eu.Point3(1.5, 0.5, 0.5), axes, [0.6, 0.1, 0.1])
+        self.assertTrue(B.overlaps(A) and A.intersect(B) and B.intersect(A))
+        B = eu.OBB3(eu.Point3(1.7, 0.5, 0.5), axes, [0.6, 0.1, 0.1])
+        self.assertFalse(B.overlaps(A) or A.intersect(B))
+        S = eu.Sphere(eu.Point3(2.5, 0.5, 0.5), 0.25)
+        self.assertTrue(S.intersect(B) and B.intersect(S))
+        S = eu.Sphere(eu.Point3(2.5, 0.5, 0.8), 0.25)
+        self.assertFalse(B.intersect(S))
+        P = eu.Plane(eu.Vector3(1., 0., 0.), 2.2)
+        self.assertTrue(P.intersect(B) and B.intersect(P))
+        self.assertFalse(B.intersect(eu.Plane(eu.Vector3(1., 0., 0.), 2.4)))
+        self.assertTrue(eu.Point3(2., 0.5, 0.5).intersect(B))
+        self.assertFalse(B.intersect(eu.Point3(2., 0.7, 0.5)))
+
+    def test_intersect_line3(self):
+        rnd = self.rnd
+        for i in range(200):
+            B = self.box()
+            ray = eu.Ray3(eu.Point3(*[rnd.uniform(-6, 6) for j in range(3)]),
+                          eu.Vector3(*[rnd.uniform(-1, 1) for j in range(3)]))
+            segment = ray.intersect(B)
+            self.assertEqual(repr(B.intersect(ray)), repr(segment))
+            if segment is None:
+                for k in range(100):
+                    self.assertFalse(B.contains(ray.p + ray.v * (k * 0.2)))
+            else:
+                self.assertTrue(B.contains(segment.p + segment.v * 0.5))
+                for q in (segment.p, segment.p2):
+                    self.assertTrue(max(abs(d) - e for d, e in
+                                        zip(B._local(q), B.half_extents))
+                                    < 1e-9)
+
+    def test_transform(self):
+        B = self.box()
+        M = eu.Matrix4.new_rotatez(0.5)
+        M.translate(1., 2., 3.)
+        T = M * B
+        for a, b in zip(T._corners(), [M * p for p in B._corners()]):
+            self.assertAlmostEqual(abs(a - b), 0.)
+        T = eu.Matrix4.new_scale(2., 2., 2.) * B
+        for a, b in zip(T.half_extents, B.half_extents):
+            self.assertAlmostEqual(a, 2 * b)
+
 if __name__ == '__main__':
     unittest.main()